@@ -0,0 +1,307 @@
+import os
+import json
+import asyncio
+from urllib.parse import parse_qs
+import httpx
+from telegram import InputMedia, Message, Update
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from botcore.config import (
+    ASGI_HTTP_POOL_SIZE, ASGI_HTTP_TIMEOUT, GRAPH_API_URL, GRAPH_CONNECT_TIMEOUT, IMAGE_DOWNLOAD_WAIT,
+    MESSENGER_QUEUE_DRAIN_TIMEOUT, PAGE_ACCESS_TOKEN, RATE_LIMIT_MAX_RETRIES, SENDER_NAME_WAIT, TELEGRAM_API_URL,
+    TELEGRAM_TOKEN, WEBHOOK_REGISTER_RETRY
+)
+from botcore.flows import run_flow_async, spawn_task, spawned_tasks
+from botcore.images import image_cache
+from botcore.messenger import (
+    handle_messenger_batch, pending_user_name, prefetch_user_name, sender_names, verify_subscription
+)
+from botcore.metrics import metrics, timed_calls_async
+from botcore.ratelimit import graph_reserve, observe_graph_response, rate_limited_async, should_retry
+from botcore.startup import readiness, webhook_registration
+from botcore.sweeper import state_sweeper
+from botcore.tracing import is_admin, profiler, traced
+from botcore.scheduler import publish_scheduler
+from botcore.validation import (
+    create_draft, handle_update, publish_jobs, start_publish_scheduler, telegram_post_message_for_validation
+)
+from botcore.web import metrics_text, profile_seconds, stats_snapshot
+
+# Point d'entrée ASGI (uvicorn asgi:app, ou gunicorn -k uvicorn.workers.UvicornWorker asgi:app) :
+# les deux webhooks tournent sur une seule boucle asyncio. Mêmes dialogues (botcore.validation),
+# même flux de conversation Messenger et même état que les applications Flask, mais les appels
+# Telegram et Graph passent par un client HTTP asynchrone (httpx) au lieu d'occuper un thread
+# par requête. application.py reste le point d'entrée WSGI simple.
+
+# ----------------------------- CLIENT HTTP ASYNCHRONE -------------------------------
+_http = None
+
+def get_http_client():
+    # Créé dans la boucle du serveur au premier appel, fermé au shutdown (lifespan)
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            timeout=httpx.Timeout(ASGI_HTTP_TIMEOUT, connect=GRAPH_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=ASGI_HTTP_POOL_SIZE, max_keepalive_connections=ASGI_HTTP_POOL_SIZE)
+        )
+    return _http
+
+async def telegram_request(method, params, files=None):
+    url = f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/{method}"
+    if files:
+        # multipart : les champs structurés (media, reply_markup) sont encodés en JSON
+        data = {key: value if isinstance(value, str) else json.dumps(value) for key, value in params.items()}
+        resp = await get_http_client().post(url, data=data, files=files)
+    else:
+        resp = await get_http_client().post(url, json=params)
+    payload = resp.json()
+    if payload.get("ok"):
+        return payload["result"]
+    # Mêmes exceptions que python-telegram-bot : les dialogues les interceptent telles quelles
+    description = payload.get("description", f"HTTP {resp.status_code}")
+    retry_after = payload.get("parameters", {}).get("retry_after")
+    if retry_after is not None:
+        raise RetryAfter(retry_after)
+    if payload.get("error_code") == 400:
+        raise BadRequest(description)
+    raise TelegramError(description)
+
+def upload_file(value):
+    # Fichier ouvert (send_photo) ou InputFile de python-telegram-bot (InputMediaPhoto)
+    if hasattr(value, "input_file_content"):
+        return (value.filename, value.input_file_content, value.mimetype)
+    return (os.path.basename(getattr(value, "name", "photo.jpg")), value.read(), "image/jpeg")
+
+def is_file(value):
+    return hasattr(value, "read") or hasattr(value, "input_file_content")
+
+def telegram_params(kwargs):
+    # Arguments d'une méthode du Bot -> champs de l'API HTTP Bot (+ fichiers multipart)
+    params = {}
+    files = {}
+    for key, value in kwargs.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)) and value and isinstance(value[0], InputMedia):
+            medias = []
+            for item in value:
+                media = {"type": item.type, "media": item.media}
+                if is_file(item.media):
+                    name = f"file{len(files)}"
+                    files[name] = upload_file(item.media)
+                    media["media"] = f"attach://{name}"
+                if getattr(item, "caption", None):
+                    media["caption"] = item.caption
+                medias.append(media)
+            value = medias
+        elif is_file(value):
+            files[key] = upload_file(value)
+            continue
+        elif hasattr(value, "to_dict"):
+            value = value.to_dict()
+        params[key] = value
+    return params, files
+
+def telegram_result(result):
+    if isinstance(result, list):
+        return [telegram_result(item) for item in result]
+    if isinstance(result, dict) and "message_id" in result:
+        return Message.de_json(result, None)
+    return result
+
+async def bot_api_call(step):
+    # tg.send_message(...) -> POST sendMessage, résultat en objets Telegram
+    head, *rest = step.method.split("_")
+    params, files = telegram_params(step.kwargs)
+    return telegram_result(await telegram_request(head + "".join(word.title() for word in rest), params, files))
+
+# Client des dialogues, derrière le même limiteur que les applications Flask
+call_telegram = rate_limited_async(timed_calls_async(bot_api_call))
+
+async def graph_call(method, path, **kwargs):
+    url = f"{GRAPH_API_URL}/{path}"
+    for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+        delay = graph_reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        resp = await get_http_client().request(method, url, **kwargs)
+        retry_after = observe_graph_response(resp)
+        if not should_retry(retry_after, attempt):
+            return resp
+        print(f"Graph API limite le débit, nouvel essai dans {retry_after:.0f}s")
+
+# ----------------------------- RÉPONSES MESSENGER -------------------------------
+# Dernier envoi en cours par destinataire : chaque réponse attend la précédente, l'ordre est conservé
+_reply_chains = {}
+
+@metrics.timed("autopost_outbound_call", call="messenger_send")
+async def send_reply(recipient_id, text):
+    params = {"access_token": PAGE_ACCESS_TOKEN}
+    data = {"recipient": {"id": recipient_id}, "message": {"text": text}}
+    resp = await graph_call("POST", "v17.0/me/messages", params=params, json=data)
+    if resp.status_code >= 400:
+        print("Erreur Messenger:", resp.status_code, resp.text)
+        return False
+    return True
+
+async def deliver_reply(previous, recipient_id, text):
+    if previous is not None:
+        await asyncio.wait({previous})
+    await send_reply(recipient_id, text)
+
+def reply_to_messenger(recipient_id, text):
+    task = spawn_task(deliver_reply(_reply_chains.get(recipient_id), recipient_id, text), "réponse Messenger")
+    _reply_chains[recipient_id] = task
+
+    def done(task):
+        if _reply_chains.get(recipient_id) is task:
+            del _reply_chains[recipient_id]
+
+    task.add_done_callback(done)
+
+# ----------------------------- SOUMISSION DES BROUILLONS -------------------------------
+async def get_user_name(sender_id):
+    name = sender_names.get(sender_id)
+    if name:
+        return name
+    # Même recherche que les applications Flask (pool name_lookups), attendue sans bloquer la boucle
+    prefetch_user_name(sender_id)
+    pending = pending_user_name(sender_id)
+    if pending:
+        try:
+            name = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(pending)), SENDER_NAME_WAIT)
+        except Exception:
+            name = None
+    return name or sender_names.get(sender_id) or f"ID {sender_id}"
+
+@traced("submit_draft", detached=True)
+async def submit_draft(sender_id, buffer):
+    sender_name = await get_user_name(sender_id)
+    pending = [asyncio.wrap_future(fut) for fut in image_cache.pending(buffer["photos"])]
+    if pending:
+        await asyncio.wait(pending, timeout=IMAGE_DOWNLOAD_WAIT)
+    draft = create_draft(sender_id, buffer, sender_name, image_cache.wait(buffer["photos"], 0))
+    await run_flow_async(telegram_post_message_for_validation(draft), call_telegram)
+    return draft
+
+def submit_draft_in_background(sender_id, buffer):
+    spawn_task(submit_draft(sender_id, buffer), "soumission du brouillon")
+
+async def register_webhook():
+    # Même inscription que les applications Flask (marqueur du déploiement, bail), sur la boucle
+    if not webhook_registration.enabled():
+        return
+    while True:
+        try:
+            if await run_flow_async(webhook_registration.register(), call_telegram):
+                return
+        except Exception as e:
+            webhook_registration.failed(e)
+        await asyncio.sleep(WEBHOOK_REGISTER_RETRY)
+
+# ----------------------------- APPLICATION ASGI -------------------------------
+async def read_body(receive):
+    body = b""
+    more_body = True
+    while more_body:
+        event = await receive()
+        body += event.get("body", b"")
+        more_body = event.get("more_body", False)
+    return body
+
+async def respond(send, status, payload):
+    if isinstance(payload, (dict, list)):
+        body = json.dumps(payload).encode("utf-8")
+        content_type = b"application/json"
+    else:
+        body = str(payload).encode("utf-8")
+        content_type = b"text/plain; charset=utf-8"
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", content_type)]})
+    await send({"type": "http.response.body", "body": body})
+
+@metrics.timed("autopost_handler", handler="messenger")
+@traced("receive")
+async def messenger_webhook(body):
+    state_sweeper.ensure_started()
+    # Sur la boucle : les réponses et la soumission du brouillon partent en tâches asynchrones
+    handle_messenger_batch(json.loads(body or b"{}"), submit_draft_in_background, reply_to_messenger)
+    return 200, {"ok": True}
+
+@metrics.timed("autopost_handler", handler="telegram")
+@traced("telegram_webhook")
+async def telegram_webhook(body):
+    state_sweeper.ensure_started()
+    await run_flow_async(handle_update(Update.de_json(json.loads(body or b"{}"), None)), call_telegram)
+    return 200, "OK"
+
+async def route(method, path, query, body, headers):
+    if path == "/webhook" and method == "GET":
+        challenge, status = verify_subscription(query)
+        return status, challenge or ""
+    if path == "/webhook" and method == "POST":
+        return await messenger_webhook(body)
+    if path == "/telegram-webhook" and method == "POST":
+        return await telegram_webhook(body)
+    if path == "/stats" and method == "GET":
+        return 200, {**stats_snapshot(), "asgi": {"background_tasks": len(spawned_tasks())}}
+    if path == "/ready" and method == "GET":
+        status = readiness.status()
+        return 200 if status["ready"] else 503, status
+    if path == "/metrics" and method == "GET":
+        return 200, metrics_text()
+    if path == "/admin/profile" and method == "GET":
+        # Le profileur échantillonne tous les threads du processus, boucle asyncio comprise
+        if not is_admin(headers.get("x-admin-token")):
+            return 404, "Not Found"
+        try:
+            seconds = profile_seconds(query.get("seconds", 10))
+        except ValueError:
+            return 400, "Bad Request"
+        try:
+            return 200, await asyncio.get_running_loop().run_in_executor(None, profiler.run, seconds)
+        except RuntimeError as e:
+            return 409, str(e)
+    return 404, "Not Found"
+
+async def lifespan(receive, send):
+    while True:
+        event = await receive()
+        if event["type"] == "lifespan.startup":
+            readiness.ensure_started()
+            state_sweeper.ensure_started()
+            # Le planificateur (thread) publie sur cette boucle ; l'upload Graph passe par publish_jobs
+            loop = asyncio.get_running_loop()
+            start_publish_scheduler(
+                lambda flow: asyncio.run_coroutine_threadsafe(run_flow_async(flow, call_telegram, publish_jobs), loop)
+            )
+            # Inscription du webhook en arrière-plan : le démarrage n'attend pas Telegram
+            spawn_task(register_webhook(), "configuration webhook Telegram")
+            await send({"type": "lifespan.startup.complete"})
+        elif event["type"] == "lifespan.shutdown":
+            # Plus de sortie de file ; laisse finir les envois et publications en cours avant de fermer le client HTTP
+            publish_scheduler.stop()
+            pending = spawned_tasks()
+            if pending:
+                await asyncio.wait(pending, timeout=MESSENGER_QUEUE_DRAIN_TIMEOUT)
+            if _http is not None:
+                await _http.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    body = await read_body(receive)
+    query = {key: values[0] for key, values in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+    headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope.get("headers", [])}
+    try:
+        status, payload = await route(scope["method"], scope["path"], query, body, headers)
+    except json.JSONDecodeError:
+        status, payload = 400, "Bad Request"
+    except Exception as e:
+        print("Erreur webhook :", e)
+        status, payload = 500, "Internal Server Error"
+    await respond(send, status, payload)
@@ -0,0 +1,348 @@
+import sys
+import json
+import zlib
+import struct
+import time
+import random
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# Faux serveurs Graph API et API Bot Telegram pour les benchmarks, sans dépendance externe.
+# Latence, taux d'erreur et limites de débit sont réglables ; les messages envoyés au faux
+# Telegram sont gardés pour que bench/loadgen.py retrouve les brouillons à valider.
+#
+#   python bench/fake_servers.py --graph-port 8081 --telegram-port 8082 --latency 0.05 --error-rate 0.01
+#
+# L'application testée pointe dessus avec :
+#   GRAPH_API_URL=http://127.0.0.1:8081 TELEGRAM_API_URL=http://127.0.0.1:8082
+
+def noise_png(seed, size):
+    # PNG RVB de bruit, déterministe par URL : contenu et empreintes distincts d'une photo à l'autre,
+    # taille proche de size octets (le bruit ne se compresse pas)
+    rnd = random.Random(seed)
+    side = max(16, int((size / 3) ** 0.5))
+    rows = b"".join(b"\x00" + rnd.randbytes(side * 3) for _ in range(side))
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    header = struct.pack(">IIBBBBB", side, side, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows, 1)) + chunk(b"IEND", b"")
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        # Renvoie 0 si la requête passe, sinon l'attente conseillée (secondes)
+        if self.rate <= 0:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def usage(self):
+        if self.rate <= 0:
+            return 0
+        with self._lock:
+            return int(100 * (1 - self.tokens / self.burst))
+
+
+class FakeAPI:
+    def __init__(self, latency, jitter, error_rate, rate, burst):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.bucket = TokenBucket(rate, burst)
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._next_id = 1000
+
+    def next_id(self):
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    def count(self, key):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+    def failing(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+def parse_body(headers, body):
+    # JSON (requests, httpx), formulaire urlencodé ou multipart (upload de fichiers)
+    content_type = headers.get("Content-Type", "")
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=HTTP).parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+        fields = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                fields[name] = {"filename": part.get_filename(), "size": len(part.get_payload(decode=True) or b"")}
+            else:
+                fields[name] = part.get_content() if part.get_content_maintype() == "text" else part.get_payload(decode=True).decode()
+        return fields
+    return {key: values[-1] for key, values in parse_qs(body.decode("utf-8")).items()}
+
+
+class BenchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    api = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, payload, headers=None, content_type="application/json"):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_any(self):
+        url = urlsplit(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            params = dict(query, **parse_body(self.headers, body))
+        except ValueError:
+            return self.reply(400, {"error": "bad body"})
+        self.route(self.command, url.path, params)
+
+    do_GET = do_POST = do_DELETE = handle_any
+
+
+# ----------------------------- FAUX GRAPH API -------------------------------
+class GraphHandler(BenchHandler):
+    def route(self, method, path, params):
+        parts = [part for part in path.split("/") if part]
+        if parts and parts[0].startswith("v") and parts[0][1:].replace(".", "").isdigit():
+            parts = parts[1:]
+        if parts and parts[0] == "img":
+            # Images des pièces jointes Messenger : environ ?size= octets, contenu unique par URL
+            self.api.count("image")
+            return self.reply(200, noise_png(path, int(params.get("size", 50000))), content_type="image/png")
+        if parts == ["_bench", "stats"]:
+            return self.reply(200, self.api.stats())
+
+        self.api.delay()
+        retry_after = self.api.bucket.take()
+        usage = {"X-App-Usage": json.dumps({"call_count": self.api.bucket.usage(), "total_time": 0, "total_cputime": 0})}
+        if retry_after:
+            self.api.count("throttled")
+            return self.reply(400, {"error": {"message": "Application request limit reached", "type": "OAuthException", "code": 4}},
+                              {"Retry-After": str(int(retry_after) + 1), **usage})
+        if self.api.failing():
+            self.api.count("errors")
+            return self.reply(500, {"error": {"message": "An unexpected error has occurred.", "type": "OAuthException", "code": 2}}, usage)
+
+        if method == "POST" and not parts and "batch" in params:
+            self.api.count("batch")
+            return self.reply(200, [self.batch_item(op) for op in json.loads(params["batch"])], usage)
+        if method == "POST" and parts[-2:] == ["me", "messages"]:
+            self.api.count("messages")
+            return self.reply(200, {"recipient_id": params.get("recipient", {}).get("id"), "message_id": f"m_{self.api.next_id()}"}, usage)
+        if method == "POST" and len(parts) == 2 and parts[1] == "photos":
+            self.api.count("photos")
+            return self.reply(200, {"id": str(self.api.next_id())}, usage)
+        if method == "POST" and len(parts) == 2 and parts[1] == "feed":
+            self.api.count("feed")
+            return self.reply(200, {"id": f"{parts[0]}_{self.api.next_id()}"}, usage)
+        if method == "DELETE":
+            self.api.count("delete")
+            return self.reply(200, {"success": True}, usage)
+        if method == "GET" and len(parts) == 2 and parts[1] in ("feed", "scheduled_posts"):
+            # Vérification d'une publication reprise : aucun post existant
+            self.api.count("feed_check")
+            return self.reply(200, {"data": []}, usage)
+        if method == "GET" and not parts and "ids" in params:
+            self.api.count("lookup")
+            return self.reply(200, {object_id: {"id": object_id} for object_id in params["ids"].split(",")}, usage)
+        if method == "GET" and len(parts) == 1:
+            self.api.count("profile")
+            return self.reply(200, {"id": parts[0], "first_name": "Bench", "last_name": parts[0][-4:]}, usage)
+        self.api.count("unknown")
+        return self.reply(404, {"error": {"message": f"Unknown path {path}", "code": 803}})
+
+    def batch_item(self, op):
+        name = op.get("relative_url", "")
+        if name.endswith("/photos"):
+            body = {"id": str(self.api.next_id())}
+        elif name.endswith("/feed"):
+            body = {"id": f"{name.split('/')[0]}_{self.api.next_id()}"}
+        else:
+            body = {"success": True}
+        return {"code": 200, "body": json.dumps(body)}
+
+
+# ----------------------------- FAUX API BOT TELEGRAM -------------------------------
+class TelegramState:
+    # Messages envoyés (consultables via /_bench/messages) et limite par chat, comme Telegram
+    def __init__(self, chat_rate, chat_burst):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.messages = []
+        self.webhook_url = ""
+        self._chats = {}
+        self._lock = threading.Lock()
+
+    def chat_bucket(self, chat_id):
+        with self._lock:
+            if chat_id not in self._chats:
+                self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            return self._chats[chat_id]
+
+    def record(self, message):
+        with self._lock:
+            self.messages.append(message)
+
+    def since(self, after):
+        with self._lock:
+            return [m for m in self.messages if m["message_id"] > after]
+
+
+class TelegramHandler(BenchHandler):
+    state = None
+
+    def route(self, method, path, params):
+        parts = [part for part in path.split("/") if part]
+        if parts == ["_bench", "stats"]:
+            return self.reply(200, self.api.stats())
+        if parts == ["_bench", "messages"]:
+            return self.reply(200, self.state.since(int(params.get("after", 0))))
+        if len(parts) != 2 or not parts[0].startswith("bot"):
+            return self.reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+        api_method = parts[1]
+        if api_method == "getUpdates":
+            # Long polling d'autopost/app.py : aucune mise à jour, on rend la main après un délai
+            time.sleep(min(float(params.get("timeout") or 0), 5))
+            return self.reply(200, {"ok": True, "result": []})
+
+        self.api.delay()
+        chat_id = params.get("chat_id")
+        retry_after = self.api.bucket.take() or (chat_id is not None and self.state.chat_bucket(str(chat_id)).take())
+        if retry_after:
+            self.api.count("throttled")
+            retry_after = int(retry_after) + 1
+            return self.reply(429, {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {retry_after}",
+                                    "parameters": {"retry_after": retry_after}})
+        if self.api.failing():
+            self.api.count("errors")
+            return self.reply(500, {"ok": False, "error_code": 500, "description": "Internal Server Error"})
+        self.api.count(api_method)
+        return self.reply(200, {"ok": True, "result": self.result(api_method, params)})
+
+    def message(self, params, message_id=None, **fields):
+        reply_markup = params.get("reply_markup")
+        if isinstance(reply_markup, str):
+            reply_markup = json.loads(reply_markup)
+        message = {
+            "message_id": message_id or self.api.next_id(),
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            **fields,
+        }
+        if reply_markup:
+            message["reply_markup"] = reply_markup
+        if message_id is None:
+            self.state.record(message)
+        return message
+
+    def photo(self):
+        n = self.api.next_id()
+        return [{"file_id": f"file_{n}", "file_unique_id": f"u{n}", "width": 1280, "height": 960, "file_size": 120000}]
+
+    def result(self, api_method, params):
+        if api_method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if api_method == "setWebhook":
+            self.state.webhook_url = params.get("url", "")
+            return True
+        if api_method == "getWebhookInfo":
+            return {"url": self.state.webhook_url, "has_custom_certificate": False, "pending_update_count": 0}
+        if api_method == "sendMessage":
+            return self.message(params, text=params.get("text", ""))
+        if api_method == "sendPhoto":
+            return self.message(params, photo=self.photo(), caption=params.get("caption", ""))
+        if api_method == "sendMediaGroup":
+            media = params.get("media", [])
+            if isinstance(media, str):
+                media = json.loads(media)
+            return [self.message(params, photo=self.photo(), caption=item.get("caption", ""), media_group_id="1") for item in media]
+        if api_method in ("editMessageText", "editMessageCaption", "editMessageReplyMarkup"):
+            fields = {"text": params["text"]} if "text" in params else {"caption": params.get("caption", "")}
+            return self.message(params, message_id=int(params.get("message_id", 0)), **fields)
+        return True
+
+
+def serve(handler, port, label):
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=label, daemon=True).start()
+    print(f"{label} sur http://127.0.0.1:{server.server_port}")
+    return server
+
+
+def start_fake_servers(args):
+    graph = FakeAPI(args.latency, args.jitter, args.error_rate, args.graph_rate, args.graph_burst)
+    telegram = FakeAPI(args.latency, args.jitter, args.error_rate, args.telegram_rate, args.telegram_burst)
+    graph_handler = type("Graph", (GraphHandler,), {"api": graph})
+    telegram_handler = type("Telegram", (TelegramHandler,), {"api": telegram, "state": TelegramState(args.chat_rate, args.chat_burst)})
+    return serve(graph_handler, args.graph_port, "Faux Graph API"), serve(telegram_handler, args.telegram_port, "Faux Telegram")
+
+
+def add_arguments(parser):
+    parser.add_argument("--graph-port", type=int, default=8081)
+    parser.add_argument("--telegram-port", type=int, default=8082)
+    parser.add_argument("--latency", type=float, default=0.05, help="latence moyenne (s)")
+    parser.add_argument("--jitter", type=float, default=0.02, help="écart type de la latence (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="part des appels en erreur 500")
+    parser.add_argument("--graph-rate", type=float, default=0, help="appels/s avant le code 4 (0 = illimité)")
+    parser.add_argument("--graph-burst", type=float, default=50)
+    parser.add_argument("--telegram-rate", type=float, default=30, help="appels/s globaux avant 429")
+    parser.add_argument("--telegram-burst", type=float, default=30)
+    parser.add_argument("--chat-rate", type=float, default=1, help="appels/s par chat avant 429")
+    parser.add_argument("--chat-burst", type=float, default=20)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Faux serveurs Graph API et Telegram pour les benchmarks")
+    add_arguments(parser)
+    start_fake_servers(parser.parse_args())
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,273 @@
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+import fake_servers
+
+# Générateur de charge : rejoue des conversations Messenger complètes sur /webhook ("samir", lieu,
+# date, rafales de photos, "fin"), puis valide les brouillons reçus par le faux Telegram via
+# /telegram-webhook (modifier le lieu, supprimer une photo, valider). Affiche p50/p95/p99 et le
+# débit (événements/s) de chaque point d'entrée.
+#
+#   python bench/loadgen.py --start-fakes --conversations 200 --concurrency 20 --photos 6
+#
+# avec l'application lancée sur les faux serveurs, par exemple :
+#   GRAPH_API_URL=http://127.0.0.1:8081 TELEGRAM_API_URL=http://127.0.0.1:8082 TELEGRAM_TOKEN=123456:bench \
+#   TELEGRAM_CHAT_ID=42 PAGE_ID=1000 PAGE_ACCESS_TOKEN=bench WEBHOOK_URL=http://127.0.0.1:8000/telegram-webhook \
+#   PUBLISH_SPACING=0 PUBLISH_MAX_PER_HOUR=0 TELEGRAM_CHAT_RATE_PER_MINUTE=600 STATE_BACKEND=sqlite \
+#   gunicorn -w 2 --threads 8 -b 127.0.0.1:8000 application:app
+# (ou uvicorn asgi:app). PUBLISH_SPACING=0 et PUBLISH_MAX_PER_HOUR=0 vident la file de publication sans
+# attendre ; sans TELEGRAM_CHAT_RATE_PER_MINUTE (20 par défaut, la limite réelle d'un groupe), tous les
+# brouillons allant au même chat, le limiteur dicte le débit mesuré. Le faux Telegram suit --chat-rate.
+#
+# --save garde le rapport en JSON ; --baseline le compare à un rapport précédent et sort en erreur
+# si p95 ou le débit se dégradent de plus de --tolerance.
+# autopost/app.py reçoit Telegram en polling : seule la partie Messenger s'applique à lui.
+
+ADMIN = {"id": 4242, "is_bot": False, "first_name": "Bench"}
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+class EntryPointStats:
+    # Latence de chaque POST et nombre d'événements (messages Messenger ou mises à jour Telegram)
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.events = 0
+        self.errors = 0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def post(self, url, payload, events=1):
+        body = json.dumps(payload).encode("utf-8")
+        request = Request(url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+        start = time.perf_counter()
+        try:
+            with urlopen(request, timeout=60) as resp:
+                resp.read()
+            ok = True
+        except (HTTPError, URLError, OSError):
+            ok = False
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.started = self.started or time.monotonic() - elapsed
+            self.finished = time.monotonic()
+            self.latencies.append(elapsed)
+            self.events += events
+            self.errors += 0 if ok else 1
+        return ok
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        duration = (self.finished - self.started) if self.latencies else 0
+        return {
+            "requests": len(latencies),
+            "events": self.events,
+            "errors": self.errors,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1) if latencies else None,
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1) if latencies else None,
+            "events_per_s": round(self.events / duration, 1) if duration else None,
+        }
+
+
+def fetch_json(url):
+    with urlopen(url, timeout=10) as resp:
+        return json.loads(resp.read())
+
+
+# ----------------------------- CONVERSATIONS MESSENGER -------------------------------
+def messenger_payload(args, sender_id, messages):
+    now = int(time.time() * 1000)
+    return {"object": "page", "entry": [{
+        "id": args.page_id,
+        "time": now,
+        "messaging": [
+            {"sender": {"id": sender_id}, "recipient": {"id": args.page_id}, "timestamp": now + i, "message": dict(message, mid=f"m_{uuid.uuid4().hex}")}
+            for i, message in enumerate(messages)
+        ],
+    }]}
+
+
+def conversation(args, n):
+    # Une liste de POST, chacun regroupant un ou plusieurs messages (Facebook groupe parfois les rafales)
+    sender_id = f"bench{n:06d}"
+    steps = [[{"text": "samir"}], [{"text": f"Lieu {n}"}], [{"text": "15/10/2025"}]]
+    photos = [
+        {"attachments": [{"type": "image", "payload": {"url": f"{args.image_base}/img/{sender_id}-{i}.png?size={args.image_size}"}}]}
+        for i in range(args.photos)
+    ]
+    steps += [photos[i:i + args.burst_size] for i in range(0, len(photos), args.burst_size)]
+    steps.append([{"text": "fin"}])
+    return sender_id, steps
+
+
+def run_conversation(args, stats, n):
+    sender_id, steps = conversation(args, n)
+    for messages in steps:
+        stats.post(f"{args.target}/webhook", messenger_payload(args, sender_id, messages), events=len(messages))
+        if args.think:
+            time.sleep(args.think)
+
+
+# ----------------------------- VALIDATIONS TELEGRAM -------------------------------
+class TelegramScript:
+    # Les invites (nouveau lieu, choix de la photo) ont le même texte pour tous les brouillons :
+    # le couple « callback + lecture de l'invite » est fait sous verrou pour retrouver la bonne.
+    def __init__(self, args, stats):
+        self.args = args
+        self.stats = stats
+        self.update_ids = itertools.count(int(time.time()) * 1000)
+        self._prompt_lock = threading.Lock()
+
+    def messages_after(self, after):
+        return fetch_json(f"{self.args.fake_telegram}/_bench/messages?after={after}")
+
+    def send(self, update):
+        return self.stats.post(f"{self.args.telegram_target}/telegram-webhook", update)
+
+    def callback(self, message, data):
+        update_id = next(self.update_ids)
+        return self.send({"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": ADMIN, "chat_instance": "bench", "data": data, "message": message,
+        }})
+
+    def reply(self, prompt, text):
+        return self.send({"update_id": next(self.update_ids), "message": {
+            "message_id": next(self.update_ids), "date": int(time.time()), "chat": prompt["chat"],
+            "from": ADMIN, "text": text, "reply_to_message": prompt,
+        }})
+
+    def prompt_for(self, message, data, prefix):
+        with self._prompt_lock:
+            last = max([m["message_id"] for m in self.messages_after(0)] or [0])
+            self.callback(message, data)
+            for m in self.messages_after(last):
+                if (m.get("text") or "").startswith(prefix):
+                    return m
+        return None
+
+    def run(self, control):
+        prompt = self.prompt_for(control, "edit_lieu", "Envoie le nouveau lieu")
+        if prompt:
+            self.reply(prompt, "Lieu modifié (bench)")
+        picker = self.prompt_for(control, "delete_photo", "Clique sur la photo")
+        if picker:
+            self.callback(picker, "delete_photo_0")
+        self.callback(control, "valider")
+
+
+def validation_controls(messages):
+    controls = []
+    for m in messages:
+        buttons = [b.get("callback_data") for row in (m.get("reply_markup") or {}).get("inline_keyboard", []) for b in row]
+        if "valider" in buttons:
+            controls.append(m)
+    return controls
+
+
+def wait_for_drafts(args, after, expected):
+    deadline = time.monotonic() + args.draft_timeout
+    controls = []
+    while time.monotonic() < deadline:
+        controls = validation_controls(fetch_json(f"{args.fake_telegram}/_bench/messages?after={after}"))
+        if len(controls) >= expected:
+            break
+        time.sleep(0.5)
+    return controls
+
+
+# ----------------------------- RAPPORT -------------------------------
+def compare(report, baseline, tolerance):
+    regressions = []
+    for name, current in report.items():
+        previous = baseline.get(name)
+        if not previous or not current["requests"]:
+            continue
+        if previous.get("p95_ms") and current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+        if previous.get("events_per_s") and current["events_per_s"] < previous["events_per_s"] * (1 - tolerance):
+            regressions.append(f"{name}: {previous['events_per_s']} -> {current['events_per_s']} événements/s")
+    return regressions
+
+
+def print_report(report):
+    print(f"{'point d entrée':<20}{'requêtes':>10}{'événements':>12}{'erreurs':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'évts/s':>9}")
+    for name, r in report.items():
+        print(f"{name:<20}{r['requests']:>10}{r['events']:>12}{r['errors']:>9}"
+              f"{str(r['p50_ms']):>9}{str(r['p95_ms']):>9}{str(r['p99_ms']):>9}{str(r['events_per_s']):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Charge Messenger + Telegram sur l'application")
+    parser.add_argument("--target", default="http://127.0.0.1:8000", help="URL de l'application testée")
+    parser.add_argument("--telegram-target", default=None, help="URL du webhook Telegram (défaut : --target)")
+    parser.add_argument("--fake-telegram", default="http://127.0.0.1:8082")
+    parser.add_argument("--image-base", default="http://127.0.0.1:8081", help="hôte des images (faux Graph)")
+    parser.add_argument("--page-id", default="1000")
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--photos", type=int, default=4, help="photos par conversation")
+    parser.add_argument("--burst-size", type=int, default=3, help="photos par POST /webhook")
+    parser.add_argument("--image-size", type=int, default=150000, help="taille approximative des images (octets)")
+    parser.add_argument("--think", type=float, default=0.0, help="pause entre deux messages (s)")
+    parser.add_argument("--no-telegram", action="store_true", help="Messenger seulement (autopost/app.py)")
+    parser.add_argument("--draft-timeout", type=float, default=60)
+    parser.add_argument("--save", help="écrit le rapport JSON dans ce fichier")
+    parser.add_argument("--baseline", help="rapport JSON de référence")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--start-fakes", action="store_true", help="lance aussi les faux serveurs dans ce processus")
+    fake_servers.add_arguments(parser)
+    args = parser.parse_args()
+    args.telegram_target = args.telegram_target or args.target
+    if args.start_fakes:
+        fake_servers.start_fake_servers(args)
+
+    messenger = EntryPointStats("webhook")
+    telegram = EntryPointStats("telegram-webhook")
+    last_message = 0
+    if not args.no_telegram:
+        last_message = max([m["message_id"] for m in fetch_json(f"{args.fake_telegram}/_bench/messages?after=0")] or [0])
+
+    print(f"{args.conversations} conversations Messenger, {args.concurrency} en parallèle…")
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lambda n: run_conversation(args, messenger, n), range(args.conversations)))
+
+    if not args.no_telegram:
+        controls = wait_for_drafts(args, last_message, args.conversations)
+        print(f"{len(controls)} brouillons reçus sur Telegram, validation…")
+        script = TelegramScript(args, telegram)
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(script.run, controls))
+
+    report = {"webhook": messenger.report(), "telegram-webhook": telegram.report()}
+    print_report(report)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print("RÉGRESSION", line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
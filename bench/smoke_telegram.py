@@ -0,0 +1,68 @@
+import os
+import sys
+import json
+import argparse
+from urllib.request import urlopen
+
+import fake_servers
+
+# Test de fumée : un brouillon complet (nom de l'expéditeur, photos, album, message de contrôle,
+# édition du statut, réponse au callback) passe par le client limité d'application.py contre les
+# faux serveurs. Sort en erreur si un appel Telegram échoue ou n'arrive pas au faux serveur.
+#
+#   python bench/smoke_telegram.py
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def fetch_json(url):
+    with urlopen(url, timeout=10) as resp:
+        return json.loads(resp.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Un brouillon à travers le client Telegram d'application.py")
+    parser.add_argument("--photos", type=int, default=3)
+    fake_servers.add_arguments(parser)
+    args = parser.parse_args()
+    fake_servers.start_fake_servers(args)
+    graph_url = f"http://127.0.0.1:{args.graph_port}"
+    telegram_url = f"http://127.0.0.1:{args.telegram_port}"
+    os.environ.update({
+        "GRAPH_API_URL": graph_url, "TELEGRAM_API_URL": telegram_url, "TELEGRAM_TOKEN": "123456:bench",
+        "TELEGRAM_CHAT_ID": "42", "PAGE_ID": "1000", "PAGE_ACCESS_TOKEN": "bench", "STATE_BACKEND": "memory",
+    })
+    sys.path.insert(0, ROOT)
+    import application
+    from botcore.config import TELEGRAM_CHAT_ID
+    from botcore.flows import run_flow, tg
+    from botcore.images import image_cache
+    from botcore.messenger import new_user_buffer
+    from botcore.validation import edit_validation_status
+
+    urls = [f"{graph_url}/img/smoke-{i}.png?size=20000" for i in range(args.photos)]
+    for url in urls:
+        image_cache.prefetch(url)
+    buffer = dict(new_user_buffer(), lieu="Lieu smoke", date="15/10/2025", photos=urls, finished=True)
+    draft = application.submit_draft("smoke", buffer)
+
+    controls = [
+        m for m in fetch_json(f"{telegram_url}/_bench/messages?after=0")
+        if any(b.get("callback_data") == "valider" for row in (m.get("reply_markup") or {}).get("inline_keyboard", []) for b in row)
+    ]
+    if not controls:
+        sys.exit("ÉCHEC : aucun message de validation reçu par le faux Telegram")
+    control = controls[-1]
+    run_flow(edit_validation_status(TELEGRAM_CHAT_ID, control["message_id"], "photo" in control, "Smoke test"), application.call_bot)
+    application.call_bot(tg.answer_callback_query(callback_query_id="1", text="OK"))
+
+    calls = fetch_json(f"{telegram_url}/_bench/stats")
+    expected = ["sendMediaGroup" if args.photos > 1 else "sendPhoto" if args.photos else "sendMessage", "answerCallbackQuery"]
+    missing = [method for method in expected if not calls.get(method)]
+    if missing:
+        sys.exit(f"ÉCHEC : appels absents {missing} ({calls})")
+    print(f"OK : brouillon {draft['id']}, appels Telegram {calls}")
+
+
+if __name__ == "__main__":
+    main()
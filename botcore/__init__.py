@@ -0,0 +1,18 @@
+# Noyau commun aux deux bots : application.py (webhooks, python-telegram-bot 13) et
+# autopost/app.py (polling, python-telegram-bot 20). Chaque module s'importe explicitement :
+#   config      variables d'environnement
+#   graph       client HTTP Graph API (pool keep-alive)
+#   metrics     histogrammes de latence des appels sortants et des webhooks (format Prometheus)
+#   tracing     spans par requête et par job, traces lentes, profilage échantillonné
+#   ratelimit   limiteur de débit adaptatif (Graph API et Telegram)
+#   state       état partagé (mémoire ou SQLite) : conversations et brouillons
+#   images      cache local des photos Messenger (adressé par contenu)
+#   imaging     normalisation des photos, exécutée dans un pool de processus
+#   publishing  publication Facebook (photos, batch, post)
+#   messenger   réponses Messenger et conversation avec l'agent
+#   flows       dialogues Telegram indépendants du client (synchrone ou asynchrone)
+#   scheduler   file de publication espacée (plafond horaire, heures creuses)
+#   validation  aperçu Telegram des brouillons et boutons de validation
+#   startup     démarrage sans effet de bord : préchauffage, /ready, inscription du webhook Telegram
+#   sweeper     éviction des conversations et brouillons abandonnés
+#   web         vues d'exploitation communes (/stats, /metrics, /ready, /admin/profile)
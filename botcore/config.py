@@ -0,0 +1,117 @@
+import os
+import importlib.util
+
+# Utilisez les variables d'environnement pour vos tokens/secrets
+TELEGRAM_TOKEN = os.environ.get("TELEGRAM_TOKEN")
+TELEGRAM_CHAT_ID = int(os.environ.get("TELEGRAM_CHAT_ID", "0"))
+PAGE_ACCESS_TOKEN = os.environ.get("PAGE_ACCESS_TOKEN")
+PAGE_ID = os.environ.get("PAGE_ID")
+# Webhook Telegram inscrit au démarrage (WEBHOOK_URL, sinon déduit de l'hôte Azure)
+_website_hostname = os.environ.get("WEBSITE_HOSTNAME")
+TELEGRAM_WEBHOOK_URL = os.environ.get("WEBHOOK_URL") or (f"https://{_website_hostname}/telegram-webhook" if _website_hostname else None)
+# API Bot Telegram (remplaçable par un serveur local, cf. bench/)
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org")
+FB_UPLOAD_CONCURRENCY = int(os.environ.get("FB_UPLOAD_CONCURRENCY", "4"))
+# "parallel" (un appel par photo) ou "batch" (requêtes batch Graph API)
+FB_PUBLISH_MODE = os.environ.get("FB_PUBLISH_MODE", "parallel")
+GRAPH_BATCH_LIMIT = 50
+GRAPH_API_URL = os.environ.get("GRAPH_API_URL", "https://graph.facebook.com")
+GRAPH_CONNECT_TIMEOUT = float(os.environ.get("GRAPH_CONNECT_TIMEOUT", "3.05"))
+GRAPH_READ_TIMEOUT = float(os.environ.get("GRAPH_READ_TIMEOUT", "10"))
+GRAPH_PUBLISH_READ_TIMEOUT = float(os.environ.get("GRAPH_PUBLISH_READ_TIMEOUT", "60"))
+GRAPH_POOL_SIZE = int(os.environ.get("GRAPH_POOL_SIZE", "10"))
+GRAPH_MAX_RETRIES = int(os.environ.get("GRAPH_MAX_RETRIES", "3"))
+# Limiteur de débit : seaux à jetons par API et par cible (page, chat), ralentis par les refus du serveur
+RATE_LIMIT_MAX_RETRIES = int(os.environ.get("RATE_LIMIT_MAX_RETRIES", "3"))
+RATE_LIMIT_MAX_WAIT = float(os.environ.get("RATE_LIMIT_MAX_WAIT", "60"))
+RATE_LIMIT_RECOVERY = float(os.environ.get("RATE_LIMIT_RECOVERY", "0.01"))
+GRAPH_RATE = float(os.environ.get("GRAPH_RATE", "10"))
+GRAPH_BURST = int(os.environ.get("GRAPH_BURST", "20"))
+GRAPH_USAGE_SLOWDOWN = float(os.environ.get("GRAPH_USAGE_SLOWDOWN", "75"))
+GRAPH_THROTTLE_BACKOFF = float(os.environ.get("GRAPH_THROTTLE_BACKOFF", "60"))
+GRAPH_THROTTLE_CODES = {4, 17, 32, 613, 80001}
+TELEGRAM_GLOBAL_RATE = float(os.environ.get("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_CHAT_RATE_PER_MINUTE = float(os.environ.get("TELEGRAM_CHAT_RATE_PER_MINUTE", "20"))
+# File d'envoi des réponses Messenger : un worker par shard, file bornée par shard
+MESSENGER_QUEUE_WORKERS = int(os.environ.get("MESSENGER_QUEUE_WORKERS", "4"))
+MESSENGER_QUEUE_MAXSIZE = int(os.environ.get("MESSENGER_QUEUE_MAXSIZE", "500"))
+MESSENGER_QUEUE_PUT_TIMEOUT = float(os.environ.get("MESSENGER_QUEUE_PUT_TIMEOUT", "2"))
+MESSENGER_QUEUE_DRAIN_TIMEOUT = float(os.environ.get("MESSENGER_QUEUE_DRAIN_TIMEOUT", "10"))
+# Point d'entrée ASGI : client HTTP asynchrone partagé (Telegram et Graph API)
+ASGI_HTTP_TIMEOUT = float(os.environ.get("ASGI_HTTP_TIMEOUT", "30"))
+ASGI_HTTP_POOL_SIZE = int(os.environ.get("ASGI_HTTP_POOL_SIZE", "100"))
+# Soumissions de brouillons ("fin") traitées hors de la requête webhook
+DRAFT_SUBMIT_WORKERS = int(os.environ.get("DRAFT_SUBMIT_WORKERS", "4"))
+# Jobs de publication ("valider") et intervalle minimal entre deux éditions de progression
+PUBLISH_JOB_WORKERS = int(os.environ.get("PUBLISH_JOB_WORKERS", "2"))
+PUBLISH_PROGRESS_INTERVAL = float(os.environ.get("PUBLISH_PROGRESS_INTERVAL", "2"))
+# Durée au-delà de laquelle le verrou d'un job de publication interrompu est repris
+PUBLISH_LOCK_TTL = float(os.environ.get("PUBLISH_LOCK_TTL", "900"))
+# File de publication : délai minimal entre deux posts, plafond par heure (0 = aucun),
+# heures creuses "23-7" (heure locale du serveur) et programmation côté Graph (scheduled_publish_time)
+PUBLISH_SPACING = float(os.environ.get("PUBLISH_SPACING", "120"))
+PUBLISH_MAX_PER_HOUR = int(os.environ.get("PUBLISH_MAX_PER_HOUR", "10"))
+PUBLISH_QUIET_HOURS = tuple(int(h) for h in os.environ.get("PUBLISH_QUIET_HOURS", "").split("-") if h.strip())
+PUBLISH_GRAPH_SCHEDULE = os.environ.get("PUBLISH_GRAPH_SCHEDULE", "0") == "1"
+PUBLISH_SCHEDULER_INTERVAL = float(os.environ.get("PUBLISH_SCHEDULER_INTERVAL", "5"))
+PUBLISH_SCHEDULER_LEASE_TTL = float(os.environ.get("PUBLISH_SCHEDULER_LEASE_TTL", "60"))
+PUBLISH_QUEUE_REFRESH_LIMIT = 10
+# Graph refuse un scheduled_publish_time à moins de 10 minutes
+GRAPH_SCHEDULE_MIN_LEAD = 660
+# "memory" (un seul worker) ou "sqlite" (état partagé entre workers et redémarrages)
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory")
+STATE_DB_PATH = os.environ.get("STATE_DB_PATH", "state.sqlite3")
+STATE_CACHE_SIZE = int(os.environ.get("STATE_CACHE_SIZE", "1000"))
+# Éviction des conversations et brouillons abandonnés (durées en secondes)
+USER_BUFFER_TTL = int(os.environ.get("USER_BUFFER_TTL", str(6 * 3600)))
+USER_BUFFER_MAX_ENTRIES = int(os.environ.get("USER_BUFFER_MAX_ENTRIES", "5000"))
+DRAFT_TTL = int(os.environ.get("DRAFT_TTL", str(7 * 24 * 3600)))
+DRAFT_MAX_ENTRIES = int(os.environ.get("DRAFT_MAX_ENTRIES", "1000"))
+STATE_SWEEP_INTERVAL = int(os.environ.get("STATE_SWEEP_INTERVAL", "60"))
+SESSION_EXPIRED_NOTIFY = os.environ.get("SESSION_EXPIRED_NOTIFY", "1") == "1"
+# Déduplication des événements redélivrés (mids Messenger, update_id Telegram)
+MESSENGER_DEDUPE_WINDOW = int(os.environ.get("MESSENGER_DEDUPE_WINDOW", str(6 * 3600)))
+MESSENGER_DEDUPE_MAX_ENTRIES = int(os.environ.get("MESSENGER_DEDUPE_MAX_ENTRIES", "20000"))
+TELEGRAM_DEDUPE_WINDOW = int(os.environ.get("TELEGRAM_DEDUPE_WINDOW", "3600"))
+TELEGRAM_DEDUPE_MAX_ENTRIES = int(os.environ.get("TELEGRAM_DEDUPE_MAX_ENTRIES", "10000"))
+# file_id Telegram des photos déjà envoyées en modération
+TELEGRAM_FILE_ID_TTL = int(os.environ.get("TELEGRAM_FILE_ID_TTL", str(7 * 24 * 3600)))
+TELEGRAM_FILE_ID_MAX_ENTRIES = int(os.environ.get("TELEGRAM_FILE_ID_MAX_ENTRIES", "5000"))
+# Cache local des photos Messenger (téléchargées dès réception, rangées sous leur sha256)
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", "image_cache")
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))
+IMAGE_CACHE_MAX_ENTRIES = int(os.environ.get("IMAGE_CACHE_MAX_ENTRIES", "20000"))
+IMAGE_MAX_BYTES = int(os.environ.get("IMAGE_MAX_BYTES", str(25 * 1024 * 1024)))
+IMAGE_DOWNLOAD_WORKERS = int(os.environ.get("IMAGE_DOWNLOAD_WORKERS", "4"))
+IMAGE_DOWNLOAD_TIMEOUT = float(os.environ.get("IMAGE_DOWNLOAD_TIMEOUT", "20"))
+IMAGE_DOWNLOAD_WAIT = float(os.environ.get("IMAGE_DOWNLOAD_WAIT", "5"))
+# Normalisation des photos (Pillow optionnel : sans lui, les originaux sont envoyés tels quels)
+PILLOW_AVAILABLE = importlib.util.find_spec("PIL") is not None
+IMAGE_NORMALIZE = os.environ.get("IMAGE_NORMALIZE", "1") == "1" and PILLOW_AVAILABLE
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", "2048"))
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_NORMALIZE_WORKERS = int(os.environ.get("IMAGE_NORMALIZE_WORKERS", "2"))
+IMAGE_NORMALIZE_TIMEOUT = float(os.environ.get("IMAGE_NORMALIZE_TIMEOUT", "30"))
+# Photos en double : empreintes des photos publiées récemment et écart toléré (bits de dHash)
+PHOTO_DUPLICATE_WINDOW = int(os.environ.get("PHOTO_DUPLICATE_WINDOW", str(30 * 24 * 3600)))
+PHOTO_DUPLICATE_MAX_ENTRIES = int(os.environ.get("PHOTO_DUPLICATE_MAX_ENTRIES", "20000"))
+PHOTO_SIMILARITY_THRESHOLD = int(os.environ.get("PHOTO_SIMILARITY_THRESHOLD", "6"))
+# Cache des noms d'expéditeurs (profil Graph API) et attente maximale d'une recherche en cours
+SENDER_NAME_TTL = int(os.environ.get("SENDER_NAME_TTL", str(24 * 3600)))
+SENDER_NAME_CACHE_SIZE = int(os.environ.get("SENDER_NAME_CACHE_SIZE", "500"))
+SENDER_NAME_WAIT = float(os.environ.get("SENDER_NAME_WAIT", "2"))
+# autopost : attente maximale du démarrage de la boucle Telegram avant un envoi depuis Flask
+TELEGRAM_BRIDGE_WAIT = float(os.environ.get("TELEGRAM_BRIDGE_WAIT", "10"))
+# Requêtes plus lentes que TRACE_SLOW_THRESHOLD secondes écrites dans TRACE_LOG_PATH (0 = aucune)
+TRACE_SLOW_THRESHOLD = float(os.environ.get("TRACE_SLOW_THRESHOLD", "2"))
+TRACE_LOG_PATH = os.environ.get("TRACE_LOG_PATH", "slow_traces.jsonl")
+# Profilage à la demande (/admin/profile) : désactivé tant qu'ADMIN_TOKEN n'est pas défini
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.01"))
+PROFILE_MAX_SECONDS = int(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+# Inscription du webhook Telegram en arrière-plan : nouvel essai toutes les N secondes en cas d'échec.
+# L'inscription est refaite à chaque nouveau DEPLOYMENT_ID (ex. SHA du commit déployé) et au plus
+# tard après WEBHOOK_MARKER_TTL secondes (webhook modifié ou supprimé hors du bot).
+WEBHOOK_REGISTER_RETRY = int(os.environ.get("WEBHOOK_REGISTER_RETRY", "30"))
+WEBHOOK_MARKER_TTL = int(os.environ.get("WEBHOOK_MARKER_TTL", str(24 * 3600)))
+DEPLOYMENT_ID = os.environ.get("DEPLOYMENT_ID", "")
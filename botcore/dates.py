@@ -0,0 +1,13 @@
+import re
+
+def is_date_valid(date_str):
+    # Validation pour format سنة/شهر/يوم (exemple: 15/10/2025)
+    return bool(re.match(r"^(0[1-9]|[12][0-9]|3[01])/(0[1-9]|1[0-2])/[0-9]{4}$", date_str))
+
+def convert_date_to_ar_format(date_str):
+    # Transforme jj/mm/aaaa -> aaaa/mm/jj pour l'affichage arabe
+    m = re.match(r"^(0[1-9]|[12][0-9]|3[01])/(0[1-9]|1[0-2])/[0-9]{4}$", date_str)
+    if not m:
+        return date_str
+    jj, mm, aaaa = date_str.split("/")
+    return f"{aaaa}/{mm}/{jj}"
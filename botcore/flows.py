@@ -0,0 +1,127 @@
+import asyncio
+import functools
+import contextvars
+
+# Dialogues Telegram écrits une seule fois pour tous les clients : Bot synchrone de
+# python-telegram-bot 13 (application.py) ou Bot asynchrone de la version 20 (autopost/app.py).
+# Un dialogue est un générateur qui décrit ses appels au lieu de les faire :
+#
+#     msg = yield tg.send_message(chat_id=..., text=...)
+#
+# run_flow (ou run_flow_async) exécute chaque appel avec le client fourni, renvoie le résultat
+# au générateur ou y relève l'exception (BadRequest...) pour ses propres try/except.
+# Un sous-dialogue s'appelle avec yield from ; un travail bloquant (Graph API) avec
+# yield InThread(fn, *args), exécuté hors de la boucle asyncio ; un dialogue de fond (publication)
+# avec yield Spawn(flow, executor), qui rend la main tout de suite.
+
+class TelegramCall:
+    def __init__(self, method, kwargs):
+        self.method = method
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return f"TelegramCall({self.method})"
+
+class TelegramCalls:
+    # tg.send_message(**kwargs) -> TelegramCall("send_message", kwargs) : mêmes noms que les méthodes du Bot
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+        return lambda **kwargs: TelegramCall(method, kwargs)
+
+tg = TelegramCalls()
+
+class InThread:
+    def __init__(self, fn, *args, **kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+class Spawn:
+    # Dialogue lancé en arrière-plan avec le même client ; ses InThread passent par executor
+    def __init__(self, flow, executor, label="job"):
+        self.flow = flow
+        self.executor = executor
+        self.label = label
+
+# Client du dialogue en cours, vu depuis le thread d'un InThread (voir run_from_thread)
+_thread_runner = contextvars.ContextVar("thread_runner", default=None)
+
+def run_from_thread(flow):
+    # Exécute un sous-dialogue depuis le code bloquant d'un InThread (progression d'un upload...)
+    runner = _thread_runner.get()
+    if runner is None:
+        raise RuntimeError("run_from_thread appelé hors d'un InThread")
+    return runner(flow)
+
+def log_future_error(label, future):
+    if not future.cancelled() and future.exception():
+        print(f"Erreur {label} :", future.exception())
+
+def bot_caller(bot):
+    # Client le plus simple : la méthode du même nom sur un Bot python-telegram-bot
+    return lambda call: getattr(bot, call.method)(**call.kwargs)
+
+def run_flow(flow, call):
+    result, error = None, None
+    while True:
+        try:
+            step = flow.send(result) if error is None else flow.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        result, error = None, None
+        try:
+            if isinstance(step, InThread):
+                token = _thread_runner.set(lambda sub: run_flow(sub, call))
+                try:
+                    result = step.fn(*step.args, **step.kwargs)
+                finally:
+                    _thread_runner.reset(token)
+            elif isinstance(step, Spawn):
+                result = step.executor.submit(run_flow, step.flow, call)
+                result.add_done_callback(functools.partial(log_future_error, step.label))
+            else:
+                result = call(step)
+        except Exception as e:
+            error = e
+
+# Tâches asyncio des Spawn : une référence les protège du ramasse-miettes jusqu'à leur fin
+_spawned = set()
+
+def spawn_task(coro, label):
+    # Tâche de fond sur la boucle courante, gardée référencée ; ses erreurs sont journalisées
+    task = asyncio.get_running_loop().create_task(coro)
+    _spawned.add(task)
+    task.add_done_callback(_spawned.discard)
+    task.add_done_callback(functools.partial(log_future_error, label))
+    return task
+
+def spawned_tasks():
+    # Tâches de fond encore en cours, à attendre à l'arrêt d'un serveur asyncio
+    return set(_spawned)
+
+async def run_flow_async(flow, call, executor=None):
+    # call(step) renvoie une coroutine ; les InThread passent par executor (pool par défaut sinon)
+    loop = asyncio.get_running_loop()
+
+    def run_sub_from_thread(sub):
+        return asyncio.run_coroutine_threadsafe(run_flow_async(sub, call, executor), loop).result()
+
+    result, error = None, None
+    while True:
+        try:
+            step = flow.send(result) if error is None else flow.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        result, error = None, None
+        try:
+            if isinstance(step, InThread):
+                ctx = contextvars.copy_context()
+                ctx.run(_thread_runner.set, run_sub_from_thread)
+                result = await loop.run_in_executor(executor, ctx.run, functools.partial(step.fn, *step.args, **step.kwargs))
+            elif isinstance(step, Spawn):
+                result = spawn_task(run_flow_async(step.flow, call, step.executor), step.label)
+            else:
+                result = await call(step)
+        except Exception as e:
+            error = e
@@ -0,0 +1,71 @@
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from botcore.config import (
+    GRAPH_API_URL, GRAPH_CONNECT_TIMEOUT, GRAPH_MAX_RETRIES, GRAPH_POOL_SIZE, GRAPH_READ_TIMEOUT, RATE_LIMIT_MAX_RETRIES
+)
+from botcore.ratelimit import graph_reserve, observe_graph_response, should_retry
+
+# ----------------------------- CLIENT HTTP GRAPH API (pool keep-alive) -------------------------------
+_graph_session = None
+_graph_session_pid = None
+_graph_session_lock = threading.Lock()
+
+def get_graph_session():
+    # Une session par processus (les workers gunicorn forkés ne partagent pas les sockets)
+    global _graph_session, _graph_session_pid
+    if _graph_session is None or _graph_session_pid != os.getpid():
+        with _graph_session_lock:
+            if _graph_session is None or _graph_session_pid != os.getpid():
+                retries = Retry(
+                    total=GRAPH_MAX_RETRIES,
+                    backoff_factor=0.3,
+                    status_forcelist=(500, 502, 503, 504),
+                    allowed_methods=frozenset(["GET", "HEAD", "OPTIONS", "DELETE"]),
+                    raise_on_status=False
+                )
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=GRAPH_POOL_SIZE, max_retries=retries)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _graph_session = session
+                _graph_session_pid = os.getpid()
+    return _graph_session
+
+def graph_request(method, path, read_timeout=None, **kwargs):
+    url = path if path.startswith("http") else f"{GRAPH_API_URL}/{path}"
+    kwargs.setdefault("timeout", (GRAPH_CONNECT_TIMEOUT, read_timeout or GRAPH_READ_TIMEOUT))
+    for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+        delay = graph_reserve()
+        if delay > 0:
+            time.sleep(delay)
+        resp = get_graph_session().request(method, url, **kwargs)
+        retry_after = observe_graph_response(resp)
+        if not should_retry(retry_after, attempt):
+            return resp
+        # Appel refusé pour quota, donc non exécuté : on le rejoue une fois le seau débloqué
+        print(f"Graph API limite le débit, nouvel essai dans {retry_after:.0f}s")
+        if hasattr(kwargs.get("data"), "seek"):
+            kwargs["data"].seek(0)
+
+def graph_pool_stats():
+    adapter = get_graph_session().get_adapter(GRAPH_API_URL)
+    pools = []
+    for key in adapter.poolmanager.pools.keys():
+        pool = adapter.poolmanager.pools.get(key)
+        if pool is None:
+            continue
+        idle = [conn for conn in list(pool.pool.queue) if conn] if pool.pool else []
+        pools.append({
+            "host": pool.host,
+            "port": pool.port,
+            "maxsize": GRAPH_POOL_SIZE,
+            "idle_connections": len(idle),
+            "connections_created": pool.num_connections,
+            "requests": pool.num_requests,
+        })
+    return {"pid": os.getpid(), "pools": pools}
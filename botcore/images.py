@@ -0,0 +1,368 @@
+import os
+import mmap
+import time
+import uuid
+import hashlib
+import tempfile
+import threading
+import functools
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from botcore.config import (
+    GRAPH_CONNECT_TIMEOUT, IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES, IMAGE_DOWNLOAD_TIMEOUT, IMAGE_DOWNLOAD_WORKERS,
+    IMAGE_JPEG_QUALITY, IMAGE_MAX_BYTES, IMAGE_MAX_EDGE, IMAGE_NORMALIZE, IMAGE_NORMALIZE_TIMEOUT, IMAGE_NORMALIZE_WORKERS,
+    PHOTO_DUPLICATE_MAX_ENTRIES, PHOTO_DUPLICATE_WINDOW, PHOTO_SIMILARITY_THRESHOLD, PILLOW_AVAILABLE
+)
+from botcore.graph import get_graph_session
+from botcore.imaging import dhash_image_file, normalize_image_file, warm_up
+from botcore.state import state_store
+
+# ----------------------------- CACHE LOCAL DES IMAGES (adressé par contenu) -------------------------------
+_image_workers = None
+_image_workers_pid = None
+_image_workers_lock = threading.Lock()
+
+def get_image_workers():
+    # Pool de processus créé à la demande, un par processus (les workers gunicorn forkés ne le partagent pas).
+    # spawn : à ce stade des threads tournent déjà (verrous, pools HTTP) et un fork pourrait en hériter bloqués.
+    global _image_workers, _image_workers_pid
+    if _image_workers is None or _image_workers_pid != os.getpid():
+        with _image_workers_lock:
+            if _image_workers is None or _image_workers_pid != os.getpid():
+                _image_workers = ProcessPoolExecutor(
+                    max_workers=IMAGE_NORMALIZE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                )
+                _image_workers_pid = os.getpid()
+    return _image_workers
+
+def warm_up_image_workers():
+    # Le pool ne lance ses processus qu'à la soumission d'un travail : un travail par processus,
+    # soumis d'un coup, les démarre tous (spawn et import de Pillow) avant la première photo
+    pool = get_image_workers()
+    futures = [pool.submit(warm_up) for _ in range(IMAGE_NORMALIZE_WORKERS)]
+    return {future.result(timeout=IMAGE_NORMALIZE_TIMEOUT) for future in futures}
+
+class ImageCache:
+    # Pièces jointes Messenger téléchargées une seule fois, en flux, et rangées sous leur sha256 :
+    # les aperçus et la publication ne dépendent plus des URL du CDN, qui expirent.
+    # L'index url -> sha256 vit dans le store d'état (partagé entre workers avec SQLite).
+    def __init__(self, root, max_bytes, store, workers):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.store = store
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-fetch")
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.files = 0
+        self.size = 0
+        self.evicted = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def digest(self, url):
+        entry = self.store.get("image_urls", url)
+        return entry["sha256"] if entry else None
+
+    def dhash(self, url):
+        entry = self.store.get("image_urls", url)
+        return entry.get("dhash") if entry else None
+
+    def lookup(self, url):
+        digest = self.digest(url)
+        if not digest:
+            return None
+        path = self.path_for(digest)
+        try:
+            # La date de modification sert d'ordre LRU pour l'éviction
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def download(self, url):
+        if self.lookup(url):
+            return self.digest(url)
+        tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        sha = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, "wb") as out:
+                with get_graph_session().get(url, stream=True, timeout=(GRAPH_CONNECT_TIMEOUT, IMAGE_DOWNLOAD_TIMEOUT)) as resp:
+                    resp.raise_for_status()
+                    for chunk in resp.iter_content(64 * 1024):
+                        size += len(chunk)
+                        if size > IMAGE_MAX_BYTES:
+                            raise ValueError(f"Image de plus de {IMAGE_MAX_BYTES} octets")
+                        sha.update(chunk)
+                        out.write(chunk)
+            digest = sha.hexdigest()
+            source_size = size
+            if IMAGE_NORMALIZE:
+                tmp_path, size = self._normalize(tmp_path)
+            path = self.path_for(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Même contenu = même fichier : le renommage est atomique et idempotent
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        self.store.set("image_urls", url, {
+            "sha256": digest,
+            "size": size,
+            "source_size": source_size,
+            "dhash": self._fingerprint(path),
+        })
+        self.bytes_in += source_size
+        self.bytes_out += size
+        return digest
+
+    def _fingerprint(self, path):
+        if not PILLOW_AVAILABLE:
+            return None
+        try:
+            return get_image_workers().submit(dhash_image_file, path).result(timeout=IMAGE_NORMALIZE_TIMEOUT)
+        except Exception as e:
+            print("Erreur empreinte image:", e)
+            return None
+
+    def _normalize(self, tmp_path):
+        # Le fichier garde la clé sha256 de l'original, mais contient la version allégée à envoyer
+        out_path = tmp_path + ".jpg"
+        try:
+            size = get_image_workers().submit(
+                normalize_image_file, tmp_path, out_path, IMAGE_MAX_EDGE, IMAGE_JPEG_QUALITY
+            ).result(timeout=IMAGE_NORMALIZE_TIMEOUT)
+        except Exception as e:
+            print("Erreur normalisation image, original conservé:", e)
+            try:
+                os.unlink(out_path)
+            except OSError:
+                pass
+            return tmp_path, os.path.getsize(tmp_path)
+        os.unlink(tmp_path)
+        return out_path, size
+
+    def prefetch(self, url):
+        # Lancé dès la réception de la photo : le fichier est prêt quand l'agent tape "fin"
+        if self.lookup(url):
+            return
+        with self._lock:
+            if url in self._pending:
+                return
+            fut = self._pool.submit(self.download, url)
+            self._pending[url] = fut
+        fut.add_done_callback(functools.partial(self._done, url))
+
+    def _done(self, url, fut):
+        with self._lock:
+            self._pending.pop(url, None)
+        if fut.exception():
+            print("Erreur téléchargement image:", url, fut.exception())
+
+    def pending(self, urls):
+        with self._lock:
+            return [self._pending[url] for url in urls if url in self._pending]
+
+    def wait(self, urls, timeout):
+        # Attend au plus timeout secondes au total ; renvoie {url: sha256} des images disponibles
+        deadline = time.monotonic() + timeout
+        for fut in self.pending(urls):
+            try:
+                fut.result(timeout=max(0, deadline - time.monotonic()))
+            except Exception:
+                pass
+        hashes = {}
+        for url in urls:
+            digest = self.digest(url)
+            if digest:
+                hashes[url] = digest
+        return hashes
+
+    def expire(self, max_idle, max_entries):
+        self.store.expire("image_urls", max_idle, max_entries)
+        return self.evict()
+
+    def evict(self):
+        # Éviction par taille totale : les fichiers les moins récemment utilisés partent en premier
+        files = []
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        removed = 0
+        if total > self.max_bytes:
+            for mtime, size, path in sorted(files):
+                if total <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+        self.files = len(files) - removed
+        self.size = total
+        self.evicted += removed
+        return removed
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "files": self.files,
+            "bytes": self.size,
+            "evicted": self.evicted,
+            "pending": pending,
+            "normalize": IMAGE_NORMALIZE,
+            "downloaded_bytes": self.bytes_in,
+            "upload_bytes": self.bytes_out,
+        }
+
+class MultipartFileBody:
+    # Corps multipart/form-data lu au fil de l'envoi : le fichier est projeté en mémoire (mmap)
+    # au lieu d'être chargé, et la taille est connue d'avance (Content-Length, pas de chunked).
+    def __init__(self, fields, file_field, path, content_type="image/jpeg"):
+        self.boundary = uuid.uuid4().hex
+        head = ""
+        for name, value in fields.items():
+            head += f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+        head += (
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+            f'filename="{os.path.basename(path)}"\r\nContent-Type: {content_type}\r\n\r\n'
+        )
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._parts = [head.encode("utf-8"), self._map or b"", f"\r\n--{self.boundary}--\r\n".encode("utf-8")]
+        self._len = sum(len(part) for part in self._parts)
+        self._pos = 0
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return self._len
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        # Permet à urllib3 de rembobiner le corps avant une nouvelle tentative
+        base = {0: 0, 1: self._pos, 2: self._len}[whence]
+        self._pos = max(0, min(self._len, base + offset))
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._len - self._pos
+        out = []
+        while size > 0 and self._pos < self._len:
+            offset = self._pos
+            for part in self._parts:
+                if offset < len(part):
+                    break
+                offset -= len(part)
+            chunk = part[offset:offset + size]
+            out.append(chunk)
+            self._pos += len(chunk)
+            size -= len(chunk)
+        return b"".join(out)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+image_cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES, state_store, IMAGE_DOWNLOAD_WORKERS)
+
+# ----------------------------- PHOTOS EN DOUBLE -------------------------------
+class PublishedPhotos:
+    # dHash des photos publiées récemment, une clé hexadécimale par photo dans le store (bornée par
+    # le balayage). La recherche se fait sur une copie locale compacte (array d'entiers 64 bits),
+    # rechargée au plus toutes les refresh secondes pour voir les publications des autres workers.
+    def __init__(self, store, window, max_entries, refresh=30):
+        self.store = store
+        self.window = window
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self._hashes = array("Q")
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def add(self, values, post_id):
+        now = time.time()
+        for value in values:
+            self.store.set("published_photos", f"{value:016x}", {"post_id": post_id, "ts": now})
+        with self._lock:
+            self._hashes = self._hashes + array("Q", values)
+
+    def _snapshot(self):
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh:
+                self._hashes = array("Q", (int(key, 16) for key in self.store.keys("published_photos")))
+                self._loaded_at = time.monotonic()
+            return self._hashes
+
+    def closest(self, value, threshold):
+        best = None
+        for known in self._snapshot():
+            distance = bin(value ^ known).count("1")
+            if distance <= threshold and (best is None or distance < best[0]):
+                best = (distance, known)
+        if best is None:
+            return None
+        entry = self.store.get("published_photos", f"{best[1]:016x}")
+        if not entry:
+            return None
+        return {"post_id": entry["post_id"], "distance": best[0]}
+
+    def expire(self):
+        return len(self.store.expire("published_photos", self.window, self.max_entries))
+
+    def __len__(self):
+        return self.store.count("published_photos")
+
+published_photos = PublishedPhotos(state_store, PHOTO_DUPLICATE_WINDOW, PHOTO_DUPLICATE_MAX_ENTRIES)
+
+def check_photos(urls, photo_hashes):
+    # Doublons exacts (même URL ou même sha256) retirés ; photos proches d'une publication récente signalées
+    kept = []
+    seen = set()
+    for url in urls:
+        key = photo_hashes.get(url) or url
+        if key not in seen:
+            seen.add(key)
+            kept.append(url)
+    similar = []
+    for url in kept:
+        value = image_cache.dhash(url)
+        if value is None:
+            continue
+        match = published_photos.closest(value, PHOTO_SIMILARITY_THRESHOLD)
+        if match:
+            match["url"] = url
+            similar.append(match)
+    return kept, {"dropped": len(urls) - len(kept), "similar": similar}
+
+def remember_published_photos(draft, post_id):
+    values = [image_cache.dhash(url) for url in draft["photos"]]
+    values = [value for value in values if value is not None]
+    if values:
+        published_photos.add(values, post_id)
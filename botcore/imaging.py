@@ -0,0 +1,37 @@
+import os
+import importlib
+
+# Traitements exécutés dans les processus du pool d'images (contexte spawn) : ce module ne dépend
+# que de Pillow, pour que chaque processus démarre sans recharger le reste du bot.
+
+def warm_up():
+    # Premier travail de chaque processus : démarrage et chargement de Pillow avant la première photo
+    importlib.import_module("PIL.Image")
+    return os.getpid()
+
+def normalize_image_file(src_path, dst_path, max_edge, quality):
+    # Réduit au bord maximal, supprime l'EXIF et réencode en JPEG
+    from PIL import Image, ImageOps
+    with Image.open(src_path) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        img.save(dst_path, "JPEG", quality=quality, optimize=True, progressive=True)
+    return os.path.getsize(dst_path)
+
+def dhash_image(img):
+    # Empreinte perceptuelle 64 bits (difference hash) : stable au redimensionnement et à la recompression
+    from PIL import Image
+    small = img.convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+def dhash_image_file(path):
+    from PIL import Image, ImageOps
+    with Image.open(path) as img:
+        return dhash_image(ImageOps.exif_transpose(img))
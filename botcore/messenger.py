@@ -0,0 +1,355 @@
+import os
+import time
+import zlib
+import queue
+import atexit
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from botcore.config import (
+    DRAFT_SUBMIT_WORKERS, MESSENGER_DEDUPE_MAX_ENTRIES, MESSENGER_DEDUPE_WINDOW, MESSENGER_QUEUE_DRAIN_TIMEOUT,
+    MESSENGER_QUEUE_MAXSIZE, MESSENGER_QUEUE_PUT_TIMEOUT, MESSENGER_QUEUE_WORKERS, PAGE_ACCESS_TOKEN,
+    SENDER_NAME_CACHE_SIZE, SENDER_NAME_TTL, SENDER_NAME_WAIT
+)
+from botcore.dates import is_date_valid
+from botcore.flows import log_future_error
+from botcore.graph import graph_request
+from botcore.images import image_cache
+from botcore.metrics import metrics
+from botcore.state import RecentIds, StateMap, shared_store, state_store
+from botcore.tracing import Span
+
+# Conversations Messenger en cours, par expéditeur (partagées entre workers avec STATE_BACKEND=sqlite)
+user_buffers = StateMap(state_store, "user_buffers")
+messenger_dedupe = RecentIds("seen_mids", MESSENGER_DEDUPE_WINDOW, MESSENGER_DEDUPE_MAX_ENTRIES, shared_store)
+
+@metrics.timed("autopost_outbound_call", call="messenger_send")
+def deliver_message_to_messenger(recipient_id, message):
+    params = {"access_token": PAGE_ACCESS_TOKEN}
+    data = {"recipient": {"id": recipient_id}, "message": {"text": message}}
+    try:
+        r = graph_request("POST", "v17.0/me/messages", params=params, json=data)
+        return r.ok
+    except Exception as e:
+        print("Erreur Messenger:", e)
+        return False
+
+# ----------------------------- FILE D'ENVOI MESSENGER (asynchrone) -------------------------------
+class MessengerReplyQueue:
+    # Un worker par shard : un destinataire est toujours servi par le même worker, donc dans l'ordre
+    def __init__(self, workers, maxsize, put_timeout):
+        self.workers = max(1, workers)
+        self.maxsize = maxsize
+        self.put_timeout = put_timeout
+        self._queues = []
+        self._threads = []
+        self._pid = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._stats = {"enqueued": 0, "sent": 0, "failed": 0, "blocked_puts": 0, "dropped": 0, "max_depth": 0}
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queues = [queue.Queue(maxsize=self.maxsize) for _ in range(self.workers)]
+            self._threads = []
+            for i, q in enumerate(self._queues):
+                t = threading.Thread(target=self._run, args=(q,), name=f"messenger-reply-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._closed = False
+            self._pid = os.getpid()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def put(self, recipient_id, message):
+        self._ensure_started()
+        if self._closed:
+            return deliver_message_to_messenger(recipient_id, message)
+        q = self._queues[zlib.crc32(str(recipient_id).encode()) % self.workers]
+        try:
+            q.put_nowait((recipient_id, message))
+        except queue.Full:
+            self._count("blocked_puts")
+            try:
+                q.put((recipient_id, message), timeout=self.put_timeout)
+            except queue.Full:
+                self._count("dropped")
+                print("File Messenger pleine, message abandonné pour", recipient_id)
+                return False
+        with self._lock:
+            self._stats["enqueued"] += 1
+            self._stats["max_depth"] = max(self._stats["max_depth"], q.qsize())
+        return True
+
+    def _run(self, q):
+        while True:
+            item = q.get()
+            try:
+                if item is None:
+                    return
+                # Envoi hors requête : sa propre trace
+                with Span("messenger_reply", root=True):
+                    self._count("sent" if deliver_message_to_messenger(*item) else "failed")
+            finally:
+                q.task_done()
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            "workers": self.workers,
+            "capacity_per_worker": self.maxsize,
+            "depth": [q.qsize() for q in self._queues],
+        })
+        return stats
+
+    def drain(self, timeout=None):
+        # Arrêt propre : on laisse les workers vider leur file avant de quitter
+        if self._pid != os.getpid():
+            return
+        self._closed = True
+        deadline = time.monotonic() + (MESSENGER_QUEUE_DRAIN_TIMEOUT if timeout is None else timeout)
+        for q in self._queues:
+            try:
+                q.put(None, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+        for t in self._threads:
+            t.join(max(0, deadline - time.monotonic()))
+
+messenger_replies = MessengerReplyQueue(MESSENGER_QUEUE_WORKERS, MESSENGER_QUEUE_MAXSIZE, MESSENGER_QUEUE_PUT_TIMEOUT)
+atexit.register(messenger_replies.drain)
+
+def send_message_to_messenger(recipient_id, message):
+    return messenger_replies.put(recipient_id, message)
+
+# ----------------------------- NOMS DES EXPÉDITEURS (cache + préchargement) -------------------------------
+class TTLCache:
+    # Cache LRU borné avec expiration par entrée
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+sender_names = TTLCache(SENDER_NAME_CACHE_SIZE, SENDER_NAME_TTL)
+name_lookups = ThreadPoolExecutor(max_workers=2, thread_name_prefix="name-lookup")
+_pending_names = {}
+_pending_names_lock = threading.Lock()
+
+@metrics.timed("autopost_outbound_call", call="get_user_name")
+def load_user_name(sender_id):
+    params = {"access_token": PAGE_ACCESS_TOKEN, "fields": "first_name,last_name"}
+    try:
+        r = graph_request("GET", sender_id, params=params)
+        data = r.json()
+        name = f"{data.get('first_name', '')} {data.get('last_name', '')}".strip()
+        if name:
+            sender_names.set(sender_id, name)
+        return name or None
+    except Exception as e:
+        print("Erreur fetch nom Messenger:", e)
+        return None
+    finally:
+        with _pending_names_lock:
+            _pending_names.pop(sender_id, None)
+
+def prefetch_user_name(sender_id):
+    # Lancé au début de la conversation : le nom est prêt quand l'agent tape "fin"
+    if sender_names.get(sender_id):
+        return
+    with _pending_names_lock:
+        if sender_id not in _pending_names:
+            _pending_names[sender_id] = name_lookups.submit(load_user_name, sender_id)
+
+def pending_user_name(sender_id):
+    with _pending_names_lock:
+        return _pending_names.get(sender_id)
+
+def get_user_name(sender_id):
+    name = sender_names.get(sender_id)
+    if name:
+        return name
+    pending = pending_user_name(sender_id)
+    if pending:
+        try:
+            name = pending.result(timeout=SENDER_NAME_WAIT)
+        except Exception:
+            name = None
+    else:
+        name = load_user_name(sender_id)
+    return name or f"ID {sender_id}"
+
+# ----------------------------- TRADUCTIONS EN ARABE pour Messenger -------------------------------
+AR_MSGS = {
+    "welcome": "مرحبًا، يرجى اتباع الخطوات لإرسال المنشور.",
+    "ask_lieu": "من فضلك أرسل اسم المكان باللغة العربية (مثال: محور دوران دار البيضاء).",
+    "lieu_ok": "شكرًا، تم استلام اسم المكان!",
+    "ask_date": "من فضلك أرسل التاريخ بالصيغة: سنة/شهر/يوم (مثال: 15/10/2025).",
+    "date_ok": "شكرًا، تم استلام التاريخ!",
+    "date_invalid": "صيغة التاريخ غير صحيحة. يرجى إرسال التاريخ بالصيغة: سنة/شهر/يوم (مثال: 15/10/2025).",
+    "ask_photo": "أرسل الصور أو اكتب 'fin' عند الانتهاء.",
+    "photo_ok": "تم استلام الصور(ة).",
+    "finish_ok": "تم إرسال المنشور، وسيتم نشره قريبًا.",
+    "session_expired": "انتهت صلاحية الجلسة بسبب عدم النشاط. اكتب 'samir' للبدء من جديد.",
+}
+
+# ----------------------------- CONVERSATION MESSENGER -------------------------------
+# --- METS TON VÉRIFY TOKEN PERSO ICI ---
+MESSENGER_VERIFY_TOKEN = "123456789"
+
+def verify_subscription(args):
+    # Vérification du webhook par Facebook (GET /webhook) : renvoie (corps, statut)
+    if args.get("hub.mode") == "subscribe" and args.get("hub.verify_token") == MESSENGER_VERIFY_TOKEN:
+        return args.get("hub.challenge"), 200
+    return "Verification token mismatch", 403
+
+def new_user_buffer():
+    return {
+        "step": 0, "lieu": None, "date": None, "photos": [],
+        "finished": False,
+        "error_sent_1": False, "error_sent_2": False, "error_sent_3": False,
+        "consigne_sent_1": False, "consigne_sent_2": False
+    }
+
+# ----------------------------- SOUMISSION DES BROUILLONS EN ARRIÈRE-PLAN -------------------------------
+# Nom de l'expéditeur et envoi Telegram d'un brouillon : le webhook Messenger répond sans attendre
+# (Facebook renvoie l'événement au-delà de 20 s)
+draft_submissions = ThreadPoolExecutor(max_workers=DRAFT_SUBMIT_WORKERS, thread_name_prefix="draft-submit")
+
+def submit_in_background(submit_draft):
+    # submit_draft(sender_id, buffer) -> on_finish qui le lance dans draft_submissions
+    def on_finish(sender_id, buffer):
+        future = draft_submissions.submit(submit_draft, sender_id, buffer)
+        future.add_done_callback(functools.partial(log_future_error, "soumission du brouillon"))
+        return future
+    return on_finish
+
+# on_finish(sender_id, buffer) prend le relais quand l'agent tape "fin" : chaque application
+# y envoie le brouillon à Telegram avec son propre client (submit_in_background(submit_draft)).
+# reply(sender_id, text) envoie les réponses : file ordonnée par défaut, client asynchrone sous ASGI.
+# Renvoie la conversation à enregistrer (une nouvelle après "fin").
+def handle_messenger_event(sender_id, message, buffer, on_finish, reply=None):
+    reply = reply or send_message_to_messenger
+    if buffer["step"] == 0:
+        if "text" in message and message.get("text", "").strip().lower().startswith("samir"):
+            buffer["step"] = 1
+            prefetch_user_name(sender_id)
+            reply(sender_id, AR_MSGS["welcome"])
+        return buffer
+
+    if buffer["step"] == 1:
+        if buffer["lieu"] is not None:
+            return buffer
+        if "text" in message:
+            buffer["lieu"] = message["text"].strip()
+            buffer["step"] = 2
+            buffer["error_sent_2"] = False
+            buffer["consigne_sent_2"] = False
+            reply(sender_id, AR_MSGS["lieu_ok"])
+        elif not buffer.get("consigne_sent_1", False):
+            buffer["consigne_sent_1"] = True
+            reply(sender_id, AR_MSGS["ask_lieu"])
+        return buffer
+
+    if buffer["step"] == 2:
+        if buffer["date"] is not None:
+            return buffer
+        if "text" in message:
+            date_str = message["text"].strip()
+            if is_date_valid(date_str):
+                buffer["date"] = date_str
+                buffer["step"] = 3
+                buffer["error_sent_3"] = False
+                buffer["error_sent_2"] = False
+                buffer["consigne_sent_2"] = False
+                reply(sender_id, AR_MSGS["date_ok"])
+            else:
+                if not buffer.get("error_sent_2", False):
+                    buffer["error_sent_2"] = True
+                    reply(sender_id, AR_MSGS["date_invalid"])
+        elif not buffer.get("consigne_sent_2", False):
+            buffer["consigne_sent_2"] = True
+            reply(sender_id, AR_MSGS["ask_date"])
+        return buffer
+
+    if buffer["step"] == 3 and not buffer.get("finished", False):
+        attachments = message.get("attachments", [])
+        images = [a["payload"]["url"] for a in attachments if a.get("type") == "image"]
+        if images:
+            for url in images:
+                if url not in buffer["photos"]:
+                    buffer["photos"].append(url)
+                    image_cache.prefetch(url)
+            buffer["error_sent_3"] = False
+            reply(sender_id, AR_MSGS["photo_ok"])
+        elif "text" in message and message.get("text", "").strip().lower() == "fin":
+            buffer["finished"] = True
+            reply(sender_id, AR_MSGS["finish_ok"])
+            on_finish(sender_id, buffer)
+            return new_user_buffer()
+        elif not images:
+            if not buffer.get("error_sent_3", False):
+                buffer["error_sent_3"] = True
+                reply(sender_id, AR_MSGS["ask_photo"])
+        return buffer
+    return buffer
+
+def handle_messenger_batch(data, on_finish, reply=None):
+    # Facebook peut regrouper plusieurs événements dans un même POST : on les traite tous,
+    # groupés par expéditeur pour ne charger/sauvegarder son état qu'une fois par lot
+    events_by_sender = OrderedDict()
+    for entry in data.get("entry", []):
+        for event in entry.get("messaging", []):
+            sender_id = event.get("sender", {}).get("id")
+            message = event.get("message", {})
+            if not sender_id or messenger_dedupe.seen(message.get("mid")):
+                continue
+            events_by_sender.setdefault(sender_id, []).append(event)
+    failed = None
+    for sender_id, events in events_by_sender.items():
+        events.sort(key=lambda event: event.get("timestamp", 0))
+        try:
+            buffer = user_buffers.get(sender_id) or new_user_buffer()
+            for event in events:
+                buffer = handle_messenger_event(sender_id, event.get("message", {}), buffer, on_finish, reply)
+            user_buffers[sender_id] = buffer
+        except Exception as e:
+            # Rien n'est enregistré pour cet expéditeur : Facebook renverra le lot (réponse 500),
+            # dont les événements ne doivent pas passer pour des doublons
+            for event in events:
+                messenger_dedupe.forget(event.get("message", {}).get("mid"))
+            failed = failed or e
+    if failed:
+        raise failed
+    return sum(len(events) for events in events_by_sender.values())
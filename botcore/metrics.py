@@ -0,0 +1,147 @@
+import time
+import inspect
+import functools
+import threading
+from bisect import bisect_left
+
+from botcore.tracing import Span
+
+# ----------------------------- MÉTRIQUES (format texte Prometheus) -------------------------------
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRIC_HELP = {
+    "autopost_outbound_call": "appels sortants (Graph API, Messenger, Telegram)",
+    "autopost_handler": "webhooks traités de bout en bout",
+}
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def format_metric_labels(labels):
+    # labels : tuple trié de paires (nom, valeur)
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+def call_failed(result):
+    # Un résultat False ou {"error": ...} compte comme un échec, comme une exception
+    return result is False or (isinstance(result, dict) and "error" in result)
+
+class Metrics:
+    # Histogrammes de latence et compteurs d'échecs du processus, rendus au format texte de Prometheus.
+    # Avec plusieurs workers gunicorn, chaque scrape ne voit que les séries du worker qui répond.
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._histograms = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, labels, failed=False):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                # Un compteur par intervalle (non cumulés), puis la somme et le nombre d'observations
+                hist = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            i = bisect_left(self.buckets, seconds)
+            if i < len(self.buckets):
+                hist[i] += 1
+            hist[-2] += seconds
+            hist[-1] += 1
+            if failed:
+                self._errors[key] = self._errors.get(key, 0) + 1
+
+    def timed(self, name, **labels):
+        # Décorateur pour une fonction ou une coroutine ; l'appel devient aussi un span enfant de la trace en cours
+        def decorator(fn):
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def async_wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    failed = True
+                    try:
+                        with Span(labels.get("call", name)):
+                            result = await fn(*args, **kwargs)
+                        failed = call_failed(result)
+                        return result
+                    finally:
+                        self.observe(name, time.perf_counter() - start, labels, failed)
+                return async_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                failed = True
+                try:
+                    with Span(labels.get("call", name)):
+                        result = fn(*args, **kwargs)
+                    failed = call_failed(result)
+                    return result
+                finally:
+                    self.observe(name, time.perf_counter() - start, labels, failed)
+            return wrapper
+        return decorator
+
+    def render(self, gauges=()):
+        with self._lock:
+            histograms = {key: list(values) for key, values in self._histograms.items()}
+            errors = dict(self._errors)
+        lines = []
+        for name in sorted({name for name, _ in histograms}):
+            series = sorted((labels, values) for (n, labels), values in histograms.items() if n == name)
+            lines.append(f"# HELP {name}_seconds Durée des {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name}_seconds histogram")
+            for labels, values in series:
+                cumulative = 0
+                for bound, count in zip(self.buckets, values):
+                    cumulative += count
+                    lines.append(f"{name}_seconds_bucket{format_metric_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{name}_seconds_bucket{format_metric_labels(labels + (('le', '+Inf'),))} {values[-1]}")
+                lines.append(f"{name}_seconds_sum{format_metric_labels(labels)} {values[-2]:.6f}")
+                lines.append(f"{name}_seconds_count{format_metric_labels(labels)} {values[-1]}")
+            lines.append(f"# HELP {name}_errors_total Échecs des {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name}_errors_total counter")
+            for labels, _ in series:
+                lines.append(f"{name}_errors_total{format_metric_labels(labels)} {errors.get((name, labels), 0)}")
+        for name, help_text, samples in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{format_metric_labels(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics(METRIC_BUCKETS)
+
+# ----------------------------- APPELS TELEGRAM (clients des dialogues) -------------------------------
+def telegram_call_label(step):
+    # send_media_group -> telegram_sendMediaGroup, comme l'endpoint de l'API Bot
+    first, *rest = step.method.split("_")
+    return "telegram_" + first + "".join(part.title() for part in rest)
+
+def timed_calls(call):
+    # Client de run_flow mesuré : une série par méthode du Bot (envoi, édition, album...)
+    def timed(step):
+        start = time.perf_counter()
+        failed = True
+        try:
+            with Span(telegram_call_label(step)):
+                result = call(step)
+            failed = False
+            return result
+        finally:
+            metrics.observe("autopost_outbound_call", time.perf_counter() - start, {"call": telegram_call_label(step)}, failed)
+    return timed
+
+def timed_calls_async(call):
+    async def timed(step):
+        start = time.perf_counter()
+        failed = True
+        try:
+            with Span(telegram_call_label(step)):
+                result = await call(step)
+            failed = False
+            return result
+        finally:
+            metrics.observe("autopost_outbound_call", time.perf_counter() - start, {"call": telegram_call_label(step)}, failed)
+    return timed
@@ -0,0 +1,397 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote, urlencode
+
+from botcore.config import (
+    FB_PUBLISH_MODE, FB_UPLOAD_CONCURRENCY, GRAPH_BATCH_LIMIT, GRAPH_PUBLISH_READ_TIMEOUT, PAGE_ACCESS_TOKEN, PAGE_ID,
+    PUBLISH_LOCK_TTL
+)
+from botcore.graph import graph_request
+from botcore.images import MultipartFileBody, image_cache
+from botcore.metrics import metrics
+from botcore.state import state_store
+
+# ----------------------------- PUBLICATION FACEBOOK -------------------------------
+def chunk_list(lst, n):
+    for i in range(0, len(lst), n):
+        yield lst[i:i + n]
+
+@metrics.timed("autopost_outbound_call", call="photo_upload")
+def upload_photo_to_facebook(image_url):
+    path = image_cache.lookup(image_url)
+    if path:
+        # Photo en cache : on envoie le fichier local, l'URL du CDN a pu expirer depuis
+        body = MultipartFileBody({"published": "false"}, "source", path)
+        try:
+            resp = graph_request(
+                "POST",
+                f"{PAGE_ID}/photos",
+                read_timeout=GRAPH_PUBLISH_READ_TIMEOUT,
+                params={"access_token": PAGE_ACCESS_TOKEN},
+                data=body,
+                headers={"Content-Type": body.content_type}
+            )
+        finally:
+            body.close()
+        return resp.json()
+    resp = graph_request("POST", f"{PAGE_ID}/photos", read_timeout=GRAPH_PUBLISH_READ_TIMEOUT, params={
+        "access_token": PAGE_ACCESS_TOKEN,
+        "url": image_url,
+        "published": False
+    })
+    return resp.json()
+
+def delete_facebook_object(object_id):
+    try:
+        graph_request("DELETE", object_id, params={"access_token": PAGE_ACCESS_TOKEN})
+    except Exception as e:
+        print("Erreur suppression objet Facebook:", object_id, e)
+
+# ----------------------------- JOURNAL DES PUBLICATIONS -------------------------------
+def new_publish_record(draft_id):
+    return {
+        "draft_id": draft_id,
+        "photo_ids": {},
+        "post_id": None,
+        "status": "new",
+        "message": None,
+        "posting_since": None,
+        "scheduled_publish_time": None,
+        "attempts": 0,
+        "last_error": None
+    }
+
+class PublishLog:
+    # Journal des publications par brouillon (store d'état) : media_fbid déjà envoyés, étape en cours
+    # et id du post. Une nouvelle tentative repart de la dernière étape terminée.
+    def __init__(self, store, lock_ttl):
+        self.store = store
+        self.lock_ttl = lock_ttl
+
+    def get(self, draft_id):
+        return self.store.get("publish_attempts", draft_id)
+
+    def begin(self, draft_id):
+        record = self.get(draft_id) or new_publish_record(draft_id)
+        record["attempts"] += 1
+        self.save(record)
+        return record
+
+    def save(self, record):
+        if record["draft_id"]:
+            self.store.set("publish_attempts", record["draft_id"], record)
+
+    def claim(self, draft_id):
+        # Un seul job à la fois par brouillon, y compris entre workers (verrou périmé après lock_ttl)
+        now = time.time()
+        if self.store.add("publish_locks", draft_id, now):
+            return True
+        held_since = self.store.get("publish_locks", draft_id)
+        if held_since is None or now - held_since > self.lock_ttl:
+            self.store.set("publish_locks", draft_id, now)
+            return True
+        return False
+
+    def release(self, draft_id):
+        self.store.delete("publish_locks", draft_id)
+
+    def _drop_unpublished(self, record):
+        if record and not record.get("post_id"):
+            for photo_id in record["photo_ids"].values():
+                delete_facebook_object(photo_id)
+
+    def discard(self, draft_id):
+        # Brouillon refusé ou expiré : les photos envoyées mais jamais publiées sont supprimées
+        self._drop_unpublished(self.get(draft_id))
+        self.store.delete("publish_attempts", draft_id)
+
+    def expire(self, max_idle, max_entries):
+        evicted = self.store.expire("publish_attempts", max_idle, max_entries)
+        for draft_id, record in evicted:
+            self._drop_unpublished(record)
+        self.store.expire("publish_locks", self.lock_ttl, max_entries)
+        return len(evicted)
+
+    def __len__(self):
+        return self.store.count("publish_attempts")
+
+publish_log = PublishLog(state_store, PUBLISH_LOCK_TTL)
+
+def mark_posting(record, message):
+    # Avant l'appel /feed : si la réponse se perd, la reprise vérifiera si ce post existe déjà
+    record["status"] = "posting"
+    record["message"] = message
+    record["posting_since"] = time.time()
+    publish_log.save(record)
+
+def feed_schedule_fields(record):
+    # Post programmé côté Graph : créé non publié, Facebook le sort à scheduled_publish_time
+    if not record.get("scheduled_publish_time"):
+        return {}
+    return {"published": "false", "scheduled_publish_time": str(int(record["scheduled_publish_time"]))}
+
+def media_rejected(error, photo_ids):
+    # Le code 100 couvre tout paramètre invalide : seuls les refus qui visent les photos
+    # (media_fbid expirés ou supprimés) obligent à les renvoyer
+    if not isinstance(error, dict) or error.get("code") != 100:
+        return False
+    text = " ".join(str(error.get(key) or "") for key in ("message", "error_user_msg")).lower()
+    return "attached_media" in text or "media_fbid" in text or any(pid in text for pid in photo_ids)
+
+def find_existing_post(record):
+    # Un appel /feed resté sans réponse a pu aboutir. Renvoie l'id du post s'il existe, None sinon ;
+    # lève une exception quand Graph ne permet pas de trancher
+    photo_ids = list(record["photo_ids"].values())
+    if photo_ids:
+        # Les photos attachées à un post portent son page_story_id
+        data = graph_request("GET", "", params={
+            "access_token": PAGE_ACCESS_TOKEN,
+            "ids": ",".join(photo_ids),
+            "fields": "page_story_id"
+        }).json()
+        if "error" in data:
+            raise RuntimeError(data["error"].get("message", data["error"]))
+        for item in data.values():
+            if isinstance(item, dict) and item.get("page_story_id"):
+                return item["page_story_id"]
+        return None
+    # Sans photo enregistrée (post texte, batch sans réponse) : même message dans le fil de la page,
+    # ou parmi ses posts programmés
+    edge = "scheduled_posts" if record.get("scheduled_publish_time") else "feed"
+    data = graph_request("GET", f"{PAGE_ID}/{edge}", params={
+        "access_token": PAGE_ACCESS_TOKEN,
+        "fields": "id,message",
+        "since": int(record["posting_since"] or 0) - 60,
+        "limit": 25
+    }).json()
+    if "error" in data:
+        raise RuntimeError(data["error"].get("message", data["error"]))
+    for post in data.get("data", []):
+        if post.get("message") == record["message"]:
+            return post["id"]
+    return None
+
+def upload_photos_to_facebook(image_urls, progress=None, on_uploaded=None):
+    # Upload concurrent, mais les ids restent dans l'ordre des photos
+    photo_ids = [None] * len(image_urls)
+    errors = []
+    done = 0
+    workers = max(1, min(FB_UPLOAD_CONCURRENCY, len(image_urls)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(upload_photo_to_facebook, url): i for i, url in enumerate(image_urls)}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            try:
+                res = fut.result()
+            except Exception as e:
+                res = {"error": {"message": str(e)}}
+            if "id" in res:
+                photo_ids[i] = res["id"]
+                if on_uploaded:
+                    on_uploaded(image_urls[i], res["id"])
+            else:
+                errors.append({"index": i, "url": image_urls[i], "error": res.get("error", res)})
+            done += 1
+            if progress:
+                progress(done, len(image_urls))
+    errors.sort(key=lambda err: err["index"])
+    return photo_ids, errors
+
+@metrics.timed("autopost_outbound_call", call="graph_batch")
+def graph_batch(operations):
+    resp = graph_request("POST", "", read_timeout=GRAPH_PUBLISH_READ_TIMEOUT, data={
+        "access_token": PAGE_ACCESS_TOKEN,
+        "batch": json.dumps(operations),
+        "include_headers": "false"
+    })
+    return resp.json()
+
+def parse_batch_item(item):
+    # Chaque élément du batch : {"code": ..., "body": "<json>"} ou null si une dépendance a échoué
+    if not item:
+        return {"error": {"message": "Requête du batch non exécutée."}}
+    try:
+        body = json.loads(item.get("body") or "{}")
+    except ValueError:
+        body = {"error": {"message": item.get("body")}}
+    if item.get("code") != 200 and "error" not in body:
+        body = {"error": {"message": f"HTTP {item.get('code')}", "body": body}}
+    return body
+
+def photo_batch_operation(name, image_url):
+    return {
+        "method": "POST",
+        "name": name,
+        "relative_url": f"{PAGE_ID}/photos",
+        "body": urlencode({"url": image_url, "published": "false"}),
+        "omit_response_on_success": False
+    }
+
+def feed_batch_operation(message, media_refs, extra=None):
+    # Les références JSONPath ({result=photoN:$.id}) doivent rester telles quelles dans le body
+    body = "message=" + quote(message, safe="")
+    for i, ref in enumerate(media_refs):
+        body += f"&attached_media[{i}]=" + json.dumps({"media_fbid": ref})
+    if extra:
+        body += "&" + urlencode(extra)
+    return {"method": "POST", "relative_url": f"{PAGE_ID}/feed", "body": body}
+
+@metrics.timed("autopost_outbound_call", call="feed_post")
+def post_to_feed(**kwargs):
+    resp = graph_request("POST", f"{PAGE_ID}/feed", read_timeout=GRAPH_PUBLISH_READ_TIMEOUT, **kwargs)
+    return resp.json()
+
+def create_feed_post(message, photo_ids, photo_errors, record):
+    attached_media = [{"media_fbid": pid} for pid in photo_ids]
+    mark_posting(record, message)
+    try:
+        result = post_to_feed(
+            params={"access_token": PAGE_ACCESS_TOKEN},
+            json={"message": message, "attached_media": attached_media, **feed_schedule_fields(record)}
+        )
+    except Exception as e:
+        # Issue inconnue (timeout...) : le post existe peut-être, la reprise vérifiera avant de republier
+        result = {"error": {"message": str(e)}, "outcome_unknown": True}
+    return finish_feed_post(result, photo_errors, record)
+
+def finish_feed_post(result, photo_errors, record):
+    if "id" in result:
+        record["post_id"] = result["id"]
+        record["status"] = "done"
+        if record.get("scheduled_publish_time"):
+            result["scheduled_publish_time"] = record["scheduled_publish_time"]
+    elif not result.get("outcome_unknown"):
+        record["status"] = "failed"
+        if media_rejected(result.get("error"), record["photo_ids"].values()):
+            # La prochaine tentative renverra les photos ; les autres échecs gardent leurs media_fbid
+            for pid in record["photo_ids"].values():
+                delete_facebook_object(pid)
+            record["photo_ids"] = {}
+    record["last_error"] = result.get("error")
+    publish_log.save(record)
+    if photo_errors:
+        result["photo_errors"] = photo_errors
+    return result
+
+def publish_on_facebook_batch(message, image_urls, progress, record):
+    # Les photos déjà envoyées lors d'une tentative précédente sont référencées directement par leur id
+    photo_ids = [record["photo_ids"].get(url) for url in image_urls]
+    missing = [i for i, pid in enumerate(photo_ids) if not pid]
+    feed_result = None
+    single_batch = len(missing) < GRAPH_BATCH_LIMIT
+    for start in range(0, len(missing), GRAPH_BATCH_LIMIT):
+        chunk = missing[start:start + GRAPH_BATCH_LIMIT]
+        operations = [photo_batch_operation(f"photo{i}", image_urls[i]) for i in chunk]
+        if single_batch:
+            refs = [pid or f"{{result=photo{i}:$.id}}" for i, pid in enumerate(photo_ids)]
+            operations.append(feed_batch_operation(message, refs, feed_schedule_fields(record)))
+            mark_posting(record, message)
+        try:
+            results = graph_batch(operations)
+        except Exception as e:
+            if single_batch:
+                # Le post a pu être créé : pas de bascule qui risquerait de publier deux fois
+                return finish_feed_post({"error": {"message": str(e)}, "outcome_unknown": True}, [], record)
+            results = {"error": {"message": str(e)}}
+        if not isinstance(results, list):
+            print("Erreur batch Graph API:", results)
+            continue
+        for j, i in enumerate(chunk):
+            res = parse_batch_item(results[j] if j < len(results) else None)
+            if "id" in res:
+                photo_ids[i] = res["id"]
+                record["photo_ids"][image_urls[i]] = res["id"]
+        publish_log.save(record)
+        if progress:
+            progress(sum(1 for pid in photo_ids if pid), len(image_urls))
+        if single_batch and len(results) > len(chunk):
+            feed_result = parse_batch_item(results[len(chunk)])
+
+    if feed_result is not None and "id" in feed_result:
+        return finish_feed_post(feed_result, [], record)
+    if feed_result is not None:
+        print("Erreur publication batch, bascule en mode séquentiel:", feed_result.get("error"))
+
+    # Échec partiel : on renvoie une à une les photos manquantes puis on crée le post
+    photo_errors = []
+    for i, url in enumerate(image_urls):
+        if photo_ids[i]:
+            continue
+        try:
+            res = upload_photo_to_facebook(url)
+        except Exception as e:
+            res = {"error": {"message": str(e)}}
+        if "id" in res:
+            photo_ids[i] = res["id"]
+            record["photo_ids"][url] = res["id"]
+            publish_log.save(record)
+        else:
+            photo_errors.append({"index": i, "url": url, "error": res.get("error", res)})
+        if progress:
+            progress(sum(1 for pid in photo_ids if pid), len(image_urls))
+    uploaded = [pid for pid in photo_ids if pid]
+    if not uploaded:
+        return {"error": {"message": "Aucune photo n'a pu être envoyée."}, "photo_errors": photo_errors}
+    return create_feed_post(message, uploaded, photo_errors, record)
+
+def publish_on_facebook(message, image_urls=None, progress=None, record=None):
+    if record is None:
+        record = new_publish_record(None)
+    if not image_urls:
+        mark_posting(record, message)
+        try:
+            result = post_to_feed(params={
+                "access_token": PAGE_ACCESS_TOKEN,
+                "message": message,
+                **feed_schedule_fields(record)
+            })
+        except Exception as e:
+            result = {"error": {"message": str(e)}, "outcome_unknown": True}
+        return finish_feed_post(result, [], record)
+    if FB_PUBLISH_MODE == "batch":
+        return publish_on_facebook_batch(message, image_urls, progress, record)
+
+    # Reprise : seules les photos sans media_fbid enregistré sont envoyées
+    already = sum(1 for url in image_urls if url in record["photo_ids"])
+    missing = [url for url in image_urls if url not in record["photo_ids"]]
+
+    def on_uploaded(url, photo_id):
+        record["photo_ids"][url] = photo_id
+        publish_log.save(record)
+
+    def report(done, total):
+        progress(already + done, len(image_urls))
+
+    photo_ids, photo_errors = upload_photos_to_facebook(missing, report if progress else None, on_uploaded)
+    for err in photo_errors:
+        err["index"] = image_urls.index(err["url"])
+        print(f"Erreur upload photo {err['index'] + 1}/{len(image_urls)}:", err["error"])
+    uploaded = [record["photo_ids"][url] for url in image_urls if url in record["photo_ids"]]
+    if not uploaded:
+        return {"error": {"message": "Aucune photo n'a pu être envoyée."}, "photo_errors": photo_errors}
+    return create_feed_post(message, uploaded, photo_errors, record)
+
+def publish_draft(draft_id, message, image_urls, progress=None, scheduled_time=None):
+    # Idempotent : un brouillon déjà publié renvoie son post, une reprise repart de la dernière étape
+    if not publish_log.claim(draft_id):
+        return {"error": {"message": "Publication déjà en cours pour ce brouillon."}}
+    try:
+        record = publish_log.begin(draft_id)
+        if record.get("post_id"):
+            return {"id": record["post_id"], "resumed": True}
+        if record["status"] == "posting":
+            try:
+                post_id = find_existing_post(record)
+            except Exception as e:
+                # Le dernier envoi a peut-être abouti : pas de nouvel essai à l'aveugle
+                print("Erreur vérification post existant:", e)
+                return {"error": {"message": "Impossible de vérifier si la tentative précédente a été publiée, réessayez plus tard."}}
+            if post_id:
+                return finish_feed_post({"id": post_id, "resumed": True}, [], record)
+        # Vérification faite avec l'heure de la tentative précédente : celle-ci part avec la sienne
+        record["scheduled_publish_time"] = scheduled_time
+        publish_log.save(record)
+        return publish_on_facebook(message, image_urls, progress, record)
+    finally:
+        publish_log.release(draft_id)
@@ -0,0 +1,189 @@
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from telegram.error import RetryAfter
+
+from botcore.config import (
+    GRAPH_BURST, GRAPH_RATE, GRAPH_THROTTLE_BACKOFF, GRAPH_THROTTLE_CODES, GRAPH_USAGE_SLOWDOWN, PAGE_ID,
+    RATE_LIMIT_MAX_RETRIES, RATE_LIMIT_MAX_WAIT, RATE_LIMIT_RECOVERY, TELEGRAM_CHAT_RATE_PER_MINUTE,
+    TELEGRAM_GLOBAL_RATE
+)
+
+# ----------------------------- LIMITEUR DE DÉBIT (Graph API et Telegram) -------------------------------
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # factor < 1 : débit réduit après un refus ou un quota proche de la limite, remonte avec le temps
+        self.factor = 1.0
+        self.blocked_until = 0.0
+
+    def reserve(self, cost, now):
+        # Consomme cost jetons (quitte à passer en négatif) et renvoie l'attente nécessaire
+        elapsed = max(0.0, now - self.updated)
+        self.factor = min(1.0, self.factor + elapsed * RATE_LIMIT_RECOVERY)
+        rate = self.rate * self.factor
+        self.tokens = min(self.capacity, self.tokens + elapsed * rate) - cost
+        self.updated = now
+        delay = -self.tokens / rate if self.tokens < 0 else 0.0
+        return max(delay, self.blocked_until - now)
+
+class RateLimiter:
+    # Un seau à jetons par (API, cible) : page Facebook, quota de l'application, chat Telegram.
+    # Les appels attendent leur tour au lieu d'échouer ; les refus (retry_after, Retry-After) et les
+    # en-têtes d'usage Graph ralentissent le seau concerné.
+    def __init__(self, limits, max_buckets=1000):
+        self.limits = limits
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"waits": 0, "waited_seconds": 0.0, "throttled": 0}
+
+    def _bucket(self, api, target):
+        key = (api, str(target))
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            rate, capacity = self.limits.get(key) or self.limits[api]
+            bucket = self._buckets[key] = TokenBucket(rate, capacity)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        return bucket
+
+    def reserve(self, api, target, cost=1):
+        with self._lock:
+            delay = self._bucket(api, target).reserve(cost, time.monotonic())
+            if delay > 0:
+                self.stats["waits"] += 1
+                self.stats["waited_seconds"] += delay
+        return delay
+
+    def throttle(self, api, target, retry_after):
+        with self._lock:
+            bucket = self._bucket(api, target)
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + retry_after)
+            bucket.factor = max(0.05, bucket.factor / 2)
+            self.stats["throttled"] += 1
+
+    def observe_usage(self, api, target, percent):
+        # Quotas en pourcentage (X-App-Usage, X-Page-Usage) : on freine avant d'atteindre 100 %
+        if percent < GRAPH_USAGE_SLOWDOWN:
+            return
+        with self._lock:
+            bucket = self._bucket(api, target)
+            bucket.factor = min(bucket.factor, max(0.05, (100 - percent) / (100 - GRAPH_USAGE_SLOWDOWN)))
+            if percent >= 100:
+                bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + GRAPH_THROTTLE_BACKOFF)
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            slowed = {
+                f"{api}:{target}": {"factor": round(bucket.factor, 2), "blocked_for": round(max(0.0, bucket.blocked_until - now), 1)}
+                for (api, target), bucket in self._buckets.items()
+                if bucket.factor < 1 or bucket.blocked_until > now
+            }
+            return dict(self.stats, buckets=len(self._buckets), slowed=slowed)
+
+rate_limiter = RateLimiter({
+    "graph": (GRAPH_RATE, GRAPH_BURST),
+    "telegram": (TELEGRAM_CHAT_RATE_PER_MINUTE / 60, int(TELEGRAM_CHAT_RATE_PER_MINUTE)),
+    ("telegram", "global"): (TELEGRAM_GLOBAL_RATE, int(TELEGRAM_GLOBAL_RATE)),
+})
+
+# ----------------------------- GRAPH API -------------------------------
+def graph_reserve():
+    return max(rate_limiter.reserve("graph", "app"), rate_limiter.reserve("graph", PAGE_ID))
+
+def graph_usage_percent(header):
+    if not header:
+        return None
+    try:
+        usage = json.loads(header)
+    except ValueError:
+        return None
+    values = [value for value in usage.values() if isinstance(value, (int, float))]
+    return max(values) if values else None
+
+def observe_graph_response(resp):
+    # Réponse requests ou httpx. Renvoie le délai avant un nouvel essai si Graph a refusé l'appel
+    # pour dépassement de quota (appel non exécuté, donc rejouable), None sinon
+    for header, target in (("X-App-Usage", "app"), ("X-Page-Usage", PAGE_ID)):
+        percent = graph_usage_percent(resp.headers.get(header))
+        if percent is not None:
+            rate_limiter.observe_usage("graph", target, percent)
+    if resp.status_code < 400:
+        return None
+    try:
+        code = resp.json().get("error", {}).get("code")
+    except ValueError:
+        code = None
+    if resp.status_code != 429 and code not in GRAPH_THROTTLE_CODES:
+        return None
+    try:
+        retry_after = float(resp.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        retry_after = GRAPH_THROTTLE_BACKOFF
+    rate_limiter.throttle("graph", "app" if code == 4 else PAGE_ID, retry_after)
+    return retry_after
+
+def should_retry(retry_after, attempt):
+    return retry_after is not None and attempt < RATE_LIMIT_MAX_RETRIES and retry_after <= RATE_LIMIT_MAX_WAIT
+
+# ----------------------------- TELEGRAM (clients des dialogues) -------------------------------
+def telegram_reserve(chat_id, cost=1):
+    delay = rate_limiter.reserve("telegram", "global", cost)
+    if chat_id is not None:
+        delay = max(delay, rate_limiter.reserve("telegram", chat_id, cost))
+    return delay
+
+def telegram_cost(kwargs):
+    # Un album compte pour autant de messages que de photos dans la limite par chat
+    media = kwargs.get("media")
+    return len(media) if isinstance(media, (list, tuple)) else 1
+
+def telegram_throttled(step, error, attempt):
+    # RetryAfter reçu pour step : freine le seau concerné et dit s'il faut rejouer l'appel
+    retry_after = float(error.retry_after)
+    if not should_retry(retry_after, attempt):
+        return False
+    print(f"Telegram limite le débit ({step.method}), nouvel essai dans {retry_after:.0f}s")
+    chat_id = step.kwargs.get("chat_id")
+    rate_limiter.throttle("telegram", "global" if chat_id is None else chat_id, retry_after)
+    for value in step.kwargs.values():
+        # Fichier déjà lu par la tentative refusée
+        if hasattr(value, "seek"):
+            value.seek(0)
+    return True
+
+def rate_limited(call):
+    # Client de run_flow derrière le limiteur : attend son jeton, respecte retry_after avant de rejouer
+    def limited(step):
+        for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+            delay = telegram_reserve(step.kwargs.get("chat_id"), telegram_cost(step.kwargs))
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                return call(step)
+            except RetryAfter as e:
+                if not telegram_throttled(step, e, attempt):
+                    raise
+    return limited
+
+def rate_limited_async(call):
+    # Même chose pour run_flow_async : l'attente ne bloque pas la boucle
+    async def limited(step):
+        for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+            delay = telegram_reserve(step.kwargs.get("chat_id"), telegram_cost(step.kwargs))
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await call(step)
+            except RetryAfter as e:
+                if not telegram_throttled(step, e, attempt):
+                    raise
+    return limited
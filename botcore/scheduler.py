@@ -0,0 +1,180 @@
+import os
+import time
+import threading
+from concurrent.futures import wait
+
+from botcore.config import (
+    GRAPH_SCHEDULE_MIN_LEAD, PUBLISH_GRAPH_SCHEDULE, PUBLISH_MAX_PER_HOUR, PUBLISH_QUIET_HOURS,
+    PUBLISH_SCHEDULER_INTERVAL, PUBLISH_SCHEDULER_LEASE_TTL, PUBLISH_SPACING
+)
+from botcore.state import Lease, state_store
+
+# ----------------------------- FILE DE PUBLICATION (espacement, plafond horaire, heures creuses) -------------------------------
+class PublishQueue:
+    # File persistante des brouillons validés. Les heures de sortie se déduisent des dernières
+    # publications (espacement, plafond sur une heure glissante) puis sautent les heures creuses.
+    def __init__(self, store, spacing, max_per_hour, quiet_hours, schedule_lead=None):
+        self.store = store
+        self.spacing = spacing
+        self.max_per_hour = max_per_hour
+        self.quiet_hours = quiet_hours if len(quiet_hours) == 2 else None
+        self.schedule_lead = schedule_lead
+
+    def push(self, draft_id, chat_id, message_id, has_photo):
+        self.store.set("publish_queue", draft_id, {
+            "draft_id": draft_id, "chat_id": chat_id, "message_id": message_id,
+            "has_photo": has_photo, "queued_at": time.time()
+        })
+
+    def entries(self):
+        entries = [self.store.get("publish_queue", key) for key in self.store.keys("publish_queue")]
+        return sorted((entry for entry in entries if entry), key=lambda entry: entry["queued_at"])
+
+    def releases(self, now):
+        return [t for t in self.store.get("publish_history", "releases", []) if t > now - 3600]
+
+    def after_quiet_hours(self, ts):
+        if not self.quiet_hours:
+            return ts
+        start, end = self.quiet_hours
+        lt = time.localtime(ts)
+        if start <= end:
+            quiet = start <= lt.tm_hour < end
+        else:
+            quiet = lt.tm_hour >= start or lt.tm_hour < end
+        if not quiet:
+            return ts
+        # Fin des heures creuses : aujourd'hui à end:00, ou demain si elles ont commencé avant minuit
+        day = lt.tm_mday + (1 if start > end and lt.tm_hour >= start else 0)
+        return time.mktime((lt.tm_year, lt.tm_mon, day, end, 0, 0, 0, 0, -1))
+
+    def slots(self, count, now):
+        releases = self.releases(now)
+        slots = []
+        t = now
+        for _ in range(count):
+            if releases:
+                t = max(t, releases[-1] + self.spacing)
+            if self.max_per_hour and len(releases) >= self.max_per_hour:
+                t = max(t, releases[-self.max_per_hour] + 3600)
+            t = self.after_quiet_hours(t)
+            slots.append(t)
+            releases.append(t)
+        return slots
+
+    def schedule(self, now=None):
+        # [(entrée, heure de sortie prévue)] dans l'ordre de la file
+        now = now or time.time()
+        entries = self.entries()
+        return list(zip(entries, self.slots(len(entries), now)))
+
+    def position(self, draft_id):
+        for i, (entry, eta) in enumerate(self.schedule()):
+            if entry["draft_id"] == draft_id:
+                return i + 1, eta
+        return None, None
+
+    def pop_due(self, now):
+        # Sort la tête de file si son heure est venue ; avec schedule_lead, une sortie assez lointaine
+        # est confiée tout de suite à Graph (scheduled_publish_time) au lieu d'attendre ici.
+        entries = self.entries()
+        if not entries:
+            return None
+        entry = entries[0]
+        slot = self.slots(1, now)[0]
+        if slot <= now:
+            entry["scheduled_time"] = None
+        elif self.schedule_lead is not None and slot - now >= self.schedule_lead:
+            entry["scheduled_time"] = slot
+        else:
+            return None
+        self.store.delete("publish_queue", entry["draft_id"])
+        self.store.set("publish_history", "releases", self.releases(now) + [entry["scheduled_time"] or now])
+        return entry
+
+    def restore(self, entry):
+        # Remet une entrée sortie sans avoir été publiée à sa place d'origine (même queued_at)
+        self.store.set("publish_queue", entry["draft_id"], entry)
+
+    def __len__(self):
+        return self.store.count("publish_queue")
+
+publish_queue = PublishQueue(
+    state_store, PUBLISH_SPACING, PUBLISH_MAX_PER_HOUR, PUBLISH_QUIET_HOURS,
+    GRAPH_SCHEDULE_MIN_LEAD if PUBLISH_GRAPH_SCHEDULE else None
+)
+publish_lease = Lease(state_store, "publish_scheduler", PUBLISH_SCHEDULER_LEASE_TTL)
+
+def queue_status_text(position, eta):
+    if position is None:
+        return "⏳ Publication en cours…"
+    when = time.localtime(eta)
+    day = "" if time.strftime("%d/%m") == time.strftime("%d/%m", when) else time.strftime("le %d/%m ", when)
+    return f"🕒 Validé, en file de publication : position {position}, sortie prévue {day}vers {time.strftime('%H:%M', when)}."
+
+class PublishScheduler:
+    # Tous les processus ajoutent à la file ; seul le détenteur du bail la vide, un post à la fois.
+    # release(entry) lance la publication et renvoie son Future ; on_released() suit chaque sortie.
+    def __init__(self, queue, lease, interval):
+        self.queue = queue
+        self.lease = lease
+        self.interval = interval
+        self.release = None
+        self.on_released = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self.released = 0
+
+    def ensure_started(self, release, on_released):
+        # Un thread par processus, démarré au boot du worker (après le fork)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.release = release
+            self.on_released = on_released
+            self._stopped.clear()
+            threading.Thread(target=self._run, name="publish-scheduler", daemon=True).start()
+            self._pid = os.getpid()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                while self.tick():
+                    pass
+            except Exception as e:
+                print("Erreur planificateur de publication :", e)
+
+    def tick(self):
+        if self._stopped.is_set() or not self.lease.acquire():
+            return False
+        entry = self.queue.pop_due(time.time())
+        if not entry:
+            return False
+        try:
+            job = self.release(entry)
+        except Exception:
+            # Publication non lancée (boucle Telegram absente, pool fermé à l'arrêt) : l'entrée
+            # reprend sa place pour le prochain tour, ici ou dans un autre processus
+            self.queue.restore(entry)
+            raise
+        # Bail renouvelé pendant la publication : aucun autre processus ne sort le post suivant
+        while wait([job], timeout=self.interval).not_done:
+            self.lease.acquire()
+        self.released += 1
+        self.on_released()
+        return True
+
+publish_scheduler = PublishScheduler(publish_queue, publish_lease, PUBLISH_SCHEDULER_INTERVAL)
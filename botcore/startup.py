@@ -0,0 +1,142 @@
+import os
+import time
+import threading
+
+from botcore.config import (
+    DEPLOYMENT_ID, IMAGE_NORMALIZE, TELEGRAM_TOKEN, TELEGRAM_WEBHOOK_URL, WEBHOOK_MARKER_TTL, WEBHOOK_REGISTER_RETRY
+)
+from botcore.flows import tg
+from botcore.graph import get_graph_session
+from botcore.images import warm_up_image_workers
+from botcore.state import Lease, state_store
+
+# ----------------------------- DÉMARRAGE (webhook Telegram, disponibilité) -------------------------------
+class WebhookRegistration:
+    # Inscription une fois par déploiement, hors du chemin des requêtes : getWebhookInfo d'abord,
+    # setWebhook seulement si l'URL diffère. Le marqueur gardé dans le store (partagé avec SQLite)
+    # évite l'appel aux autres workers et aux redémarrages ; le bail empêche deux workers
+    # d'interroger Telegram en même temps.
+    def __init__(self, store, url, deployment_id, marker_ttl, retry_interval):
+        self.store = store
+        self.url = url
+        self.deployment_id = deployment_id
+        self.marker_ttl = marker_ttl
+        self.retry_interval = retry_interval
+        self.lease = Lease(store, "telegram_webhook", retry_interval)
+        self.status = "not_started" if TELEGRAM_TOKEN and url else "disabled"
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def enabled(self):
+        if self.status == "disabled":
+            print("TELEGRAM_TOKEN ou WEBSITE_HOSTNAME/WEBHOOK_URL manquant : webhook Telegram NON configuré")
+            return False
+        return True
+
+    def marked(self):
+        marker = self.store.get("deployment", "telegram_webhook")
+        return (
+            marker is not None and marker["url"] == self.url and marker["deployment"] == self.deployment_id
+            and marker["registered_at"] > time.time() - self.marker_ttl
+        )
+
+    def register(self):
+        # Dialogue exécuté par le client Telegram de l'application ; renvoie True une fois l'URL inscrite
+        self.status = "pending"
+        if self.marked():
+            self.status = "registered"
+            return True
+        if not self.lease.acquire():
+            # Un autre worker s'en charge ; on relira le marqueur au prochain tour
+            return False
+        try:
+            info = yield tg.get_webhook_info()
+            if (info.get("url") if isinstance(info, dict) else info.url) != self.url:
+                yield tg.set_webhook(url=self.url)
+                print("Webhook Telegram configuré sur :", self.url)
+            self.store.set("deployment", "telegram_webhook", {
+                "url": self.url, "deployment": self.deployment_id, "registered_at": time.time()
+            })
+            self.status = "registered"
+            return True
+        finally:
+            self.lease.release()
+
+    def failed(self, error):
+        self.status = "error"
+        print("Erreur configuration webhook Telegram :", error)
+
+    def ensure_started(self, run):
+        # Thread par processus, démarré au boot du worker : run(flow) exécute le dialogue et renvoie son résultat
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            if self.enabled():
+                threading.Thread(target=self._run, args=(run,), name="webhook-registration", daemon=True).start()
+
+    def _run(self, run):
+        while True:
+            try:
+                if run(self.register()):
+                    return
+            except Exception as e:
+                self.failed(e)
+            time.sleep(self.retry_interval)
+
+webhook_registration = WebhookRegistration(
+    state_store, TELEGRAM_WEBHOOK_URL, DEPLOYMENT_ID, WEBHOOK_MARKER_TTL, WEBHOOK_REGISTER_RETRY
+)
+
+class Readiness:
+    # Préchauffage en arrière-plan (base d'état, session Graph, processus du pool d'images) : /ready
+    # répond 503 jusqu'à la fin, pour que la plateforme n'envoie du trafic qu'aux workers prêts.
+    # require() ajoute une condition propre au point d'entrée (boucle de polling d'autopost...).
+    def __init__(self):
+        self.checks = {}
+        self.warmup_seconds = None
+        self.image_processes = 0
+        self._pid = None
+        self._ready_pid = None
+        self._lock = threading.Lock()
+
+    def require(self, name, check):
+        self.checks[name] = check
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name="warmup", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        start = time.perf_counter()
+        while True:
+            try:
+                state_store.count("leases")
+                get_graph_session()
+                if IMAGE_NORMALIZE:
+                    self.image_processes = len(warm_up_image_workers())
+                break
+            except Exception as e:
+                print("Erreur préchauffage :", e)
+                time.sleep(1)
+        self.warmup_seconds = round(time.perf_counter() - start, 3)
+        self._ready_pid = os.getpid()
+
+    def status(self):
+        checks = {name: bool(check()) for name, check in self.checks.items()}
+        return {
+            "ready": self._ready_pid == os.getpid() and all(checks.values()),
+            "warmup_seconds": self.warmup_seconds,
+            "image_processes": self.image_processes,
+            "checks": checks,
+            "telegram_webhook": webhook_registration.status,
+        }
+
+readiness = Readiness()
@@ -0,0 +1,524 @@
+import os
+import json
+import time
+import sqlite3
+import uuid
+import threading
+from collections import OrderedDict
+
+from botcore.config import STATE_BACKEND, STATE_CACHE_SIZE, STATE_DB_PATH
+
+# ----------------------------- STOCKAGE DE L'ÉTAT (mémoire ou SQLite) -------------------------------
+class MemoryStateStore:
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.RLock()
+
+    # Valeurs stockées en JSON : get() renvoie une copie, comme avec SQLite.
+    # Chaque espace de noms est un OrderedDict trié par dernière écriture (ordre LRU).
+    def get(self, ns, key, default=None):
+        with self._lock:
+            entry = self._data.get(ns, {}).get(str(key))
+        return default if entry is None else json.loads(entry[0])
+
+    def set(self, ns, key, value):
+        raw = json.dumps(value)
+        with self._lock:
+            entries = self._data.setdefault(ns, OrderedDict())
+            entries[str(key)] = (raw, time.time())
+            entries.move_to_end(str(key))
+
+    def delete(self, ns, key):
+        with self._lock:
+            self._data.get(ns, {}).pop(str(key), None)
+
+    def keys(self, ns, prefix=""):
+        with self._lock:
+            return [k for k in self._data.get(ns, {}) if k.startswith(prefix)]
+
+    def count(self, ns):
+        with self._lock:
+            return len(self._data.get(ns, {}))
+
+    def count_by(self, ns, field):
+        # Nombre d'entrées par valeur de field (None si absent), en un seul passage
+        with self._lock:
+            raws = [raw for raw, _ in self._data.get(ns, {}).values()]
+        counts = {}
+        for raw in raws:
+            value = json.loads(raw)
+            group = value.get(field) if isinstance(value, dict) else None
+            counts[group] = counts.get(group, 0) + 1
+        return counts
+
+    def add(self, ns, key, value):
+        # Insère seulement si la clé est absente ; renvoie True si l'insertion a eu lieu
+        with self._lock:
+            entries = self._data.setdefault(ns, OrderedDict())
+            if str(key) in entries:
+                return False
+            entries[str(key)] = (json.dumps(value), time.time())
+            return True
+
+    def replace(self, ns, key, expected, value):
+        # Compare-and-set : écrit seulement si la valeur actuelle vaut encore expected
+        with self._lock:
+            entries = self._data.get(ns, {})
+            entry = entries.get(str(key))
+            if entry is None or entry[0] != json.dumps(expected):
+                return False
+            entries[str(key)] = (json.dumps(value), time.time())
+            entries.move_to_end(str(key))
+            return True
+
+    def expire(self, ns, max_idle, max_entries):
+        # Supprime les entrées inactives depuis max_idle secondes, puis les plus anciennes au-delà de max_entries
+        cutoff = time.time() - max_idle
+        evicted = []
+        with self._lock:
+            entries = self._data.get(ns)
+            while entries:
+                key, (raw, updated_at) = next(iter(entries.items()))
+                if updated_at >= cutoff and len(entries) <= max_entries:
+                    break
+                del entries[key]
+                evicted.append((key, json.loads(raw)))
+        return evicted
+
+class SQLiteStateStore:
+    # Base partagée entre workers (mode WAL) avec un petit cache LRU par processus.
+    # Le cache est vidé dès que PRAGMA data_version signale une écriture d'une autre connexion.
+    def __init__(self, path, cache_size):
+        self.path = path
+        self.cache_size = cache_size
+        self._local = threading.local()
+        self._cache = OrderedDict()
+        self._cache_pid = os.getpid()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        if getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated_at REAL NOT NULL, "
+                "PRIMARY KEY (ns, key)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS state_updated_at ON state (ns, updated_at)")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.data_version = None
+        with self._lock:
+            if self._cache_pid != os.getpid():
+                self._cache.clear()
+                self._cache_pid = os.getpid()
+        conn = self._local.conn
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._local.data_version:
+            self._local.data_version = version
+            with self._lock:
+                self._cache.clear()
+        return conn
+
+    def _remember(self, cache_key, raw, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._cache[cache_key] = raw
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def get(self, ns, key, default=None):
+        conn = self._conn()
+        cache_key = (ns, str(key))
+        with self._lock:
+            if cache_key in self._cache:
+                self._cache.move_to_end(cache_key)
+                raw = self._cache[cache_key]
+                return default if raw is None else json.loads(raw)
+            generation = self._generation
+        row = conn.execute("SELECT value FROM state WHERE ns = ? AND key = ?", cache_key).fetchone()
+        raw = row[0] if row else None
+        self._remember(cache_key, raw, generation)
+        return default if raw is None else json.loads(raw)
+
+    def set(self, ns, key, value):
+        conn = self._conn()
+        raw = json.dumps(value)
+        with self._lock:
+            self._generation += 1
+        conn.execute(
+            "INSERT OR REPLACE INTO state (ns, key, value, updated_at) VALUES (?, ?, ?, ?)",
+            (ns, str(key), raw, time.time())
+        )
+        self._remember((ns, str(key)), raw)
+
+    def delete(self, ns, key):
+        conn = self._conn()
+        with self._lock:
+            self._generation += 1
+        conn.execute("DELETE FROM state WHERE ns = ? AND key = ?", (ns, str(key)))
+        self._remember((ns, str(key)), None)
+
+    def keys(self, ns, prefix=""):
+        rows = self._conn().execute(
+            "SELECT key FROM state WHERE ns = ? AND key >= ? AND key < ?",
+            (ns, prefix, prefix + "\uffff")
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self, ns):
+        return self._conn().execute("SELECT COUNT(*) FROM state WHERE ns = ?", (ns,)).fetchone()[0]
+
+    def count_by(self, ns, field):
+        # Agrégat côté SQLite : une requête, sans relire ni décoder chaque valeur dans Python
+        rows = self._conn().execute(
+            "SELECT json_extract(value, ?), COUNT(*) FROM state WHERE ns = ? GROUP BY 1",
+            (f"$.{field}", ns)
+        ).fetchall()
+        return dict(rows)
+
+    def add(self, ns, key, value):
+        # INSERT OR IGNORE est atomique entre workers ; renvoie True si l'insertion a eu lieu
+        conn = self._conn()
+        raw = json.dumps(value)
+        with self._lock:
+            self._generation += 1
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO state (ns, key, value, updated_at) VALUES (?, ?, ?, ?)",
+            (ns, str(key), raw, time.time())
+        )
+        if cursor.rowcount == 1:
+            self._remember((ns, str(key)), raw)
+            return True
+        # Ligne écrite par un autre worker : la prochaine lecture repasse par la base
+        with self._lock:
+            self._cache.pop((ns, str(key)), None)
+        return False
+
+    def replace(self, ns, key, expected, value):
+        # Compare-and-set atomique entre workers : la ligne n'est modifiée que si elle vaut encore expected
+        conn = self._conn()
+        raw = json.dumps(value)
+        with self._lock:
+            self._generation += 1
+        cursor = conn.execute(
+            "UPDATE state SET value = ?, updated_at = ? WHERE ns = ? AND key = ? AND value = ?",
+            (raw, time.time(), ns, str(key), json.dumps(expected))
+        )
+        if cursor.rowcount == 1:
+            self._remember((ns, str(key)), raw)
+            return True
+        with self._lock:
+            self._cache.pop((ns, str(key)), None)
+        return False
+
+    def expire(self, ns, max_idle, max_entries):
+        # Supprime les entrées inactives depuis max_idle secondes, puis les plus anciennes au-delà de max_entries.
+        # BEGIN IMMEDIATE : si plusieurs workers balaient en même temps, une entrée n'est évincée qu'une fois.
+        conn = self._conn()
+        with self._lock:
+            self._generation += 1
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT key, value FROM state WHERE ns = ? AND updated_at < ?",
+                (ns, time.time() - max_idle)
+            ).fetchall()
+            excess = conn.execute("SELECT COUNT(*) FROM state WHERE ns = ?", (ns,)).fetchone()[0] - len(rows) - max_entries
+            if excess > 0:
+                rows += conn.execute(
+                    "SELECT key, value FROM state WHERE ns = ? AND updated_at >= ? ORDER BY updated_at LIMIT ?",
+                    (ns, time.time() - max_idle, excess)
+                ).fetchall()
+            conn.executemany("DELETE FROM state WHERE ns = ? AND key = ?", [(ns, key) for key, _ in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        for key, _ in rows:
+            self._remember((ns, key), None)
+        return [(key, json.loads(raw)) for key, raw in rows]
+
+def compare_and_update(store, ns, key, update):
+    # Lecture-modification-écriture sûre entre workers, sans verrou : add() ou replace() échoue si un
+    # autre processus a écrit entre-temps, et update(valeur actuelle ou None) est rejoué sur la valeur fraîche
+    while True:
+        current = store.get(ns, key)
+        value = update(current)
+        if value == current:
+            return current
+        if current is None and store.add(ns, key, value):
+            return value
+        if current is not None and store.replace(ns, key, current, value):
+            return value
+
+class Lease:
+    # Bail exclusif dans le store d'état : un seul processus détient name jusqu'à until.
+    # Le détenteur le renouvelle à chaque tour ; s'il s'arrête, un autre le reprend après ttl.
+    def __init__(self, store, name, ttl):
+        self.store = store
+        self.name = name
+        self.ttl = ttl
+        self._owner = None
+        self._pid = None
+
+    def owner(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._owner = f"{self._pid}-{uuid.uuid4().hex}"
+        return self._owner
+
+    def acquire(self):
+        now = time.time()
+        lease = {"owner": self.owner(), "until": now + self.ttl}
+        current = self.store.get("leases", self.name)
+        if current is None:
+            return self.store.add("leases", self.name, lease)
+        if current["owner"] != lease["owner"] and current["until"] > now:
+            return False
+        return self.store.replace("leases", self.name, current, lease)
+
+    def release(self):
+        current = self.store.get("leases", self.name)
+        if current and current["owner"] == self.owner():
+            self.store.delete("leases", self.name)
+
+class StateMap:
+    # Vue « dict » sur un espace de noms du store ; toute modification doit être réécrite (map[key] = value)
+    def __init__(self, store, ns):
+        self.store = store
+        self.ns = ns
+
+    def get(self, key, default=None):
+        return self.store.get(self.ns, key, default)
+
+    def __getitem__(self, key):
+        value = self.store.get(self.ns, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.store.set(self.ns, key, value)
+
+    def __contains__(self, key):
+        return self.store.get(self.ns, key) is not None
+
+    def __len__(self):
+        return self.store.count(self.ns)
+
+    def pop(self, key, default=None):
+        value = self.store.get(self.ns, key)
+        if value is None:
+            return default
+        self.store.delete(self.ns, key)
+        return value
+
+    def items(self):
+        for key in self.store.keys(self.ns):
+            value = self.store.get(self.ns, key)
+            if value is not None:
+                yield key, value
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def expire(self, max_idle, max_entries):
+        return self.store.expire(self.ns, max_idle, max_entries)
+
+class DraftRegistry:
+    # Un seul enregistrement par soumission, avec deux index : msg_id -> brouillon et état -> brouillons
+    def __init__(self, store):
+        self.store = store
+
+    def create(self, photos, lieu, date, sender_name, sender_id, photo_hashes=None, photo_checks=None):
+        draft = {
+            "id": uuid.uuid4().hex,
+            "photos": list(photos),
+            "photo_hashes": dict(photo_hashes or {}),
+            "photo_checks": photo_checks or {"dropped": 0, "similar": []},
+            "lieu": lieu,
+            "date": date,
+            "sender_name": sender_name,
+            "sender_id": sender_id,
+            "state": "awaiting",
+            "msg_ids": [],
+            "created_at": time.time(),
+        }
+        self.save(draft)
+        return draft
+
+    def get(self, draft_id):
+        return self.store.get("drafts", draft_id) if draft_id else None
+
+    def by_msg(self, msg_id):
+        return self.get(self.store.get("draft_msgs", msg_id))
+
+    def by_state(self, *states):
+        drafts = []
+        for state in states:
+            for draft_id in self.store.get("draft_states", state, []):
+                draft = self.get(draft_id)
+                if draft:
+                    drafts.append(draft)
+        return drafts
+
+    def _move_state(self, draft_id, old_state, new_state):
+        # Index partagé par tous les workers : chaque liste est mise à jour par compare-and-set.
+        # Une liste vidée reste en place (une suppression pourrait effacer un ajout concurrent).
+        if old_state == new_state:
+            return
+
+        def without(ids):
+            return ids if ids is None else [i for i in ids if i != draft_id]
+
+        def with_draft(ids):
+            ids = ids or []
+            return ids if draft_id in ids else ids + [draft_id]
+
+        if old_state:
+            compare_and_update(self.store, "draft_states", old_state, without)
+        if new_state:
+            compare_and_update(self.store, "draft_states", new_state, with_draft)
+
+    def save(self, draft):
+        stored = self.get(draft["id"])
+        self._move_state(draft["id"], stored["state"] if stored else None, draft["state"])
+        self.store.set("drafts", draft["id"], draft)
+
+    def attach_messages(self, draft, msg_ids):
+        for msg_id in msg_ids:
+            self.store.set("draft_msgs", msg_id, draft["id"])
+        draft["msg_ids"] = draft.get("msg_ids", []) + list(msg_ids)
+        self.save(draft)
+
+    def remove(self, draft):
+        stored = self.get(draft["id"]) or draft
+        for msg_id in set(stored.get("msg_ids", []) + draft.get("msg_ids", [])):
+            self.store.delete("draft_msgs", msg_id)
+        self._move_state(draft["id"], stored["state"], None)
+        self.store.delete("drafts", draft["id"])
+
+    def expire(self, max_idle, max_entries):
+        evicted = [draft for _, draft in self.store.expire("drafts", max_idle, max_entries)]
+        for draft in evicted:
+            for msg_id in draft.get("msg_ids", []):
+                self.store.delete("draft_msgs", msg_id)
+            self._move_state(draft["id"], draft["state"], None)
+        return evicted
+
+    def __len__(self):
+        return self.store.count("drafts")
+
+class RecentIds:
+    # Index de déduplication borné : ordre d'insertion + fenêtre de temps, opérations O(1).
+    # Avec un store partagé (SQLite), la déduplication vaut pour tous les workers.
+    def __init__(self, ns, window, max_entries, store=None):
+        self.ns = ns
+        self.window = window
+        self.max_entries = max_entries
+        self.store = store
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, key):
+        # Renvoie True si la clé a déjà été vue dans la fenêtre, sinon l'enregistre
+        if key is None:
+            return False
+        key = str(key)
+        now = time.time()
+        if self.store is not None:
+            while True:
+                if self.store.add(self.ns, key, now):
+                    return False
+                seen_at = self.store.get(self.ns, key)
+                if seen_at is None:
+                    continue
+                if now - seen_at < self.window:
+                    return True
+                # Entrée périmée : un seul worker la renouvelle (compare-and-set) et traite l'événement
+                return not self.store.replace(self.ns, key, seen_at, now)
+        with self._lock:
+            self._evict(now)
+            if key in self._seen:
+                return True
+            self._seen[key] = now
+            return False
+
+    def forget(self, key):
+        # Traitement en échec : la nouvelle livraison de l'événement ne doit pas passer pour un doublon
+        if key is None:
+            return
+        if self.store is not None:
+            self.store.delete(self.ns, str(key))
+            return
+        with self._lock:
+            self._seen.pop(str(key), None)
+
+    def _evict(self, now):
+        while self._seen:
+            seen_at = next(iter(self._seen.values()))
+            if now - seen_at < self.window and len(self._seen) <= self.max_entries:
+                break
+            self._seen.popitem(last=False)
+
+    def expire(self):
+        if self.store is not None:
+            return len(self.store.expire(self.ns, self.window, self.max_entries))
+        with self._lock:
+            before = len(self._seen)
+            self._evict(time.time())
+            return before - len(self._seen)
+
+    def __len__(self):
+        if self.store is not None:
+            return self.store.count(self.ns)
+        return len(self._seen)
+
+class TelegramFileIds:
+    # file_id renvoyés par Telegram pour les photos déjà envoyées, indexés par URL et par
+    # empreinte du contenu : les aperçus suivants n'obligent plus Telegram à retélécharger l'image.
+    def __init__(self, store, ttl, max_entries):
+        self.store = store
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def _keys(self, url, digest):
+        keys = [f"sha256:{digest}"] if digest else []
+        return keys + [f"url:{url}"]
+
+    def get(self, url, digest=None):
+        for key in self._keys(url, digest):
+            file_id = self.store.get("tg_file_ids", key)
+            if file_id:
+                return file_id
+        return None
+
+    def remember(self, url, file_id, digest=None):
+        for key in self._keys(url, digest):
+            self.store.set("tg_file_ids", key, file_id)
+
+    def forget(self, url, digest=None):
+        for key in self._keys(url, digest):
+            self.store.delete("tg_file_ids", key)
+
+    def expire(self):
+        return len(self.store.expire("tg_file_ids", self.ttl, self.max_entries))
+
+    def __len__(self):
+        return self.store.count("tg_file_ids")
+
+def make_state_store():
+    if STATE_BACKEND == "sqlite":
+        return SQLiteStateStore(STATE_DB_PATH, STATE_CACHE_SIZE)
+    return MemoryStateStore()
+
+# Store unique du processus : conversations Messenger (messenger.py) et brouillons (DraftRegistry, validation.py)
+state_store = make_state_store()
+# Index de déduplication (RecentIds) : partagés entre workers seulement avec SQLite
+shared_store = state_store if STATE_BACKEND == "sqlite" else None
@@ -0,0 +1,76 @@
+import os
+import time
+import threading
+
+from botcore.config import (
+    DRAFT_MAX_ENTRIES, DRAFT_TTL, IMAGE_CACHE_MAX_ENTRIES, SESSION_EXPIRED_NOTIFY, STATE_SWEEP_INTERVAL,
+    USER_BUFFER_MAX_ENTRIES, USER_BUFFER_TTL
+)
+from botcore.images import image_cache, published_photos
+from botcore.messenger import AR_MSGS, messenger_dedupe, send_message_to_messenger, sender_names, user_buffers
+from botcore.publishing import publish_log
+from botcore.scheduler import publish_queue
+from botcore.state import state_store
+from botcore.validation import telegram_dedupe, telegram_file_ids, validation_buffers
+
+# ----------------------------- ÉVICTION DES CONVERSATIONS ET BROUILLONS ABANDONNÉS -------------------------------
+class StateSweeper:
+    def __init__(self, interval):
+        self.interval = interval
+        self._pid = None
+        self._lock = threading.Lock()
+        self.evicted = {"user_buffers": 0, "validation_buffers": 0, "publish_attempts": 0}
+        self.last_sweep = None
+
+    def ensure_started(self):
+        # Un thread par processus (démarré au premier webhook, après le fork des workers)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name="state-sweeper", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print("Erreur balayage de l'état :", e)
+
+    def sweep(self):
+        for sender_id, buffer in user_buffers.expire(USER_BUFFER_TTL, USER_BUFFER_MAX_ENTRIES):
+            self.evicted["user_buffers"] += 1
+            if SESSION_EXPIRED_NOTIFY and buffer.get("step", 0) > 0:
+                send_message_to_messenger(sender_id, AR_MSGS["session_expired"])
+        for draft in validation_buffers.expire(DRAFT_TTL, DRAFT_MAX_ENTRIES):
+            self.evicted["validation_buffers"] += 1
+            publish_log.discard(draft["id"])
+        self.evicted["publish_attempts"] += publish_log.expire(DRAFT_TTL, DRAFT_MAX_ENTRIES)
+        messenger_dedupe.expire()
+        telegram_dedupe.expire()
+        telegram_file_ids.expire()
+        image_cache.expire(DRAFT_TTL, IMAGE_CACHE_MAX_ENTRIES)
+        published_photos.expire()
+        self.last_sweep = time.time()
+
+state_sweeper = StateSweeper(STATE_SWEEP_INTERVAL)
+
+def state_sizes():
+    return {
+        "user_buffers": len(user_buffers),
+        "validation_buffers": len(validation_buffers),
+        "draft_messages": state_store.count("draft_msgs"),
+        "messenger_dedupe": len(messenger_dedupe),
+        "telegram_dedupe": len(telegram_dedupe),
+        "telegram_file_ids": len(telegram_file_ids),
+        "sender_names": len(sender_names),
+        "publish_attempts": len(publish_log),
+        "publish_queue": len(publish_queue),
+        "image_cache": image_cache.stats(),
+        "published_photos": len(published_photos),
+        "evicted": dict(state_sweeper.evicted),
+        "last_sweep": state_sweeper.last_sweep,
+    }
@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import hmac
+import time
+import uuid
+import inspect
+import functools
+import threading
+import contextvars
+
+from botcore.config import ADMIN_TOKEN, PROFILE_INTERVAL, TRACE_LOG_PATH, TRACE_SLOW_THRESHOLD
+
+# ----------------------------- TRACES (spans par requête ou par job) -------------------------------
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    # Racine : un webhook, un callback ou un job de fond ; enfants : les appels sortants faits pendant ce temps.
+    # Sans span courant, un span enfant ne fait rien. detached : nouvelle trace même si une trace est en
+    # cours (tâche lancée par une requête qui lui survit : la trace de la requête est déjà écrite).
+    def __init__(self, name, root=False, detached=False):
+        self.name = name
+        self.root = root or detached
+        self.detached = detached
+        self.trace = None
+
+    def __enter__(self):
+        parent = None if self.detached else _current_span.get()
+        if parent is None and not self.root:
+            return self
+        self.parent = parent
+        if parent is None:
+            self.trace = {"trace_id": uuid.uuid4().hex, "start": time.time(), "t0": time.perf_counter(), "spans": [], "next_id": 0}
+        else:
+            self.trace = parent.trace
+        self.id = self.trace["next_id"]
+        self.trace["next_id"] += 1
+        self.start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is None:
+            return False
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Dialogue abandonné puis fermé par le ramasse-miettes, hors du contexte qui l'exécutait
+            pass
+        duration = time.perf_counter() - self.start
+        self.trace["spans"].append({
+            "name": self.name,
+            "id": self.id,
+            "parent": self.parent.id if self.parent else None,
+            "offset_ms": round((self.start - self.trace["t0"]) * 1000, 1),
+            "duration_ms": round(duration * 1000, 1),
+            "error": repr(exc) if exc and exc_type is not GeneratorExit else None,
+        })
+        if self.parent is None:
+            slow_traces.finish(self.trace, self.name, duration)
+        return False
+
+def traced(name, detached=False):
+    # Décorateur des points d'entrée (fonction, coroutine ou dialogue) : ouvre la racine de la trace,
+    # ou un enfant si une trace est en cours. Un dialogue garde son span ouvert d'un yield à l'autre :
+    # les appels Telegram que le pilote fait pour lui en sont les enfants.
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with Span(name, root=True, detached=detached):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def flow_wrapper(*args, **kwargs):
+                with Span(name, root=True, detached=detached):
+                    return (yield from fn(*args, **kwargs))
+            return flow_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with Span(name, root=True, detached=detached):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class SlowTraceLog:
+    # Les traces plus longues que threshold sont ajoutées en JSON lines (une trace par ligne)
+    def __init__(self, path, threshold):
+        self.path = path
+        self.threshold = threshold
+        self.finished = 0
+        self.written = 0
+        self._lock = threading.Lock()
+
+    def finish(self, trace, root, duration):
+        self.finished += 1
+        if self.threshold <= 0 or duration < self.threshold:
+            return
+        line = json.dumps({
+            "trace_id": trace["trace_id"],
+            "root": root,
+            "start": trace["start"],
+            "duration_ms": round(duration * 1000, 1),
+            "pid": os.getpid(),
+            "spans": sorted(trace["spans"], key=lambda span: (span["offset_ms"], span["id"])),
+        }, ensure_ascii=False)
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self.written += 1
+        except OSError as e:
+            print("Erreur écriture trace lente :", e)
+
+slow_traces = SlowTraceLog(TRACE_LOG_PATH, TRACE_SLOW_THRESHOLD)
+
+# ----------------------------- PROFILAGE À LA DEMANDE -------------------------------
+class SamplingProfiler:
+    # Relève les piles de tous les threads (sys._current_frames) toutes les interval secondes, sans
+    # instrumenter le code ; le résultat est au format « folded » (flamegraph.pl, speedscope).
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._running = False
+
+    def run(self, duration):
+        with self._lock:
+            if self._running:
+                raise RuntimeError("Profilage déjà en cours")
+            self._running = True
+        try:
+            counts = {}
+            me = threading.get_ident()
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})")
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    key = ";".join(reversed(stack))
+                    counts[key] = counts.get(key, 0) + 1
+                time.sleep(self.interval)
+            return "".join(f"{stack} {n}\n" for stack, n in sorted(counts.items()))
+        finally:
+            with self._lock:
+                self._running = False
+
+profiler = SamplingProfiler(PROFILE_INTERVAL)
+
+def is_admin(token):
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token or "", ADMIN_TOKEN)
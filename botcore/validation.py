@@ -0,0 +1,432 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram.error import BadRequest, TelegramError
+
+from botcore.config import (
+    IMAGE_DOWNLOAD_WAIT, PUBLISH_JOB_WORKERS, PUBLISH_PROGRESS_INTERVAL, PUBLISH_QUEUE_REFRESH_LIMIT, TELEGRAM_CHAT_ID,
+    TELEGRAM_DEDUPE_MAX_ENTRIES, TELEGRAM_DEDUPE_WINDOW, TELEGRAM_FILE_ID_MAX_ENTRIES, TELEGRAM_FILE_ID_TTL
+)
+from botcore.dates import convert_date_to_ar_format, is_date_valid
+from botcore.flows import InThread, run_from_thread, tg
+from botcore.images import check_photos, image_cache, remember_published_photos
+from botcore.publishing import chunk_list, publish_draft, publish_log
+from botcore.scheduler import publish_queue, publish_scheduler, queue_status_text
+from botcore.state import DraftRegistry, RecentIds, TelegramFileIds, shared_store, state_store
+from botcore.tracing import traced
+
+# Brouillons en attente de validation (un enregistrement par soumission, retrouvé par message Telegram
+# ou par état) ; toute modification est réécrite avec validation_buffers.save(buf)
+validation_buffers = DraftRegistry(state_store)
+telegram_dedupe = RecentIds("seen_updates", TELEGRAM_DEDUPE_WINDOW, TELEGRAM_DEDUPE_MAX_ENTRIES, shared_store)
+telegram_file_ids = TelegramFileIds(state_store, TELEGRAM_FILE_ID_TTL, TELEGRAM_FILE_ID_MAX_ENTRIES)
+
+def create_draft(sender_id, buffer, sender_name, photo_hashes=None):
+    if photo_hashes is None:
+        # Téléchargements lancés à la réception des photos : on attend ceux encore en cours
+        photo_hashes = image_cache.wait(buffer["photos"], IMAGE_DOWNLOAD_WAIT)
+    photos, photo_checks = check_photos(buffer["photos"], photo_hashes)
+    return validation_buffers.create(
+        photos=photos,
+        lieu=buffer["lieu"],
+        date=buffer["date"],
+        sender_name=sender_name,
+        sender_id=sender_id,
+        photo_hashes=photo_hashes,
+        photo_checks=photo_checks
+    )
+
+# ----------------------------- RACCOURCIS DU BOT (équivalents de reply_text, answer...) -------------------------------
+def reply(message, text, **kwargs):
+    # Comme message.reply_text : le message est cité, sauf en conversation privée
+    quote = message.message_id if message.chat.type != "private" else None
+    return tg.send_message(chat_id=message.chat_id, text=text, reply_to_message_id=quote, **kwargs)
+
+def answer(query, text=None):
+    return tg.answer_callback_query(callback_query_id=query.id, text=text)
+
+def edit_query_message(query, text):
+    # Le texte d'un message photo est sa légende
+    if getattr(query.message, "photo", None):
+        return tg.edit_message_caption(chat_id=query.message.chat_id, message_id=query.message.message_id, caption=text)
+    return tg.edit_message_text(chat_id=query.message.chat_id, message_id=query.message.message_id, text=text)
+
+# ----------------------------- APERÇU TELEGRAM DES BROUILLONS -------------------------------
+def validation_keyboard():
+    buttons = [
+        [InlineKeyboardButton("📝 Modifier le lieu", callback_data="edit_lieu"),
+         InlineKeyboardButton("📝 Modifier la date", callback_data="edit_date")],
+        [InlineKeyboardButton("🗑️ Supprimer une photo", callback_data="delete_photo")],
+        [InlineKeyboardButton("✅ Valider", callback_data="valider"),
+         InlineKeyboardButton("❌ Refuser", callback_data="refuser")]
+    ]
+    return InlineKeyboardMarkup(buttons)
+
+def validation_caption(draft):
+    message = (
+        f"Nouvelle demande de publication :\n"
+        f"Nom de l'expéditeur : {draft['sender_name']}\n"
+        f"ID Messenger : {draft['sender_id']}\n"
+        f"Lieu : {draft['lieu']}\n"
+        f"Date : {draft['date']}"
+    )
+    checks = draft.get("photo_checks") or {}
+    if checks.get("dropped"):
+        message += f"\nℹ️ {checks['dropped']} photo(s) en double retirée(s)"
+    for match in checks.get("similar", []):
+        if match["url"] not in draft["photos"]:
+            continue
+        kind = "identique à une" if match["distance"] == 0 else "très proche d'une"
+        message += f"\n⚠️ Photo {draft['photos'].index(match['url']) + 1} {kind} photo déjà publiée (post {match['post_id']})"
+    return message
+
+def photo_picker_keyboard(draft):
+    buttons = []
+    for i, url in enumerate(draft["photos"]):
+        buttons.append([InlineKeyboardButton(f"Supprimer photo {i+1}", callback_data=f"delete_photo_{i}")])
+    buttons.append([InlineKeyboardButton("Annuler", callback_data="cancel_delete_photo")])
+    return InlineKeyboardMarkup(buttons)
+
+def photo_digest(draft, url):
+    return draft.get("photo_hashes", {}).get(url) or image_cache.digest(url)
+
+def send_with_file_ids(draft, urls, send):
+    # Par ordre de préférence : file_id déjà connu de Telegram, fichier du cache local, URL distante.
+    # send(media) construit l'appel Telegram pour la liste media.
+    media = []
+    files = []
+    for url in urls:
+        file_id = telegram_file_ids.get(url, photo_digest(draft, url))
+        path = None if file_id else image_cache.lookup(url)
+        if path:
+            files.append(open(path, "rb"))
+            media.append(files[-1])
+        else:
+            media.append(file_id or url)
+    try:
+        sent = yield send(media)
+    except BadRequest as e:
+        if media == list(urls):
+            raise
+        # file_id refusé (périmé ou d'un autre bot) ou fichier rejeté : on renvoie les URL
+        print(f"Envoi Telegram refusé, renvoi par URL : {e}")
+        for url in urls:
+            telegram_file_ids.forget(url, photo_digest(draft, url))
+        sent = yield send(list(urls))
+    finally:
+        for f in files:
+            f.close()
+    msgs = sent if isinstance(sent, (list, tuple)) else [sent]
+    for url, msg in zip(urls, msgs):
+        if getattr(msg, "photo", None):
+            telegram_file_ids.remember(url, msg.photo[-1].file_id, photo_digest(draft, url))
+    return msgs
+
+# L'aperçu envoyé est décrit dans draft["preview"] pour pouvoir être modifié sur place :
+# photo_msg_ids (un message par photo, dans l'ordre), caption_msg_id (message qui porte
+# le texte) et control_msg_id (message qui porte les boutons).
+def telegram_post_message_for_validation(draft):
+    photo_urls = draft["photos"]
+    message = validation_caption(draft)
+    reply_markup = validation_keyboard()
+    photo_msg_ids = []
+    if not photo_urls:
+        msg = yield tg.send_message(chat_id=TELEGRAM_CHAT_ID, text=message, reply_markup=reply_markup)
+        caption_msg_id = control_msg_id = msg.message_id
+    elif len(photo_urls) == 1:
+        (msg,) = yield from send_with_file_ids(draft, photo_urls, lambda media: tg.send_photo(
+            chat_id=TELEGRAM_CHAT_ID, photo=media[0], caption=message, reply_markup=reply_markup
+        ))
+        photo_msg_ids.append(msg.message_id)
+        caption_msg_id = control_msg_id = msg.message_id
+    else:
+        for i, chunk in enumerate(chunk_list(photo_urls, 10)):
+            def album(media, first=(i == 0)):
+                medias = []
+                for idx, item in enumerate(media):
+                    if first and idx == 0:
+                        medias.append(InputMediaPhoto(media=item, caption=message))
+                    else:
+                        medias.append(InputMediaPhoto(media=item))
+                return tg.send_media_group(chat_id=TELEGRAM_CHAT_ID, media=medias)
+            msgs = yield from send_with_file_ids(draft, chunk, album)
+            photo_msg_ids.extend([m.message_id for m in msgs])
+        confirm_msg = yield tg.send_message(chat_id=TELEGRAM_CHAT_ID, text="Veuillez valider ou modifier la publication ci-dessus.", reply_markup=reply_markup)
+        caption_msg_id = photo_msg_ids[0]
+        control_msg_id = confirm_msg.message_id
+    draft["preview"] = {
+        "photo_msg_ids": photo_msg_ids,
+        "caption_msg_id": caption_msg_id,
+        "control_msg_id": control_msg_id,
+    }
+    msg_ids = list(dict.fromkeys(photo_msg_ids + [control_msg_id]))
+    validation_buffers.attach_messages(draft, msg_ids)
+    return msg_ids
+
+def edit_preview_caption(draft):
+    preview = draft["preview"]
+    message = validation_caption(draft)
+    # Les messages d'un album ne peuvent pas porter de boutons
+    reply_markup = validation_keyboard() if preview["caption_msg_id"] == preview["control_msg_id"] else None
+    try:
+        if preview["caption_msg_id"] in preview["photo_msg_ids"]:
+            yield tg.edit_message_caption(chat_id=TELEGRAM_CHAT_ID, message_id=preview["caption_msg_id"], caption=message, reply_markup=reply_markup)
+        else:
+            yield tg.edit_message_text(chat_id=TELEGRAM_CHAT_ID, message_id=preview["caption_msg_id"], text=message, reply_markup=reply_markup)
+    except TelegramError as e:
+        if "not modified" not in str(e):
+            raise
+
+def refresh_validation_preview(draft):
+    if not draft.get("preview"):
+        return (yield from telegram_post_message_for_validation(draft))
+    try:
+        yield from edit_preview_caption(draft)
+    except TelegramError as e:
+        print(f"Édition de l'aperçu impossible, renvoi complet : {e}")
+        return (yield from telegram_post_message_for_validation(draft))
+    validation_buffers.save(draft)
+    return [draft["preview"]["caption_msg_id"]]
+
+def remove_preview_photo(draft, idx):
+    del draft["photos"][idx]
+    preview = draft.get("preview")
+    if not preview or len(preview["photo_msg_ids"]) != len(draft["photos"]) + 1:
+        return (yield from telegram_post_message_for_validation(draft))
+    msg_id = preview["photo_msg_ids"].pop(idx)
+    try:
+        if msg_id == preview["control_msg_id"]:
+            # La photo unique portait le texte et les boutons : un message texte la remplace
+            msg = yield tg.send_message(chat_id=TELEGRAM_CHAT_ID, text=validation_caption(draft), reply_markup=validation_keyboard())
+            yield tg.delete_message(chat_id=TELEGRAM_CHAT_ID, message_id=msg_id)
+            preview["caption_msg_id"] = preview["control_msg_id"] = msg.message_id
+            validation_buffers.attach_messages(draft, [msg.message_id])
+            return [msg.message_id]
+        yield tg.delete_message(chat_id=TELEGRAM_CHAT_ID, message_id=msg_id)
+        if msg_id == preview["caption_msg_id"]:
+            # Le texte était sur la photo supprimée : il passe sur la suivante, ou sur le message des boutons
+            preview["caption_msg_id"] = preview["photo_msg_ids"][0] if preview["photo_msg_ids"] else preview["control_msg_id"]
+            yield from edit_preview_caption(draft)
+    except TelegramError as e:
+        print(f"Mise à jour de l'aperçu impossible, renvoi complet : {e}")
+        return (yield from telegram_post_message_for_validation(draft))
+    validation_buffers.save(draft)
+    return [preview["caption_msg_id"]]
+
+# ----------------------------- PUBLICATION EN ARRIÈRE-PLAN -------------------------------
+publish_jobs = ThreadPoolExecutor(max_workers=PUBLISH_JOB_WORKERS, thread_name_prefix="publish-job")
+
+def build_facebook_post_text(buf):
+    return (
+        f"🗓️ التاريخ : {convert_date_to_ar_format(buf['date'])}\n"
+        f"📍 المكان : {buf['lieu']}\n\n"
+        "🌿 صور توثق النشاطات الدورية التي يقوم بها أعواننا للعناية بالمساحات الخضراء في ولاية وهران، وذلك في إطار الجهود المستمرة لتزيين وتحسين المحيط.\n\n"
+        "#مؤسسة_وهران_خضراء\n"
+        "#ولاية_وهران"
+    )
+
+def edit_validation_status(chat_id, message_id, has_photo, text, reply_markup=None):
+    try:
+        if has_photo:
+            yield tg.edit_message_caption(chat_id=chat_id, message_id=message_id, caption=text, reply_markup=reply_markup)
+        else:
+            yield tg.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, reply_markup=reply_markup)
+    except Exception as e:
+        print("Erreur édition message Telegram:", e)
+
+def publish_result_text(fb_result):
+    if "id" in fb_result:
+        text = f"✅ Publication validée et publiée sur Facebook !\nID du post : {fb_result['id']}"
+        if fb_result.get("scheduled_publish_time"):
+            when = time.strftime("%d/%m à %H:%M", time.localtime(fb_result["scheduled_publish_time"]))
+            text = f"✅ Publication validée et programmée sur Facebook pour le {when}.\nID du post : {fb_result['id']}"
+        if fb_result.get("photo_errors"):
+            text += f"\n⚠️ {len(fb_result['photo_errors'])} photo(s) n'ont pas pu être envoyées."
+        return text
+    error = fb_result.get("error", {})
+    message = error.get("message", error) if isinstance(error, dict) else error
+    return f"❌ Échec de la publication Facebook : {message}\nVous pouvez réessayer avec « Valider »."
+
+def run_publish_job(buf, chat_id, message_id, has_photo, scheduled_time=None):
+    last_edit = [0.0]
+
+    def progress(done, total):
+        # Appelé depuis l'upload (thread de l'InThread) : l'édition passe par le client du job
+        now = time.monotonic()
+        if done < total and now - last_edit[0] < PUBLISH_PROGRESS_INTERVAL:
+            return
+        last_edit[0] = now
+        run_from_thread(edit_validation_status(chat_id, message_id, has_photo, f"⏳ Publication en cours : {done}/{total} photos envoyées…"))
+
+    try:
+        fb_result = yield InThread(publish_draft, buf["id"], build_facebook_post_text(buf), buf["photos"], progress, scheduled_time)
+    except Exception as e:
+        fb_result = {"error": {"message": str(e)}}
+    print("Publication Facebook :", fb_result)
+    if "id" in fb_result:
+        yield from edit_validation_status(chat_id, message_id, has_photo, publish_result_text(fb_result))
+        remember_published_photos(buf, fb_result["id"])
+        # Le brouillon reste connu jusqu'à expiration : un double clic renvoie le post existant
+        buf["state"] = "published"
+        buf["post_id"] = fb_result["id"]
+        validation_buffers.save(buf)
+    else:
+        # On remet le brouillon en attente pour permettre une nouvelle tentative
+        buf["state"] = "awaiting"
+        validation_buffers.save(buf)
+        yield from edit_validation_status(chat_id, message_id, has_photo, publish_result_text(fb_result), reply_markup=validation_keyboard())
+
+# ----------------------------- SORTIES DE LA FILE DE PUBLICATION -------------------------------
+def take_queued_draft(entry):
+    # Le brouillon a pu expirer entre-temps : il n'est alors plus publié
+    buf = validation_buffers.get(entry["draft_id"])
+    if not buf or buf.get("state") != "queued":
+        return None
+    buf["state"] = "done"
+    validation_buffers.save(buf)
+    return buf
+
+@traced("publish_job", detached=True)
+def release_queued_draft(entry):
+    buf = take_queued_draft(entry)
+    if not buf:
+        return
+    yield from edit_validation_status(entry["chat_id"], entry["message_id"], entry["has_photo"], "⏳ Publication en cours…")
+    yield from run_publish_job(buf, entry["chat_id"], entry["message_id"], entry["has_photo"], entry["scheduled_time"])
+
+@traced("publish_queue_refresh", detached=True)
+def refresh_queue_statuses():
+    # Nouvelle position et heure prévue des brouillons suivants (les premiers seulement, pour ménager Telegram)
+    for i, (entry, eta) in enumerate(publish_queue.schedule()[:PUBLISH_QUEUE_REFRESH_LIMIT]):
+        yield from edit_validation_status(entry["chat_id"], entry["message_id"], entry["has_photo"], queue_status_text(i + 1, eta))
+
+def start_publish_scheduler(run):
+    # run(flow) exécute un dialogue avec le client Telegram de l'application et renvoie son Future
+    publish_scheduler.ensure_started(
+        lambda entry: run(release_queued_draft(entry)),
+        lambda: run(refresh_queue_statuses())
+    )
+
+# ----------------------------- MISES À JOUR TELEGRAM -------------------------------
+def handle_update(update):
+    if telegram_dedupe.seen(update.update_id):
+        return
+    try:
+        if update.message and update.message.text:
+            if update.message.text.startswith("/start"):
+                yield reply(update.message, "Bot de validation prêt !")
+            elif update.message.reply_to_message:
+                yield from edit_handler(update)
+        elif update.callback_query:
+            yield from validation_callback(update)
+    except Exception:
+        # Telegram renvoie la mise à jour après une erreur : elle ne doit pas passer pour un doublon
+        telegram_dedupe.forget(update.update_id)
+        raise
+
+@traced("validation_callback")
+def validation_callback(update):
+    query = update.callback_query
+    message_id = query.message.message_id if hasattr(query, "message") else None
+    buf = validation_buffers.by_msg(message_id)
+    if not buf:
+        yield answer(query, "Impossible de retrouver les infos du post.")
+        return
+
+    if buf.get("state") == "published":
+        yield answer(query, f"Déjà publié (post {buf.get('post_id')}).")
+        return
+
+    if buf.get("state") in ("done", "queued"):
+        yield answer(query, "Déjà traité.")
+        return
+
+    if query.data == "edit_lieu":
+        buf["state"] = "editing_lieu"
+        validation_buffers.save(buf)
+        prompt = yield reply(query.message, "Envoie le nouveau lieu en réponse à ce message.")
+        validation_buffers.attach_messages(buf, [prompt.message_id])
+        yield answer(query)
+    elif query.data == "edit_date":
+        buf["state"] = "editing_date"
+        validation_buffers.save(buf)
+        prompt = yield reply(query.message, "أرسل التاريخ بالصيغة: سنة/شهر/يوم (مثال: 15/10/2025) بالرد على هذه الرسالة.")
+        validation_buffers.attach_messages(buf, [prompt.message_id])
+        yield answer(query)
+    elif query.data == "delete_photo":
+        if not buf["photos"]:
+            yield answer(query, "Aucune photo à supprimer.")
+            return
+        picker = yield reply(query.message, "Clique sur la photo à supprimer :", reply_markup=photo_picker_keyboard(buf))
+        validation_buffers.attach_messages(buf, [picker.message_id])
+        yield answer(query)
+    elif query.data.startswith("delete_photo_"):
+        idx = int(query.data.split("_")[-1])
+        if not 0 <= idx < len(buf["photos"]):
+            yield answer(query, "Indice invalide.")
+            return
+        buf["state"] = "awaiting"
+        # Seul le message de la photo disparaît ; la liste des boutons est renumérotée
+        yield from remove_preview_photo(buf, idx)
+        yield answer(query, "Photo supprimée.")
+        if buf["photos"]:
+            yield tg.edit_message_reply_markup(chat_id=query.message.chat_id, message_id=message_id, reply_markup=photo_picker_keyboard(buf))
+        else:
+            yield tg.edit_message_text(chat_id=query.message.chat_id, message_id=message_id, text="Toutes les photos ont été supprimées.")
+    elif query.data == "cancel_delete_photo":
+        buf["state"] = "awaiting"
+        validation_buffers.save(buf)
+        yield answer(query, "Suppression annulée.")
+    elif query.data == "valider":
+        # Le brouillon rejoint la file : le planificateur le publiera à son tour
+        buf["state"] = "queued"
+        validation_buffers.save(buf)
+        has_photo = bool(getattr(query.message, "photo", None))
+        publish_queue.push(buf["id"], query.message.chat_id, message_id, has_photo)
+        position, eta = publish_queue.position(buf["id"])
+        yield answer(query, "Ajouté à la file de publication.")
+        yield from edit_validation_status(query.message.chat_id, message_id, has_photo, queue_status_text(position, eta))
+        publish_scheduler.wake()
+    elif query.data == "refuser":
+        buf["state"] = "done"
+        yield edit_query_message(query, "❌ Publication refusée.")
+        validation_buffers.remove(buf)
+        # Photos envoyées par une tentative échouée : suppression Graph, hors de la boucle asyncio
+        yield InThread(publish_log.discard, buf["id"])
+    else:
+        yield answer(query, "Action non reconnue.")
+
+def edit_handler(update):
+    reply_to = update.message.reply_to_message
+    if not reply_to:
+        yield reply(update.message, "Merci de répondre au message de demande de modification.")
+        return
+
+    buf = validation_buffers.by_msg(reply_to.message_id)
+
+    if not buf:
+        # Recherche d'un brouillon en mode édition (sécurité), par l'index des états
+        editing = validation_buffers.by_state("editing_lieu", "editing_date")
+        buf = editing[0] if editing else None
+        if not buf:
+            yield reply(update.message, "Impossible de trouver la publication à éditer.")
+            return
+
+    if buf.get("state") == "editing_lieu":
+        buf["lieu"] = update.message.text.strip()
+        buf["state"] = "awaiting"
+        validation_buffers.save(buf)
+        yield reply(update.message, "Lieu modifié.")
+        yield from refresh_validation_preview(buf)
+    elif buf.get("state") == "editing_date":
+        date_text = update.message.text.strip()
+        if is_date_valid(date_text):
+            buf["date"] = date_text
+            buf["state"] = "awaiting"
+            validation_buffers.save(buf)
+            yield reply(update.message, "Date modifiée.")
+            yield from refresh_validation_preview(buf)
+        else:
+            yield reply(update.message, "صيغة التاريخ غير صحيحة. يرجى إرسال التاريخ بالصيغة: سنة/شهر/يوم (مثال: 15/10/2025).")
+    else:
+        yield reply(update.message, "Aucune modification en cours.")
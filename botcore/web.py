@@ -0,0 +1,73 @@
+from flask import Blueprint, request
+
+from botcore.config import PROFILE_MAX_SECONDS
+from botcore.graph import graph_pool_stats
+from botcore.messenger import messenger_replies, user_buffers
+from botcore.metrics import METRICS_CONTENT_TYPE, metrics
+from botcore.ratelimit import rate_limiter
+from botcore.scheduler import publish_queue
+from botcore.startup import readiness
+from botcore.state import state_store
+from botcore.sweeper import state_sizes
+from botcore.tracing import is_admin, profiler
+from botcore.validation import validation_buffers
+
+# Vues d'exploitation communes aux deux applications Flask (app.register_blueprint(monitoring))
+monitoring = Blueprint("monitoring", __name__)
+
+def stats_snapshot():
+    return {
+        "graph": graph_pool_stats(),
+        "messenger_queue": messenger_replies.metrics(),
+        "state": state_sizes(),
+        "rate_limits": rate_limiter.snapshot(),
+    }
+
+def metric_gauges():
+    # Tailles de l'état au moment du scrape : une requête agrégée par espace de noms
+    steps = state_store.count_by("user_buffers", "step")
+    states = state_store.count_by("drafts", "state")
+    return [
+        ("autopost_user_buffers", "Conversations Messenger en cours", [({}, len(user_buffers))]),
+        ("autopost_conversations", "Conversations Messenger par étape",
+         [({"step": str(step or 0)}, n) for step, n in sorted(steps.items(), key=lambda item: str(item[0]))]),
+        ("autopost_validation_buffers", "Brouillons en cours de validation", [({}, len(validation_buffers))]),
+        ("autopost_drafts", "Brouillons par état", [({"state": str(state)}, n) for state, n in sorted(states.items(), key=lambda item: str(item[0]))]),
+        ("autopost_publish_queue", "Brouillons en file de publication", [({}, len(publish_queue))]),
+    ]
+
+def metrics_text():
+    return metrics.render(metric_gauges())
+
+def profile_seconds(value):
+    return max(1, min(int(value), PROFILE_MAX_SECONDS))
+
+@monitoring.get("/stats")
+def stats():
+    return stats_snapshot()
+
+@monitoring.get("/ready")
+def ready():
+    # Sonde de disponibilité (health check App Service) ; sans gunicorn.conf.py, le premier appel lance le préchauffage
+    readiness.ensure_started()
+    status = readiness.status()
+    return status, 200 if status["ready"] else 503
+
+@monitoring.get("/metrics")
+def metrics_endpoint():
+    return metrics_text(), 200, {"Content-Type": METRICS_CONTENT_TYPE}
+
+@monitoring.get("/admin/profile")
+def admin_profile():
+    # Profil échantillonné du processus pendant ?seconds=N, réservé à l'admin (en-tête X-Admin-Token)
+    if not is_admin(request.headers.get("X-Admin-Token")):
+        return "Not Found", 404
+    try:
+        seconds = profile_seconds(request.args.get("seconds", 10))
+    except ValueError:
+        return "Bad Request", 400
+    try:
+        folded = profiler.run(seconds)
+    except RuntimeError as e:
+        return str(e), 409
+    return folded, 200, {"Content-Type": "text/plain; charset=utf-8"}
@@ -0,0 +1,11 @@
+import sys
+
+# Lu automatiquement par gunicorn depuis le répertoire de lancement (gunicorn application:app)
+
+def post_worker_init(worker):
+    # Threads de fond démarrés au boot de chaque worker, après le fork, sans attendre le premier
+    # webhook : préchauffage, inscription du webhook Telegram, planificateur de publication, balayage
+    # de l'état. Aucun ne bloque le boot. asgi.py les démarre dans son lifespan.
+    application = sys.modules.get("application")
+    if application is not None:
+        application.start_background_tasks()
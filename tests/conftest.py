@@ -0,0 +1,10 @@
+import os
+
+# Configuration minimale pour importer les applications sans Telegram ni Facebook réels :
+# aucun webhook n'est inscrit et l'état reste en mémoire.
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:test")
+os.environ.setdefault("TELEGRAM_CHAT_ID", "42")
+os.environ.setdefault("PAGE_ID", "1000")
+os.environ.setdefault("PAGE_ACCESS_TOKEN", "test")
+os.environ.pop("WEBHOOK_URL", None)
+os.environ.pop("WEBSITE_HOSTNAME", None)
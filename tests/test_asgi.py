@@ -0,0 +1,89 @@
+import json
+import asyncio
+
+import httpx
+import pytest
+from telegram.error import BadRequest
+
+import asgi
+from botcore import validation
+from botcore.flows import tg
+from botcore.messenger import AR_MSGS
+
+class FakeAPI:
+    # Serveur Telegram/Graph simulé : enregistre les requêtes et répond comme l'API
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, request):
+        method = request.url.path.rsplit("/", 1)[-1]
+        self.requests.append((method, request))
+        if request.url.host == "graph.facebook.com":
+            return httpx.Response(200, json={"recipient_id": "s1", "message_id": "m"})
+        if method == "deleteMessage":
+            return httpx.Response(400, json={"ok": False, "error_code": 400, "description": "Bad Request: message to delete not found"})
+        if method == "sendMediaGroup":
+            media = json.loads(request.content)["media"]
+            return httpx.Response(200, json={"ok": True, "result": [message(10 + i) for i in range(len(media))]})
+        return httpx.Response(200, json={"ok": True, "result": message(20 + len(self.requests))})
+
+def message(message_id):
+    return {"message_id": message_id, "date": 0, "chat": {"id": 42, "type": "group"}}
+
+@pytest.fixture
+def api(monkeypatch):
+    api = FakeAPI()
+    monkeypatch.setattr(asgi, "_http", httpx.AsyncClient(transport=httpx.MockTransport(api)))
+    return api
+
+def test_flows_run_over_the_bot_api(api):
+    draft = validation.create_draft("s1", {"photos": ["http://x/1.png", "http://x/2.png"], "lieu": "L", "date": "15/10/2025"}, "Samir", {})
+    msg_ids = asyncio.run(asgi.run_flow_async(validation.telegram_post_message_for_validation(draft), asgi.call_telegram))
+    assert msg_ids == [10, 11, 22]
+    (album_method, album), (confirm_method, confirm) = api.requests
+    assert album_method == "sendMediaGroup" and confirm_method == "sendMessage"
+    media = json.loads(album.content)["media"]
+    assert media[0]["media"] == "http://x/1.png" and media[0]["caption"].startswith("Nouvelle demande")
+    assert json.loads(confirm.content)["reply_markup"]["inline_keyboard"][-1][0]["callback_data"] == "valider"
+    validation.validation_buffers.remove(draft)
+
+def test_files_go_multipart_and_errors_map_to_telegram_exceptions(api, tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(b"jpeg")
+
+    async def calls():
+        with open(path, "rb") as f:
+            await asgi.call_telegram(tg.send_photo(chat_id=42, photo=f, caption="c"))
+        with pytest.raises(BadRequest):
+            await asgi.call_telegram(tg.delete_message(chat_id=42, message_id=1))
+
+    asyncio.run(calls())
+    body = api.requests[0][1].content
+    assert b'name="photo"; filename="photo.jpg"' in body and b"jpeg" in body
+
+def test_messenger_replies_are_sent_in_order(api, monkeypatch):
+    monkeypatch.setattr("botcore.messenger.prefetch_user_name", lambda sender_id: None)
+    events = [
+        {"sender": {"id": "o1"}, "timestamp": i, "message": {"mid": f"o1-{i}", "text": text}}
+        for i, text in enumerate(["samir", "Lieu", "15/10/2025"])
+    ]
+
+    async def post():
+        scope = {"type": "http", "method": "POST", "path": "/webhook", "query_string": b""}
+        body = json.dumps({"entry": [{"messaging": events}]}).encode()
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": body}
+
+        async def send(event):
+            sent.append(event)
+
+        await asgi.app(scope, receive, send)
+        await asyncio.gather(*asgi.spawned_tasks())
+        return sent
+
+    sent = asyncio.run(post())
+    assert sent[0]["status"] == 200
+    texts = [json.loads(request.content)["message"]["text"] for method, request in api.requests]
+    assert texts == [AR_MSGS[key] for key in ["welcome", "lieu_ok", "date_ok"]]
@@ -0,0 +1,118 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.error import BadRequest
+
+from botcore.flows import InThread, Spawn, run_flow, run_flow_async, run_from_thread, tg
+
+class FakeBot:
+    # Enregistre les appels ; send_photo échoue pour une URL marquée "bad"
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, call):
+        self.calls.append((call.method, call.kwargs))
+        if call.method == "send_photo" and call.kwargs["photo"] == "bad":
+            raise BadRequest("Wrong file identifier")
+        return len(self.calls)
+
+def send_photos(photos):
+    sent = []
+    for photo in photos:
+        try:
+            sent.append((yield tg.send_photo(chat_id=1, photo=photo)))
+        except BadRequest:
+            sent.append((yield tg.send_message(chat_id=1, text=f"refusée : {photo}")))
+    return sent
+
+def publish(photos):
+    sent = yield from send_photos(photos)
+    total = yield InThread(sum, sent)
+    return total
+
+def upload(photos, progress):
+    # Code bloquant qui signale sa progression, comme publish_on_facebook
+    for i, photo in enumerate(photos):
+        progress(i + 1, len(photos))
+    return len(photos)
+
+def upload_with_progress(photos):
+    def progress(done, total):
+        run_from_thread(send_photos([f"{done}/{total}"]))
+
+    return (yield InThread(upload, photos, progress))
+
+def test_run_flow_sends_results_back():
+    bot = FakeBot()
+    assert run_flow(send_photos(["a", "b"]), bot) == [1, 2]
+    assert bot.calls == [("send_photo", {"chat_id": 1, "photo": "a"}), ("send_photo", {"chat_id": 1, "photo": "b"})]
+
+def test_run_flow_throws_errors_into_the_flow():
+    bot = FakeBot()
+    assert run_flow(publish(["bad", "ok"]), bot) == 2 + 3
+    assert [method for method, kwargs in bot.calls] == ["send_photo", "send_message", "send_photo"]
+
+def test_run_flow_propagates_uncaught_errors():
+    def flow():
+        yield tg.send_photo(chat_id=1, photo="bad")
+
+    try:
+        run_flow(flow(), FakeBot())
+    except BadRequest as e:
+        assert "Wrong file identifier" in str(e)
+    else:
+        raise AssertionError("BadRequest attendu")
+
+def test_run_flow_async_matches_sync_driver():
+    bot = FakeBot()
+
+    async def call(step):
+        return bot(step)
+
+    assert asyncio.run(run_flow_async(publish(["a", "bad"]), call)) == 1 + 3
+    assert [method for method, kwargs in bot.calls] == ["send_photo", "send_photo", "send_message"]
+
+def test_run_from_thread_uses_the_flow_client():
+    bot = FakeBot()
+    assert run_flow(upload_with_progress(["a", "b"]), bot) == 2
+    assert [kwargs["photo"] for method, kwargs in bot.calls] == ["1/2", "2/2"]
+
+def test_run_from_thread_from_async_driver_runs_on_the_loop():
+    bot = FakeBot()
+
+    async def call(step):
+        return bot(step)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert asyncio.run(run_flow_async(upload_with_progress(["a", "b", "c"]), call, executor)) == 3
+    assert [kwargs["photo"] for method, kwargs in bot.calls] == ["1/3", "2/3", "3/3"]
+
+def test_spawn_returns_before_the_job_runs():
+    bot = FakeBot()
+
+    def flow(executor):
+        job = yield Spawn(send_photos(["job"]), executor)
+        yield tg.send_message(chat_id=1, text="en cours")
+        return job
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        job = run_flow(flow(executor), bot)
+        assert len(job.result(timeout=5)) == 1
+    assert sorted(method for method, kwargs in bot.calls) == ["send_message", "send_photo"]
+
+def test_spawn_from_async_driver_is_a_loop_task():
+    bot = FakeBot()
+
+    async def call(step):
+        return bot(step)
+
+    def flow():
+        job = yield Spawn(upload_with_progress(["a"]), None)
+        return job
+
+    async def main():
+        job = await run_flow_async(flow(), call)
+        return await job
+
+    assert asyncio.run(main()) == 1
+    assert bot.calls == [("send_photo", {"chat_id": 1, "photo": "1/1"})]
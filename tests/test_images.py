@@ -0,0 +1,135 @@
+import io
+import math
+import hashlib
+
+import pytest
+
+from botcore import images, imaging
+from botcore.state import MemoryStateStore
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, size):
+        for i in range(0, len(self.body), size):
+            yield self.body[i:i + size]
+
+class FakeSession:
+    def __init__(self, bodies):
+        self.bodies = bodies
+        self.fetched = []
+
+    def get(self, url, **kwargs):
+        self.fetched.append(url)
+        return FakeResponse(self.bodies[url])
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    session = FakeSession({"http://x/a.jpg": b"a" * 100000, "http://x/b.jpg": b"a" * 100000})
+    monkeypatch.setattr(images, "get_graph_session", lambda: session)
+    cache = images.ImageCache(str(tmp_path), 150000, MemoryStateStore(), 2)
+    cache.session = session
+    return cache
+
+def test_downloads_are_stored_once_under_their_sha256(cache):
+    digest = hashlib.sha256(b"a" * 100000).hexdigest()
+    cache.prefetch("http://x/a.jpg")
+    cache.prefetch("http://x/b.jpg")
+    assert cache.wait(["http://x/a.jpg", "http://x/b.jpg", "http://x/c.jpg"], 5) == {
+        "http://x/a.jpg": digest,
+        "http://x/b.jpg": digest,
+    }
+    assert cache.lookup("http://x/b.jpg") == cache.path_for(digest)
+    cache.prefetch("http://x/a.jpg")
+    assert sorted(cache.session.fetched) == ["http://x/a.jpg", "http://x/b.jpg"]
+    assert cache.evict() == 0 and cache.stats()["files"] == 1
+
+def test_multipart_body_reads_and_rewinds(tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(b"0123456789")
+    body = images.MultipartFileBody({"published": "false"}, "source", str(path))
+    try:
+        whole = body.read()
+        assert len(whole) == len(body) and body.tell() == len(body)
+        assert b'name="published"\r\n\r\nfalse\r\n' in whole
+        assert b'filename="photo.jpg"\r\nContent-Type: image/jpeg\r\n\r\n0123456789\r\n' in whole
+        # Lecture par petits morceaux à cheval sur les parties, après rembobinage
+        body.seek(0)
+        chunks = []
+        while True:
+            chunk = body.read(7)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        assert b"".join(chunks) == whole
+        tail = f"\r\n--{body.boundary}--\r\n".encode()
+        assert body.seek(-len(tail), 2) == len(body) - len(tail) and body.read() == tail
+    finally:
+        body.close()
+
+def jpeg_with_exif(width, height):
+    Image = pytest.importorskip("PIL.Image")
+    img = Image.new("RGB", (width, height), (120, 180, 60))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # orientation : rotation de 90°
+    exif[0x010F] = "Téléphone"
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=95, exif=exif)
+    return out.getvalue()
+
+def test_normalize_shrinks_rotates_and_strips_exif(tmp_path):
+    from PIL import Image
+    src = tmp_path / "src.jpg"
+    src.write_bytes(jpeg_with_exif(400, 200))
+    size = imaging.normalize_image_file(str(src), str(tmp_path / "out.jpg"), 100, 80)
+    with Image.open(tmp_path / "out.jpg") as img:
+        assert img.size == (50, 100)
+        assert not img.getexif()
+    assert size == (tmp_path / "out.jpg").stat().st_size
+
+def test_cache_keeps_the_source_digest_for_the_normalized_file(cache, monkeypatch):
+    body = jpeg_with_exif(3000, 1000)
+    cache.session.bodies["http://x/big.jpg"] = body
+    monkeypatch.setattr(images, "IMAGE_NORMALIZE", True)
+    monkeypatch.setattr(images, "IMAGE_MAX_EDGE", 500)
+    digest = cache.download("http://x/big.jpg")
+    assert digest == hashlib.sha256(body).hexdigest()
+    stats = cache.stats()
+    assert stats["downloaded_bytes"] == len(body) and 0 < stats["upload_bytes"] < len(body)
+
+def test_published_photos_match_within_the_threshold():
+    photos = images.PublishedPhotos(MemoryStateStore(), 3600, 100)
+    photos.add([0b1011, 0xFFFF0000FFFF0000], "post_1")
+    assert photos.closest(0b1010, 2) == {"post_id": "post_1", "distance": 1}
+    assert photos.closest(0xFFFF0000FFFF0000, 0) == {"post_id": "post_1", "distance": 0}
+    assert photos.closest(0x00FF00FF00FF00FF, 6) is None
+    assert len(photos) == 2
+
+def test_check_photos_drops_exact_duplicates_and_flags_reposts(monkeypatch):
+    photos = images.PublishedPhotos(MemoryStateStore(), 3600, 100)
+    photos.add([0b1111], "post_1")
+    monkeypatch.setattr(images, "published_photos", photos)
+    monkeypatch.setattr(images.image_cache, "dhash", {"http://x/b.jpg": 0b0111}.get)
+    urls = ["http://x/a.jpg", "http://x/b.jpg", "http://x/a2.jpg"]
+    kept, checks = images.check_photos(urls, {"http://x/a.jpg": "sha-a", "http://x/a2.jpg": "sha-a"})
+    assert kept == ["http://x/a.jpg", "http://x/b.jpg"]
+    assert checks == {"dropped": 1, "similar": [{"post_id": "post_1", "distance": 1, "url": "http://x/b.jpg"}]}
+
+def test_dhash_survives_resizing_and_recompression(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    img = Image.new("L", (300, 200))
+    img.putdata([int(128 + 120 * math.sin(x / 40) * math.cos(y / 25)) for y in range(200) for x in range(300)])
+    img.save(tmp_path / "a.png")
+    img.resize((150, 100)).save(tmp_path / "b.jpg", "JPEG", quality=70)
+    distance = bin(imaging.dhash_image_file(str(tmp_path / "a.png")) ^ imaging.dhash_image_file(str(tmp_path / "b.jpg"))).count("1")
+    assert distance <= 6
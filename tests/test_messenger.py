@@ -0,0 +1,52 @@
+import pytest
+
+from botcore import messenger
+
+@pytest.fixture
+def replies(monkeypatch):
+    sent = []
+    monkeypatch.setattr(messenger, "send_message_to_messenger", lambda sender_id, text: sent.append((sender_id, text)))
+    monkeypatch.setattr(messenger, "prefetch_user_name", lambda sender_id: None)
+    monkeypatch.setattr(messenger.image_cache, "prefetch", lambda url: None)
+    return sent
+
+def event(sender_id, mid, timestamp, text=None, images=()):
+    message = {"mid": mid}
+    if text:
+        message["text"] = text
+    if images:
+        message["attachments"] = [{"type": "image", "payload": {"url": url}} for url in images]
+    return {"sender": {"id": sender_id}, "timestamp": timestamp, "message": message}
+
+def test_batch_processes_every_event_in_order_per_sender(replies):
+    finished = []
+    data = {"entry": [{"messaging": [
+        event("b1", "b1-2", 2, text="Lieu B"),
+        event("b1", "b1-1", 1, text="samir"),
+        event("b2", "b2-1", 1, text="samir"),
+    ]}, {"messaging": [
+        event("b1", "b1-3", 3, text="15/10/2025"),
+        event("b1", "b1-4", 4, images=["http://x/1.png", "http://x/2.png"]),
+        event("b1", "b1-5", 5, text="fin"),
+    ]}]}
+    assert messenger.handle_messenger_batch(data, lambda sender_id, buffer: finished.append(buffer)) == 6
+    assert finished[0]["lieu"] == "Lieu B" and finished[0]["photos"] == ["http://x/1.png", "http://x/2.png"]
+    assert messenger.user_buffers.get("b1")["step"] == 0
+    assert messenger.user_buffers.get("b2")["step"] == 1
+    # Redélivraison du même lot : tout est ignoré
+    assert messenger.handle_messenger_batch(data, lambda sender_id, buffer: finished.append(buffer)) == 0
+    assert len(finished) == 1
+
+def test_failed_sender_is_not_saved_and_can_be_redelivered(replies):
+    def fail(sender_id, buffer):
+        raise RuntimeError("Telegram indisponible")
+
+    messenger.user_buffers["f1"] = {**messenger.new_user_buffer(), "step": 3, "lieu": "L", "date": "15/10/2025"}
+    data = {"entry": [{"messaging": [event("f1", "f1-1", 1, text="fin"), event("f2", "f2-1", 1, text="samir")]}]}
+    with pytest.raises(RuntimeError):
+        messenger.handle_messenger_batch(data, fail)
+    assert messenger.user_buffers.get("f1")["finished"] is False
+    assert messenger.user_buffers.get("f2")["step"] == 1
+    finished = []
+    assert messenger.handle_messenger_batch(data, lambda sender_id, buffer: finished.append(sender_id)) == 1
+    assert finished == ["f1"]
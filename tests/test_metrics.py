@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from botcore import metrics as metrics_module
+from botcore.flows import run_flow, run_flow_async, tg
+from botcore.metrics import Metrics, format_metric_labels, telegram_call_label, timed_calls, timed_calls_async
+
+@pytest.fixture
+def registry(monkeypatch):
+    # Registre neuf pour chaque test : celui du module est partagé par tout le processus
+    registry = Metrics((0.1, 1))
+    monkeypatch.setattr(metrics_module, "metrics", registry)
+    return registry
+
+def test_histogram_buckets_are_cumulative(registry):
+    registry.observe("autopost_handler", 0.05, {"handler": "messenger"})
+    registry.observe("autopost_handler", 0.5, {"handler": "messenger"})
+    registry.observe("autopost_handler", 5, {"handler": "messenger"}, failed=True)
+    text = registry.render()
+    assert 'autopost_handler_seconds_bucket{handler="messenger",le="0.1"} 1' in text
+    assert 'autopost_handler_seconds_bucket{handler="messenger",le="1"} 2' in text
+    assert 'autopost_handler_seconds_bucket{handler="messenger",le="+Inf"} 3' in text
+    assert 'autopost_handler_seconds_count{handler="messenger"} 3' in text
+    assert 'autopost_handler_errors_total{handler="messenger"} 1' in text
+
+def test_timed_counts_exceptions_and_error_results(registry):
+    @registry.timed("autopost_outbound_call", call="feed_post")
+    def post(result):
+        if result is None:
+            raise ValueError("Graph")
+        return result
+
+    post({"id": "1"})
+    post({"error": {"code": 100}})
+    with pytest.raises(ValueError):
+        post(None)
+    assert 'autopost_outbound_call_errors_total{call="feed_post"} 2' in registry.render()
+
+def test_timed_wraps_coroutines(registry):
+    @registry.timed("autopost_outbound_call", call="messenger_send")
+    async def send():
+        return False
+
+    assert asyncio.run(send()) is False
+    assert 'autopost_outbound_call_errors_total{call="messenger_send"} 1' in registry.render()
+
+def test_gauges_and_label_escaping(registry):
+    text = registry.render([("autopost_drafts", "Brouillons par état", [({"state": "queued"}, 3)])])
+    assert "# TYPE autopost_drafts gauge" in text
+    assert 'autopost_drafts{state="queued"} 3' in text
+    assert format_metric_labels((("lieu", 'a"b\n'),)) == '{lieu="a\\"b\\n"}'
+
+def test_telegram_calls_are_labelled_by_bot_api_method(registry):
+    def flow():
+        yield tg.send_media_group(chat_id=1, media=[])
+        yield tg.edit_message_text(chat_id=1, message_id=2, text="x")
+
+    async def bot(step):
+        return None
+
+    assert telegram_call_label(tg.send_message(chat_id=1)) == "telegram_sendMessage"
+    run_flow(flow(), timed_calls(lambda step: None))
+    asyncio.run(run_flow_async(flow(), timed_calls_async(bot)))
+    text = registry.render()
+    assert 'autopost_outbound_call_seconds_count{call="telegram_sendMediaGroup"} 2' in text
+    assert 'autopost_outbound_call_seconds_count{call="telegram_editMessageText"} 2' in text
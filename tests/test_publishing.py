@@ -0,0 +1,119 @@
+import json
+
+import pytest
+
+from botcore import publishing
+from botcore.publishing import PublishLog, feed_batch_operation, parse_batch_item, publish_draft
+from botcore.state import MemoryStateStore
+
+def test_parse_batch_item_returns_body():
+    assert parse_batch_item({"code": 200, "body": json.dumps({"id": "123"})}) == {"id": "123"}
+
+def test_parse_batch_item_skipped_by_failed_dependency():
+    # Graph renvoie null pour une requête dont la dépendance ({result=...}) a échoué
+    assert "error" in parse_batch_item(None)
+
+def test_parse_batch_item_keeps_graph_error():
+    error = {"error": {"message": "Invalid parameter", "code": 100}}
+    assert parse_batch_item({"code": 400, "body": json.dumps(error)}) == error
+
+def test_parse_batch_item_http_error_without_error_body():
+    result = parse_batch_item({"code": 500, "body": json.dumps({"foo": 1})})
+    assert result["error"]["message"] == "HTTP 500"
+    assert result["error"]["body"] == {"foo": 1}
+
+def test_parse_batch_item_body_not_json():
+    assert parse_batch_item({"code": 502, "body": "Bad Gateway"})["error"]["message"] == "Bad Gateway"
+
+def test_feed_batch_operation_keeps_jsonpath_references():
+    op = feed_batch_operation("Lieu à Oran", ["{result=photo0:$.id}", "{result=photo1:$.id}"])
+    assert op["relative_url"].endswith("/feed")
+    assert op["body"].startswith("message=Lieu%20%C3%A0%20Oran&")
+    assert 'attached_media[1]={"media_fbid": "{result=photo1:$.id}"}' in op["body"]
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+class FakeGraph:
+    # Graph API minimale : uploads de photos, /feed (échec programmable) et lectures de vérification
+    def __init__(self):
+        self.calls = []
+        self.feed_errors = []
+        self.posts = []
+        self.stories = {}
+
+    def __call__(self, method, path, read_timeout=None, **kwargs):
+        params = kwargs.get("params", {})
+        self.calls.append((method, path))
+        if method == "POST" and path.endswith("/photos"):
+            return FakeResponse({"id": f"ph{sum(1 for m, p in self.calls if p.endswith('/photos'))}"})
+        if method == "POST" and path.endswith("/feed"):
+            if self.feed_errors:
+                error = self.feed_errors.pop(0)
+                if isinstance(error, Exception):
+                    raise error
+                return FakeResponse({"error": error})
+            self.posts.append((kwargs.get("json") or params).get("message"))
+            return FakeResponse({"id": f"post{len(self.posts)}"})
+        if method == "GET" and path.endswith("/feed"):
+            return FakeResponse({"data": [{"id": f"post{i + 1}", "message": m} for i, m in enumerate(self.posts)]})
+        if method == "GET":
+            return FakeResponse({pid: {"id": pid, "page_story_id": self.stories.get(pid)} for pid in params["ids"].split(",")})
+        return FakeResponse({"success": True})
+
+    def count(self, method, suffix):
+        return sum(1 for m, p in self.calls if m == method and p.endswith(suffix))
+
+@pytest.fixture
+def graph(monkeypatch):
+    fake = FakeGraph()
+    monkeypatch.setattr(publishing, "graph_request", fake)
+    monkeypatch.setattr(publishing, "publish_log", PublishLog(MemoryStateStore(), lock_ttl=900))
+    return fake
+
+def test_retry_reuses_uploaded_photos(graph):
+    graph.feed_errors.append(TimeoutError("read timeout"))
+    first = publish_draft("d1", "Lieu", ["http://x/1", "http://x/2"])
+    assert first["outcome_unknown"] and graph.count("POST", "/photos") == 2
+    second = publish_draft("d1", "Lieu", ["http://x/1", "http://x/2"])
+    assert second["id"] == "post1"
+    # Les photos ne sont pas renvoyées, la vérification n'a trouvé aucun post
+    assert graph.count("POST", "/photos") == 2 and graph.count("GET", "") == 1
+    assert publish_draft("d1", "Lieu", ["http://x/1", "http://x/2"]) == {"id": "post1", "resumed": True}
+    assert graph.posts == ["Lieu"]
+
+def test_lost_feed_response_returns_the_existing_post(graph):
+    graph.feed_errors.append(TimeoutError("read timeout"))
+    publish_draft("d1", "Lieu", ["http://x/1"])
+    # L'appel avait en fait abouti côté Facebook
+    graph.stories["ph1"] = "page_story"
+    assert publish_draft("d1", "Lieu", ["http://x/1"])["id"] == "page_story"
+    assert graph.count("POST", "/feed") == 1
+
+def test_text_only_retry_checks_the_page_feed(graph):
+    # Le post a été créé mais la réponse s'est perdue
+    graph.posts.append("Texte seul")
+    graph.feed_errors.append(TimeoutError("read timeout"))
+    publish_draft("d1", "Texte seul", [])
+    assert publish_draft("d1", "Texte seul", [])["id"] == "post1"
+    assert graph.posts == ["Texte seul"]
+
+def test_unverifiable_retry_is_refused(graph, monkeypatch):
+    graph.feed_errors.append(TimeoutError("read timeout"))
+    publish_draft("d1", "Texte seul", [])
+    monkeypatch.setattr(publishing, "find_existing_post", lambda record: 1 / 0)
+    assert "error" in publish_draft("d1", "Texte seul", [])
+    assert graph.count("POST", "/feed") == 1
+
+def test_only_media_errors_drop_uploaded_photos(graph):
+    graph.feed_errors.append({"code": 100, "message": "Invalid parameter: message is too long"})
+    publish_draft("d1", "Lieu", ["http://x/1"])
+    assert publishing.publish_log.get("d1")["photo_ids"] == {"http://x/1": "ph1"}
+    graph.feed_errors.append({"code": 100, "message": "(#100) Invalid media_fbid: ph1"})
+    publish_draft("d1", "Lieu", ["http://x/1"])
+    assert publishing.publish_log.get("d1")["photo_ids"] == {}
+    assert graph.count("DELETE", "ph1") == 1
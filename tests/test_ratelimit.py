@@ -0,0 +1,95 @@
+import json
+
+import pytest
+from telegram.error import RetryAfter
+
+from botcore import ratelimit
+from botcore.flows import run_flow, tg
+from botcore.ratelimit import RateLimiter, TokenBucket, observe_graph_response, rate_limited, telegram_cost
+
+@pytest.fixture(autouse=True)
+def limiter(monkeypatch):
+    # Seaux neufs pour chaque test : le limiteur du module est partagé par tout le processus
+    limiter = RateLimiter({"graph": (10, 2), "telegram": (1, 2), ("telegram", "global"): (100, 100)})
+    monkeypatch.setattr(ratelimit, "rate_limiter", limiter)
+    return limiter
+
+def test_token_bucket_spends_burst_then_waits():
+    bucket = TokenBucket(rate=2, capacity=2)
+    now = bucket.updated
+    assert bucket.reserve(1, now) == 0
+    assert bucket.reserve(1, now) == 0
+    # Seau vide : le jeton suivant arrive dans 1 / rate secondes
+    assert bucket.reserve(1, now) == pytest.approx(0.5)
+    # Une seconde plus tard, deux jetons sont revenus, dont un déjà réservé
+    assert bucket.reserve(1, now + 1) == 0
+
+def test_token_bucket_honours_block_and_recovers_rate():
+    bucket = TokenBucket(rate=10, capacity=10)
+    now = bucket.updated
+    bucket.blocked_until = now + 5
+    bucket.factor = 0.5
+    assert bucket.reserve(1, now) == pytest.approx(5)
+    bucket.reserve(0, now + 20)
+    assert bucket.factor == pytest.approx(0.7)
+
+def test_throttle_and_usage_headers_slow_the_bucket(limiter):
+    limiter.throttle("graph", "page", 30)
+    assert limiter.reserve("graph", "page") == pytest.approx(30, abs=0.1)
+    limiter.observe_usage("graph", "app", 50)
+    limiter.observe_usage("graph", "other", 90)
+    slowed = limiter.snapshot()["slowed"]
+    assert "graph:app" not in slowed
+    assert slowed["graph:page"]["factor"] == 0.5
+    assert slowed["graph:other"]["factor"] == 0.4
+
+class FakeResponse:
+    def __init__(self, status_code, payload, headers):
+        self.status_code = status_code
+        self.payload = payload
+        self.headers = headers
+
+    def json(self):
+        return self.payload
+
+def test_graph_throttling_error_asks_for_a_retry(limiter):
+    ok = FakeResponse(200, {"id": "1"}, {"X-App-Usage": json.dumps({"call_count": 95, "total_time": 10})})
+    assert observe_graph_response(ok) is None
+    assert limiter.snapshot()["slowed"]["graph:app"]["factor"] == 0.2
+    throttled = FakeResponse(400, {"error": {"code": 4}}, {"Retry-After": "12"})
+    assert observe_graph_response(throttled) == 12
+    assert observe_graph_response(FakeResponse(400, {"error": {"code": 100}}, {})) is None
+
+def test_album_costs_one_token_per_photo():
+    assert telegram_cost({"chat_id": 1, "media": ["a", "b", "c"]}) == 3
+    assert telegram_cost({"chat_id": 1, "text": "x"}) == 1
+
+def test_rate_limited_client_replays_after_retry_after(tmp_path):
+    photo = open(tmp_path / "photo.jpg", "w+b")
+    photo.write(b"jpeg")
+    calls = []
+
+    def bot(step):
+        calls.append(step.kwargs["photo"].read())
+        if len(calls) == 1:
+            raise RetryAfter(0)
+        return "sent"
+
+    def flow():
+        return (yield tg.send_photo(chat_id=1, photo=photo))
+
+    photo.seek(0)
+    assert run_flow(flow(), rate_limited(bot)) == "sent"
+    # Le fichier lu par l'appel refusé est rembobiné avant le nouvel essai
+    assert calls == [b"jpeg", b"jpeg"]
+    photo.close()
+
+def test_rate_limited_client_gives_up_on_long_waits():
+    def bot(step):
+        raise RetryAfter(3600)
+
+    def flow():
+        yield tg.send_message(chat_id=1, text="x")
+
+    with pytest.raises(RetryAfter):
+        run_flow(flow(), rate_limited(bot))
@@ -0,0 +1,74 @@
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from botcore.scheduler import PublishQueue, PublishScheduler
+from botcore.state import Lease, MemoryStateStore
+
+def local(day, hour, minute=0):
+    return time.mktime((2025, 10, day, hour, minute, 0, 0, 0, -1))
+
+@pytest.fixture
+def store():
+    return MemoryStateStore()
+
+def test_slots_apply_spacing_and_hourly_cap(store):
+    queue = PublishQueue(store, spacing=60, max_per_hour=3, quiet_hours=())
+    now = local(15, 12)
+    store.set("publish_history", "releases", [now - 30])
+    # 30 s depuis la dernière sortie : 30 s d'attente, puis 60 s entre chaque post ;
+    # le 4e attend qu'une sortie quitte l'heure glissante
+    assert queue.slots(4, now) == [now + 30, now + 90, now + 3570, now + 3630]
+
+def test_after_quiet_hours_across_midnight(store):
+    queue = PublishQueue(store, spacing=0, max_per_hour=0, quiet_hours=(23, 7))
+    assert queue.after_quiet_hours(local(15, 12)) == local(15, 12)
+    assert queue.after_quiet_hours(local(15, 23, 30)) == local(16, 7)
+    assert queue.after_quiet_hours(local(16, 3)) == local(16, 7)
+
+def test_after_quiet_hours_within_the_day(store):
+    queue = PublishQueue(store, spacing=0, max_per_hour=0, quiet_hours=(12, 14))
+    assert queue.after_quiet_hours(local(15, 13, 15)) == local(15, 14)
+    assert queue.after_quiet_hours(local(15, 14)) == local(15, 14)
+
+def test_pop_due_releases_in_order_and_hands_far_slots_to_graph(store):
+    queue = PublishQueue(store, spacing=900, max_per_hour=0, quiet_hours=(), schedule_lead=660)
+    queue.push("a", 42, 1, False)
+    queue.push("b", 42, 2, True)
+    now = time.time()
+    first = queue.pop_due(now)
+    assert first["draft_id"] == "a" and first["scheduled_time"] is None
+    # Sortie suivante dans 15 min : programmée côté Graph plutôt qu'attendue ici
+    second = queue.pop_due(now + 1)
+    assert second["draft_id"] == "b" and second["scheduled_time"] == pytest.approx(now + 900)
+    assert queue.pop_due(now + 2) is None and len(queue) == 0
+
+def test_pop_due_waits_for_near_slots(store):
+    queue = PublishQueue(store, spacing=120, max_per_hour=0, quiet_hours=(), schedule_lead=660)
+    store.set("publish_history", "releases", [time.time()])
+    queue.push("a", 42, 1, False)
+    assert queue.pop_due(time.time()) is None
+    assert queue.position("a")[0] == 1
+
+def test_scheduler_restores_an_entry_it_could_not_release(store):
+    queue = PublishQueue(store, spacing=0, max_per_hour=0, quiet_hours=())
+    scheduler = PublishScheduler(queue, Lease(store, "publish_scheduler", 60), interval=1)
+    queue.push("a", 42, 1, False)
+    released = []
+
+    def release(entry):
+        if not released:
+            released.append(None)
+            raise RuntimeError("Boucle Telegram non démarrée")
+        released.append(entry["draft_id"])
+        job = Future()
+        job.set_result(None)
+        return job
+
+    scheduler.release, scheduler.on_released = release, lambda: None
+    with pytest.raises(RuntimeError):
+        scheduler.tick()
+    assert len(queue) == 1
+    assert scheduler.tick() and released == [None, "a"]
+    assert not scheduler.tick()
@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+from botcore import images
+from botcore.flows import run_flow
+from botcore.startup import Readiness, WebhookRegistration
+from botcore.state import MemoryStateStore
+
+class FakeTelegram:
+    def __init__(self, url=""):
+        self.url = url
+        self.calls = []
+
+    def __call__(self, step):
+        self.calls.append(step.method)
+        if step.method == "get_webhook_info":
+            return {"url": self.url}
+        self.url = step.kwargs["url"]
+        return True
+
+@pytest.fixture
+def store():
+    return MemoryStateStore()
+
+def registration(store, deployment="d1", ttl=3600):
+    return WebhookRegistration(store, "https://bot/telegram-webhook", deployment, ttl, 30)
+
+def test_registers_once_per_deployment(store):
+    telegram = FakeTelegram()
+    assert run_flow(registration(store).register(), telegram) is True
+    assert telegram.calls == ["get_webhook_info", "set_webhook"]
+    # Autre worker ou redémarrage du même déploiement : le marqueur suffit
+    assert run_flow(registration(store).register(), telegram) is True
+    assert telegram.calls == ["get_webhook_info", "set_webhook"]
+    # Nouveau déploiement : on relit getWebhookInfo, sans setWebhook si l'URL est déjà la bonne
+    assert run_flow(registration(store, deployment="d2").register(), telegram) is True
+    assert telegram.calls == ["get_webhook_info", "set_webhook", "get_webhook_info"]
+
+def test_stale_marker_is_checked_again(store):
+    telegram = FakeTelegram("https://bot/telegram-webhook")
+    store.set("deployment", "telegram_webhook", {
+        "url": "https://bot/telegram-webhook", "deployment": "d1", "registered_at": time.time() - 7200
+    })
+    assert run_flow(registration(store).register(), telegram) is True
+    assert telegram.calls == ["get_webhook_info"]
+
+def test_only_the_lease_holder_talks_to_telegram(store):
+    holder = registration(store)
+    assert holder.lease.acquire()
+    telegram = FakeTelegram()
+    assert run_flow(registration(store).register(), telegram) is False
+    assert telegram.calls == []
+
+def test_readiness_waits_for_required_checks(monkeypatch):
+    monkeypatch.setattr("botcore.startup.IMAGE_NORMALIZE", False)
+    readiness = Readiness()
+    polling = []
+    readiness.require("telegram_polling", lambda: bool(polling))
+    assert readiness.status()["ready"] is False
+    readiness._run()
+    assert readiness.status()["ready"] is False
+    polling.append(True)
+    assert readiness.status()["ready"] is True
+
+def test_warm_up_starts_every_image_process(monkeypatch):
+    pytest.importorskip("PIL.Image")
+    monkeypatch.setattr(images, "IMAGE_NORMALIZE_WORKERS", 2)
+    monkeypatch.setattr(images, "_image_workers", None)
+    try:
+        assert len(images.warm_up_image_workers()) == 2
+    finally:
+        images.get_image_workers().shutdown()
@@ -0,0 +1,175 @@
+import time
+import threading
+
+import pytest
+
+from botcore.state import DraftRegistry, Lease, MemoryStateStore, RecentIds, SQLiteStateStore, StateMap, compare_and_update
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteStateStore(str(tmp_path / "state.sqlite3"), cache_size=100)
+    return MemoryStateStore()
+
+def test_get_returns_a_copy(store):
+    store.set("ns", "k", {"photos": ["a"]})
+    value = store.get("ns", "k")
+    value["photos"].append("b")
+    assert store.get("ns", "k") == {"photos": ["a"]}
+
+def test_add_only_inserts_missing_keys(store):
+    assert store.add("ns", "k", 1)
+    assert not store.add("ns", "k", 2)
+    assert store.get("ns", "k") == 1
+
+def test_replace_is_compare_and_set(store):
+    store.set("ns", "k", [1])
+    assert not store.replace("ns", "k", [2], [3])
+    assert store.replace("ns", "k", [1], [1, 2])
+    assert store.get("ns", "k") == [1, 2]
+    assert not store.replace("ns", "absent", None, 1)
+
+def test_compare_and_update_creates_then_updates(store):
+    append = lambda ids: (ids or []) + ["x"]
+    assert compare_and_update(store, "ns", "k", append) == ["x"]
+    assert compare_and_update(store, "ns", "k", append) == ["x", "x"]
+    # Valeur inchangée : aucune écriture
+    assert compare_and_update(store, "ns", "k", lambda ids: ids) == ["x", "x"]
+
+def test_compare_and_update_replays_on_concurrent_write(store):
+    store.set("ns", "k", [1])
+    calls = []
+
+    def update(ids):
+        calls.append(list(ids))
+        if len(calls) == 1:
+            # Écriture d'un autre worker entre la lecture et le compare-and-set
+            store.set("ns", "k", [1, 2])
+        return ids + [3]
+
+    assert compare_and_update(store, "ns", "k", update) == [1, 2, 3]
+    assert calls == [[1], [1, 2]]
+
+def test_compare_and_update_keeps_every_concurrent_append(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    # Un store par thread, comme des workers distincts sur la même base
+    stores = [SQLiteStateStore(path, cache_size=100) for _ in range(4)]
+
+    def worker(store, n):
+        for i in range(25):
+            compare_and_update(store, "ns", "ids", lambda ids: (ids or []) + [f"{n}-{i}"])
+
+    threads = [threading.Thread(target=worker, args=(s, n)) for n, s in enumerate(stores)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(stores[0].get("ns", "ids")) == 100
+
+def test_state_map_views_one_namespace(store):
+    buffers = StateMap(store, "user_buffers")
+    buffers["42"] = {"step": 1}
+    store.set("other", "42", {"step": 9})
+    assert "42" in buffers and len(buffers) == 1
+    assert dict(buffers.items()) == {"42": {"step": 1}}
+    assert buffers.pop("42") == {"step": 1}
+    assert buffers.get("42") is None
+
+def test_count_by_groups_values_in_one_pass(store):
+    store.set("drafts", "1", {"state": "pending"})
+    store.set("drafts", "2", {"state": "queued"})
+    store.set("drafts", "3", {"state": "pending"})
+    store.set("drafts", "4", {"photos": []})
+    store.set("other", "1", {"state": "pending"})
+    assert store.count_by("drafts", "state") == {"pending": 2, "queued": 1, None: 1}
+    assert store.count_by("empty", "state") == {}
+
+def test_draft_registry_indexes_messages_and_states(store):
+    drafts = DraftRegistry(store)
+    draft = drafts.create(["a", "b"], "Lieu", "15/10/2025", "Samir", "s1")
+    drafts.attach_messages(draft, [10, 11, 12])
+    assert drafts.by_msg(11)["id"] == draft["id"]
+    assert [d["id"] for d in drafts.by_state("awaiting")] == [draft["id"]]
+
+    draft["state"] = "editing_lieu"
+    drafts.save(draft)
+    assert drafts.by_state("awaiting") == []
+    assert drafts.by_msg(10)["state"] == "editing_lieu"
+
+    drafts.remove(draft)
+    assert drafts.by_msg(12) is None
+    assert drafts.by_state("editing_lieu") == [] and len(drafts) == 0
+
+def test_expire_drops_idle_then_least_recent_entries(store):
+    for key in ["a", "b", "c", "d", "a"]:
+        store.set("ns", key, key)
+        time.sleep(0.01)
+    # Aucune entrée inactive : seules les plus anciennes écritures au-delà de 2 partent
+    assert sorted(key for key, _ in store.expire("ns", 3600, 2)) == ["b", "c"]
+    assert sorted(store.keys("ns")) == ["a", "d"]
+    assert sorted(key for key, _ in store.expire("ns", -1, 10)) == ["a", "d"]
+    assert store.count("ns") == 0
+
+def test_draft_registry_expire_cleans_indexes(store):
+    drafts = DraftRegistry(store)
+    draft = drafts.create([], "Lieu", "15/10/2025", "Samir", "s1")
+    drafts.attach_messages(draft, [10])
+    assert [d["id"] for d in drafts.expire(-1, 10)] == [draft["id"]]
+    assert drafts.by_msg(10) is None and drafts.by_state("awaiting") == []
+
+@pytest.fixture(params=["local", "shared"])
+def recent_store(request, tmp_path):
+    if request.param == "shared":
+        return SQLiteStateStore(str(tmp_path / "state.sqlite3"), cache_size=100)
+    return None
+
+def test_recent_ids_drops_repeats_within_the_window(recent_store):
+    ids = RecentIds("seen", window=3600, max_entries=100, store=recent_store)
+    assert not ids.seen("m1")
+    assert ids.seen("m1")
+    assert not ids.seen("m2")
+    assert not ids.seen(None) and not ids.seen(None)
+    assert len(ids) == 2
+
+def test_recent_ids_forget_lets_a_redelivery_through(recent_store):
+    ids = RecentIds("seen", window=3600, max_entries=100, store=recent_store)
+    assert not ids.seen(42)
+    ids.forget(42)
+    assert not ids.seen(42)
+    assert ids.seen(42)
+
+def test_recent_ids_evicts_oldest_beyond_the_cap():
+    ids = RecentIds("seen", window=3600, max_entries=2)
+    for key in ["a", "b", "c"]:
+        ids.seen(key)
+    # "a" est sorti de l'index : il repasse comme nouveau
+    assert not ids.seen("a")
+    assert ids.seen("c")
+
+def test_recent_ids_renews_stale_entries_once(tmp_path):
+    store = SQLiteStateStore(str(tmp_path / "state.sqlite3"), cache_size=100)
+    ids = RecentIds("seen", window=60, max_entries=100, store=store)
+    store.set("seen", "m1", time.time() - 120)
+    other_worker = RecentIds("seen", window=60, max_entries=100, store=SQLiteStateStore(store.path, cache_size=100))
+    assert not ids.seen("m1")
+    assert other_worker.seen("m1")
+
+def test_lease_is_exclusive_until_it_expires(store):
+    first = Lease(store, "scheduler", ttl=60)
+    # Chaque instance a son propre propriétaire, comme deux workers distincts
+    second = Lease(store, "scheduler", ttl=60)
+    assert first.acquire()
+    assert first.acquire()
+    assert not second.acquire()
+    store.set("leases", "scheduler", {"owner": first.owner(), "until": time.time() - 1})
+    assert second.acquire()
+    assert not first.acquire()
+
+def test_lease_release_only_by_its_owner(store):
+    lease = Lease(store, "scheduler", ttl=60)
+    other = Lease(store, "scheduler", ttl=60)
+    assert lease.acquire()
+    other.release()
+    assert store.get("leases", "scheduler")["owner"] == lease.owner()
+    lease.release()
+    assert other.acquire()
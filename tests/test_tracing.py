@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from botcore import tracing
+from botcore.flows import run_flow, tg
+from botcore.metrics import timed_calls
+from botcore.tracing import SlowTraceLog, Span, traced
+
+@pytest.fixture
+def traces(monkeypatch, tmp_path):
+    # Seuil nul : toutes les traces sont écrites
+    log = SlowTraceLog(str(tmp_path / "traces.jsonl"), 1e-9)
+    monkeypatch.setattr(tracing, "slow_traces", log)
+
+    def read():
+        with open(log.path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+    return read
+
+def test_child_span_without_trace_does_nothing(traces):
+    with Span("feed_post") as span:
+        pass
+    assert span.trace is None
+
+def test_spans_nest_under_the_request_root(traces):
+    @traced("receive")
+    def receive():
+        with Span("feed_post"):
+            pass
+
+    receive()
+    (trace,) = traces()
+    assert trace["root"] == "receive"
+    spans = {span["name"]: span for span in trace["spans"]}
+    assert spans["feed_post"]["parent"] == spans["receive"]["id"]
+
+def test_traced_flow_keeps_its_span_across_yields(traces):
+    @traced("publish_job", detached=True)
+    def job():
+        yield tg.send_message(chat_id=1, text="a")
+        yield tg.edit_message_text(chat_id=1, message_id=2, text="b")
+
+    with Span("receive", root=True):
+        run_flow(job(), timed_calls(lambda step: None))
+    job_trace, request_trace = traces()
+    # Job détaché : sa propre trace, avec les appels Telegram faits pour lui
+    assert job_trace["root"] == "publish_job"
+    assert [span["name"] for span in job_trace["spans"]] == ["publish_job", "telegram_sendMessage", "telegram_editMessageText"]
+    assert [span["name"] for span in request_trace["spans"]] == ["receive"]
+
+def test_errors_are_recorded_on_the_span(traces):
+    @traced("submit_draft")
+    def submit():
+        raise ValueError("Graph")
+
+    with pytest.raises(ValueError):
+        submit()
+    assert traces()[0]["spans"][0]["error"] == "ValueError('Graph')"
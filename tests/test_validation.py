@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+from telegram.error import BadRequest
+
+from botcore import validation
+from botcore.flows import run_flow
+
+class FakeBot:
+    # Enregistre les appels et renvoie un message dont l'identifiant augmente
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, call):
+        self.calls.append((call.method, call.kwargs))
+        if call.method == "send_media_group":
+            return [SimpleNamespace(message_id=100 + i) for i in range(len(call.kwargs["media"]))]
+        return SimpleNamespace(message_id=200 + len(self.calls))
+
+def new_draft(photos):
+    return validation.create_draft("s1", {"photos": photos, "lieu": "Lieu", "date": "15/10/2025"}, "Samir")
+
+def test_removing_the_captioned_photo_moves_the_text_to_the_next_one():
+    bot = FakeBot()
+    draft = new_draft(["http://x/1.png", "http://x/2.png", "http://x/3.png"])
+    run_flow(validation.telegram_post_message_for_validation(draft), bot)
+    bot.calls.clear()
+
+    run_flow(validation.remove_preview_photo(draft, 0), bot)
+    assert [method for method, kwargs in bot.calls] == ["delete_message", "edit_message_caption"]
+    assert bot.calls[0][1]["message_id"] == 100 and bot.calls[1][1]["message_id"] == 101
+    draft = validation.validation_buffers.by_msg(101)
+    assert draft["photos"] == ["http://x/2.png", "http://x/3.png"]
+    assert draft["preview"]["photo_msg_ids"] == [101, 102]
+    validation.validation_buffers.remove(draft)
+
+def test_removing_the_only_photo_replaces_it_with_a_text_message():
+    bot = FakeBot()
+    draft = new_draft(["http://x/1.png"])
+    run_flow(validation.telegram_post_message_for_validation(draft), bot)
+    bot.calls.clear()
+
+    (msg_id,) = run_flow(validation.remove_preview_photo(draft, 0), bot)
+    assert [method for method, kwargs in bot.calls] == ["send_message", "delete_message"]
+    assert validation.validation_buffers.by_msg(msg_id)["preview"]["control_msg_id"] == msg_id
+    validation.validation_buffers.remove(draft)
+
+class PhotoBot(FakeBot):
+    # Renvoie un file_id par photo ; les file_id commençant par "stale" sont refusés
+    def __call__(self, call):
+        self.calls.append((call.method, call.kwargs))
+        media = [m.media for m in call.kwargs["media"]] if call.method == "send_media_group" else [call.kwargs["photo"]]
+        if any(str(m).startswith("stale") for m in media):
+            raise BadRequest("Wrong file identifier/http url specified")
+        msgs = [SimpleNamespace(message_id=300 + i, photo=[SimpleNamespace(file_id=f"id-{m}")]) for i, m in enumerate(media)]
+        return msgs if call.method == "send_media_group" else msgs[0]
+
+def test_file_ids_are_reused_and_stale_ones_dropped():
+    bot = PhotoBot()
+    urls = ["http://x/a.png", "http://x/b.png"]
+    send = lambda media: validation.tg.send_media_group(chat_id=42, media=[SimpleNamespace(media=m) for m in media])
+    run_flow(validation.send_with_file_ids({}, urls, send), bot)
+    run_flow(validation.send_with_file_ids({}, urls, send), bot)
+    assert [m.media for m in bot.calls[1][1]["media"]] == ["id-http://x/a.png", "id-http://x/b.png"]
+
+    validation.telegram_file_ids.remember(urls[0], "stale-a")
+    run_flow(validation.send_with_file_ids({}, urls, send), bot)
+    assert [m.media for m in bot.calls[-1][1]["media"]] == urls
+    assert validation.telegram_file_ids.get(urls[0]) == "id-http://x/a.png"